@@ -0,0 +1,179 @@
+"""
+Clean-up of abandoned bookings for the 'autoR5' Django web application.
+
+Every submitted booking form creates a Pending 'Booking' and 'Payment'
+before the customer reaches the payment page. Bookings that are never
+paid keep holding their car for the requested dates and pile up in the
+tables every booking and payment query reads.
+
+- 'time' for measuring throughput.
+- 'timedelta' from 'datetime' for the time-to-live.
+- 'stripe' for canceling the PaymentIntents of reaped bookings.
+- 'settings' from 'django.conf' for the Stripe key and the time-to-live
+    setting.
+- 'transaction' from 'django.db' for applying each batch atomically.
+- 'Exists' and 'OuterRef' from 'django.db.models' for skipping
+    bookings with a successful payment.
+- 'timezone' from 'django.utils' for the current time.
+- 'intent_id_from' from '.payments' for the intent of a payment.
+- 'Booking' and 'Payment' from '.models' for accessing the data.
+
+Usage:
+'reap_abandoned_bookings' (run by the 'reap_pending_bookings'
+management command) cancels, or deletes, Pending bookings older than
+'PENDING_BOOKING_TTL' whose checkout hold has lapsed and that have no
+successful payment. Canceling a booking releases its dates, since only
+Pending and Confirmed bookings hold a car. Bookings without a hold
+expiry are left alone: the webhook clears it once Stripe reports the
+payment as processing, and such a payment may still succeed. Bookings
+made before holds existed got one in migration 0025.
+
+The PaymentIntent of every abandoned payment is canceled on Stripe
+first, so the customer can no longer be charged for a released booking.
+When Stripe refuses (the payment is processing or already succeeded),
+the booking is skipped and its outcome is left to the webhook, which
+refunds a payment succeeding on a reaped booking.
+
+The reaper is safe to run next to live checkouts. The Stripe calls of a
+batch are made before its transaction starts, so no row stays locked
+during a network round trip. The transaction then locks the bookings
+that are still abandoned and their payments with 'SKIP LOCKED' (where
+the database supports it), so a booking whose payment is being updated
+by the Stripe webhook is left for the next run, and every 'UPDATE'
+re-checks the status it expects. A booking whose hold is renewed after
+its intent was canceled is not reaped here; the 'canceled' webhook of
+its intent cancels it instead.
+"""
+import time
+from datetime import timedelta
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from .payments import intent_id_from
+from .models import Booking, Payment
+
+# Age, in seconds, after which an unpaid Pending booking is abandoned.
+PENDING_BOOKING_TTL = getattr(settings, 'PENDING_BOOKING_TTL', 2 * 60 * 60)
+
+# Payment statuses of a booking that was never paid.
+UNPAID_STATUSES = ('Pending', 'Failed')
+
+
+def abandoned_bookings(cutoff, now=None):
+    """
+    Return the Pending bookings created before 'cutoff' whose hold
+    lapsed before 'now', without a payment in any other status than
+    'UNPAID_STATUSES'.
+    """
+    settled = Payment.objects.filter(booking=OuterRef('pk')).exclude(
+        payment_status__in=UNPAID_STATUSES)
+    return Booking.objects.filter(
+        status='Pending', created_at__lt=cutoff,
+        hold_expires_at__lt=now or timezone.now()).exclude(Exists(settled))
+
+
+def cancel_intent(payment_intent):
+    """
+    Cancel the PaymentIntent of a reaped payment.
+
+    Returns:
+    True when the intent is canceled or the payment has none, False
+    when Stripe refused, for example because the payment is processing
+    or already succeeded.
+    """
+    if not payment_intent:
+        return True
+    try:
+        stripe.PaymentIntent.cancel(intent_id_from(payment_intent))
+    except stripe.error.StripeError:
+        return False
+    return True
+
+
+def reap_abandoned_bookings(ttl=None, batch_size=500, delete=False,
+                            now=None):
+    """
+    Cancel or delete abandoned Pending bookings in batches.
+
+    Args:
+    - 'ttl': The age in seconds after which a booking is abandoned.
+    Defaults to 'PENDING_BOOKING_TTL'.
+    - 'batch_size': The maximum number of bookings per batch.
+    - 'delete': Delete the bookings and their payments instead of
+    marking them 'Canceled'.
+    - 'now': The current time, for tests.
+
+    Returns:
+    A dictionary with the number of reaped 'bookings' and 'payments',
+    the bookings 'skipped' because another transaction held them or
+    Stripe refused to cancel their PaymentIntent, the
+    number of 'batches', the 'elapsed' seconds and the throughput in
+    bookings 'per_second'.
+    """
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    now = now or timezone.now()
+    ttl = PENDING_BOOKING_TTL if ttl is None else ttl
+    cutoff = now - timedelta(seconds=ttl)
+    started = time.monotonic()
+    results = {'bookings': 0, 'payments': 0, 'skipped': 0, 'batches': 0}
+    last_id = 0
+
+    while True:
+        booking_ids = list(
+            abandoned_bookings(cutoff, now).filter(id__gt=last_id)
+            .order_by('id').values_list('id', flat=True)[:batch_size])
+        if not booking_ids:
+            break
+        last_id = booking_ids[-1]
+
+        # Stripe is called before any row is locked, so live checkouts
+        # and webhooks never wait on its network round trips.
+        refused = {
+            booking_id for booking_id, payment_intent in
+            Payment.objects.filter(
+                booking_id__in=booking_ids,
+                payment_status__in=UNPAID_STATUSES)
+            .values_list('booking_id', 'payment_intent')
+            if not cancel_intent(payment_intent)}
+
+        with transaction.atomic():
+            candidates = list(
+                abandoned_bookings(cutoff, now)
+                .filter(pk__in=booking_ids).exclude(pk__in=refused)
+                .select_for_update(skip_locked=True)
+                .values_list('id', flat=True))
+            payments = dict(
+                Payment.objects.filter(booking_id__in=candidates)
+                .values_list('id', 'booking_id'))
+            locked = set(
+                Payment.objects.filter(pk__in=payments)
+                .select_for_update(skip_locked=True)
+                .filter(payment_status__in=UNPAID_STATUSES)
+                .values_list('id', flat=True))
+            busy = {booking_id for payment_id, booking_id in payments.items()
+                    if payment_id not in locked}
+            reaped = [booking_id for booking_id in candidates
+                      if booking_id not in busy]
+            results['skipped'] += len(booking_ids) - len(reaped)
+
+            payments = Payment.objects.filter(
+                booking_id__in=reaped, payment_status__in=UNPAID_STATUSES)
+            bookings = Booking.objects.filter(
+                pk__in=reaped, status='Pending')
+            if delete:
+                results['payments'] += payments.delete()[0]
+                results['bookings'] += bookings.delete()[1].get(
+                    Booking._meta.label, 0)
+            else:
+                results['payments'] += payments.update(
+                    payment_status='Canceled')
+                results['bookings'] += bookings.update(status='Canceled')
+        results['batches'] += 1
+
+    results['elapsed'] = time.monotonic() - started
+    results['per_second'] = (
+        results['bookings'] / results['elapsed']
+        if results['elapsed'] else 0)
+    return results
@@ -6,23 +6,33 @@ media storage, geolocation services, Django admin, URL routing, rendering web
 pages, managing HTTP responses, form handling, and database models.
 
 It also imports various models related to car bookings, reviews, user profiles,
-payments, cancellation requests, and contact form submissions.
+payments, cancellation requests, background import and geocoding jobs, and
+contact form submissions.
 """
-import csv
-import cloudinary
-import cloudinary.api
-import cloudinary.uploader
-from geopy.geocoders import Nominatim
+import os
+from datetime import timedelta
 from django.contrib import admin
 from django.urls import path
 from django.shortcuts import render
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import (HttpResponseRedirect, FileResponse, Http404,
+                         JsonResponse)
 from django.urls import reverse
 from django.contrib import messages
+from django.core.exceptions import PermissionDenied
+from django.utils import timezone
+from django.utils.html import format_html
 from .forms import CsvImportForm
+from .availability import available_cars, booked_cars
+from .car_import import import_cars
+from .exports import (BOOKING_EXPORT, CAR_EXPORT, PAYMENT_EXPORT,
+                      export_response)
+from .geocoding import queue_geocoding
+from .import_jobs import IMPORT_INLINE_MAX_BYTES, queue_import
+from .refunds import approve_cancellation_requests
 from .models import (
     Car, Booking, Review, UserProfile,
-    Payment, CancellationRequest, ContactFormSubmission
+    Payment, CancellationRequest, RefundJob, ImportJob, GeocodeJob,
+    ContactFormSubmission
 )
 
 
@@ -31,11 +41,11 @@ def update_location(modeladmin, request, queryset):
     Update the location details of selected cars based on their latitude and
     longitude.
 
-    This function takes a queryset of cars and retrieves location information
-    (city and full address) based on their latitude and longitude coordinates.
-    It uses the Nominatim geocoding service to reverse-geocode the coordinates
-    and updates the 'location_city' and 'location_address' fields of each car
-    in the queryset.
+    This function queues a geocoding job for the selected cars. The
+    'process_geocoding' worker reverse-geocodes their coordinates at a
+    limited rate, reusing the cached results of points it has already
+    looked up, and updates the 'location_city' and 'location_address'
+    fields of the cars in batches (see 'autoR5.geocoding').
 
     Args:
         queryset: A QuerySet of car objects to update.
@@ -44,17 +54,71 @@ def update_location(modeladmin, request, queryset):
         None
 
     """
-    geolocator = Nominatim(user_agent="autoR5")
-    for car in queryset:
-        location = geolocator.reverse([car.latitude, car.longitude])
-        car.location_city = location.raw['address']['city']
-        car.location_address = location.address
-        car.save()
+    job = queue_geocoding(queryset.values_list('id', flat=True),
+                          request.user)
+    messages.info(request, format_html(
+        'Queued {} car(s) for geocoding. <a href="{}">Follow the job</a>.',
+        job.cars.count(),
+        reverse('admin:autoR5_geocodejob_change', args=[job.pk])))
 
 
 update_location.short_description = 'Update Location'
 
 
+def approve_requests(modeladmin, request, queryset):
+    """
+    Approve the selected cancellation requests in one transaction.
+
+    Unpaid bookings are canceled at once and refunds of paid ones are
+    queued for the 'process_refunds' worker. A summary of the outcomes
+    is shown as an admin message.
+
+    Args:
+        queryset: A QuerySet of cancellation requests to approve.
+
+    Returns:
+        None
+    """
+    results = approve_cancellation_requests(
+        queryset.values_list('id', flat=True))
+    summary = {}
+    for outcome in results.values():
+        summary[outcome] = summary.get(outcome, 0) + 1
+    messages.success(request, 'Approved cancellation requests: ' + ', '.join(
+        f"{count} {outcome.replace('_', ' ')}"
+        for outcome, count in sorted(summary.items())))
+
+
+approve_requests.short_description = 'Approve selected requests'
+
+
+class AvailabilityListFilter(admin.SimpleListFilter):
+    """
+    Admin list filter splitting cars into free and booked for today.
+
+    The filter delegates to the availability engine, so the admin sees
+    exactly the same picture as customers booking through 'book_car'.
+    """
+    title = 'availability today'
+    parameter_name = 'availability'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('free', 'Free today'),
+            ('booked', 'Booked today'),
+        )
+
+    def queryset(self, request, queryset):
+        start = timezone.localtime().replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        end = start + timedelta(days=1)
+        if self.value() == 'free':
+            return available_cars(start, end, queryset)
+        if self.value() == 'booked':
+            return booked_cars(start, end, queryset)
+        return queryset
+
+
 class CarAdmin(admin.ModelAdmin):
     """
     Admin configuration for the Car model.
@@ -65,7 +129,8 @@ class CarAdmin(admin.ModelAdmin):
                     'car_type', 'fuel_type')
 
     list_filter = ('make', 'model', 'year', 'is_available',
-                   'location_city', 'car_type', 'fuel_type')
+                   AvailabilityListFilter, 'location_city',
+                   'car_type', 'fuel_type')
 
     search_fields = ('make', 'model', 'year',
                      'location_city', 'car_type', 'fuel_type')
@@ -75,8 +140,10 @@ class CarAdmin(admin.ModelAdmin):
     def get_urls(self):
         urls = super().get_urls()
         new_urls = [
-            path('import_csv/', self.import_csv, name='import_csv'),
-            path('export_csv/', self.export_csv, name='export_csv'),
+            path('import_csv/', self.admin_site.admin_view(self.import_csv),
+                 name='import_csv'),
+            path('export_csv/', self.admin_site.admin_view(self.export_csv),
+                 name='export_csv'),
         ]
 
         return new_urls + urls
@@ -84,6 +151,14 @@ class CarAdmin(admin.ModelAdmin):
     def import_csv(self, request):
         """
         Import data from a CSV file and update or create Car objects.
+
+        The file is parsed and written in batches by
+        'autoR5.car_import.import_cars'; the admin is told how many
+        cars were created and updated and which rows were skipped.
+        Files larger than 'IMPORT_INLINE_MAX_BYTES', or any file when
+        asked to, are queued as an 'ImportJob' for the
+        'process_imports' worker instead, and the admin is sent to the
+        job's page.
         """
         if request.method == "POST":
             form = CsvImportForm(request.POST, request.FILES)
@@ -95,62 +170,30 @@ class CarAdmin(admin.ModelAdmin):
                     messages.error(
                         request,
                         'Invalid file format. Please upload a CSV file.')
+                elif (form.cleaned_data['background'] or
+                      csv_file.size > IMPORT_INLINE_MAX_BYTES):
+                    job = queue_import(csv_file, request.user)
+                    messages.info(
+                        request,
+                        'The CSV file was queued and will be imported '
+                        'in the background.')
+                    return HttpResponseRedirect(reverse(
+                        'admin:autoR5_importjob_change', args=[job.pk]))
                 else:
-                    file_data = csv_file.read().decode("utf-8")
-                    csv_data = file_data.split("\n")
-
-                    for i, row in enumerate(csv_data):
-                        # Skip the first row (header)
-                        if i == 0:
-                            continue
-
-                        fields = row.split(",")
-                        if len(fields) == 15:
-                            make, model, year, license_plate, \
-                                daily_rate, is_available, \
-                                latitude, longitude, location_city, \
-                                location_address, image, \
-                                features, car_type, fuel_type, \
-                                end = [field.strip(' "') for field in fields]
-
-                            # Handle empty fields by converting them to None
-                            if not image:
-                                image = None
-                            else:
-                                image_search_result = cloudinary.Search(
-                                ).expression(
-                                    f"public_id:{image}").execute()
-                                if image_search_result['total_count'] > 0:
-                                    # Use the existing public ID
-                                    image = image_search_result[
-                                        'resources'][0]['public_id']
-                                else:
-                                    result = cloudinary.uploader.upload(image)
-                                    image = result['public_id']
-
-                            is_available = is_available.strip(' "') == "TRUE"
-
-                            Car.objects.update_or_create(
-                                license_plate=license_plate,
-                                defaults={
-                                    'make': make,
-                                    'model': model,
-                                    'year': year,
-                                    'daily_rate': daily_rate,
-                                    'is_available': is_available,
-                                    'latitude': latitude,
-                                    'longitude': longitude,
-                                    'location_city': location_city,
-                                    'location_address': location_address,
-                                    'image': image,
-                                    'features': features,
-                                    'car_type': car_type,
-                                    'fuel_type': fuel_type,
-                                }
-                            )
-
-                    messages.success(
-                        request, 'CSV data imported successfully.')
+                    results = import_cars(csv_file)
+                    messages.success(request, (
+                        f"CSV data imported: {results['rows']} row(s), "
+                        f"{results['created']} created, "
+                        f"{results['updated']} updated in "
+                        f"{results['elapsed']:.2f}s "
+                        f"({results['per_second']:.0f} rows/s)."))
+                    if results['failed']:
+                        messages.warning(request, (
+                            f"{results['failed']} row(s) skipped: " +
+                            '; '.join(
+                                f'line {line_num}: {error}'
+                                for line_num, _, error in
+                                results['failures'][:10])))
                     url = reverse('admin:autoR5_car_changelist')
                     return HttpResponseRedirect(url)
 
@@ -163,37 +206,52 @@ class CarAdmin(admin.ModelAdmin):
     def export_csv(self, request):
         """
         Export data as a CSV file.
+
+        The file is streamed by 'autoR5.exports' with the columns read
+        by the import; add '?gzip=1' for a compressed file. Only staff
+        allowed to view cars may export them.
         """
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="car_data.csv"'
-
-        writer = csv.writer(response)
-        writer.writerow([
-            'Make', 'Model', 'Year', 'License Plate', 'Daily Rate',
-            'Available', 'Latitude', 'Longitude', 'Location City',
-            'Location Address', 'Image', 'Features', 'Car Type',
-            'Fuel Type'
-        ])
-
-        cars = Car.objects.all()
-        for car in cars:
-            # Get the public ID from the CloudinaryResource object
-            public_id = car.image.public_id if car.image else ''
-
-            writer.writerow([
-                car.make, car.model, car.year, car.license_plate,
-                car.daily_rate, 'TRUE' if car.is_available else 'FALSE',
-                car.latitude, car.longitude, car.location_city,
-                car.location_address, public_id, car.features,
-                car.car_type, car.fuel_type
-            ])
-
-        return response
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        return export_response(CAR_EXPORT, 'car_data',
+                               compress=request.GET.get('gzip') == '1')
 
     export_csv.short_description = "Export CSV"
 
 
-class BookingAdmin(admin.ModelAdmin):
+class CsvExportMixin:
+    """
+    Adds a streamed CSV export of the whole table to a model admin.
+
+    Set 'export' to an 'autoR5.exports.Export' and 'export_filename' to
+    the name of the downloaded file. The export is linked from the
+    change list and available to staff only; add '?gzip=1' for a
+    compressed file.
+    """
+    export = None
+    export_filename = None
+    change_list_template = 'admin/export_change_list.html'
+
+    def get_urls(self):
+        urls = super().get_urls()
+        info = self.model._meta.app_label, self.model._meta.model_name
+        new_urls = [
+            path('export_csv/', self.admin_site.admin_view(self.export_csv),
+                 name='%s_%s_export_csv' % info),
+        ]
+        return new_urls + urls
+
+    def export_csv(self, request):
+        """
+        Stream the table as a CSV file.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        return export_response(self.export, self.export_filename,
+                               compress=request.GET.get('gzip') == '1')
+
+
+class BookingAdmin(CsvExportMixin, admin.ModelAdmin):
     """
     Admin class for managing Booking objects.
     """
@@ -201,6 +259,8 @@ class BookingAdmin(admin.ModelAdmin):
                     'return_date', 'total_cost', 'status')
     list_filter = ('user', 'car', 'rental_date', 'return_date', 'status')
     search_fields = ('user__username', 'car__make', 'car__model', 'car__year')
+    export = BOOKING_EXPORT
+    export_filename = 'bookings'
 
 
 class ReviewAdmin(admin.ModelAdmin):
@@ -220,7 +280,7 @@ class UserProfileAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'phone_number')
 
 
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(CsvExportMixin, admin.ModelAdmin):
     """
     Admin class for managing Payment objects.
     """
@@ -228,15 +288,127 @@ class PaymentAdmin(admin.ModelAdmin):
                     'payment_method', 'payment_status')
     list_filter = ('user', 'payment_date', 'payment_method', 'payment_status')
     search_fields = ('user__username', 'booking__id')
+    export = PAYMENT_EXPORT
+    export_filename = 'payments'
 
 
 class CancellationRequestAdmin(admin.ModelAdmin):
     """
     Admin class for managing CancellationRequest objects.
     """
-    list_display = ('booking', 'user', 'request_date', 'reason')
-    list_filter = ('user', 'request_date')
+    list_display = ('booking', 'user', 'request_date', 'reason',
+                    'approved')
+    list_filter = ('approved', 'user', 'request_date')
     search_fields = ('user__username', 'booking__id', 'reason')
+    actions = [approve_requests]
+
+
+class RefundJobAdmin(admin.ModelAdmin):
+    """
+    Admin class for managing RefundJob objects.
+    """
+    list_display = ('payment', 'status', 'attempts', 'next_attempt_at',
+                    'refund_id')
+    list_filter = ('status',)
+    search_fields = ('payment__payment_intent', 'refund_id')
+    readonly_fields = ('payment', 'cancellation_request', 'refund_id',
+                       'created_at', 'updated_at')
+
+
+class ImportJobAdmin(admin.ModelAdmin):
+    """
+    Admin class for following background CSV imports.
+
+    The change page polls the job's progress and links to a CSV file
+    of the rows that could not be imported.
+    """
+    list_display = ('__str__', 'status', 'rows', 'created', 'updated',
+                    'failed', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('file_name', 'user', 'status', 'rows', 'created',
+                       'updated', 'failed', 'error', 'created_at',
+                       'updated_at', 'finished_at')
+    exclude = ('file', 'failures_file')
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description='File')
+    def file_name(self, job):
+        return os.path.basename(job.file.name)
+
+    def get_urls(self):
+        urls = super().get_urls()
+        new_urls = [
+            path('<int:pk>/progress/',
+                 self.admin_site.admin_view(self.progress),
+                 name='autoR5_importjob_progress'),
+            path('<int:pk>/failures/',
+                 self.admin_site.admin_view(self.failures),
+                 name='autoR5_importjob_failures'),
+        ]
+        return new_urls + urls
+
+    def change_view(self, request, object_id, form_url='',
+                    extra_context=None):
+        extra_context = dict(
+            extra_context or {},
+            progress_url=reverse('admin:autoR5_importjob_progress',
+                                 args=[object_id]),
+            failures_url=reverse('admin:autoR5_importjob_failures',
+                                 args=[object_id]),
+        )
+        return super().change_view(request, object_id, form_url,
+                                   extra_context)
+
+    def get_job(self, request, pk):
+        """
+        Return the job 'pk' if the user may view it.
+        """
+        job = ImportJob.objects.filter(pk=pk).first()
+        if job is None or not self.has_view_permission(request, job):
+            raise Http404('Import job not found.')
+        return job
+
+    def progress(self, request, pk):
+        """
+        Return the progress of an import job as JSON.
+        """
+        job = self.get_job(request, pk)
+        return JsonResponse({
+            'status': job.status,
+            'rows': job.rows,
+            'created': job.created,
+            'updated': job.updated,
+            'failed': job.failed,
+            'error': job.error,
+            'done': job.status in ('Succeeded', 'Failed'),
+        })
+
+    def failures(self, request, pk):
+        """
+        Download the rows an import job could not import, as CSV.
+        """
+        job = self.get_job(request, pk)
+        if not job.failures_file:
+            raise Http404('This import has no failed rows.')
+        return FileResponse(job.failures_file.open('rb'), as_attachment=True,
+                            filename=f'import_{job.pk}_failures.csv')
+
+
+class GeocodeJobAdmin(admin.ModelAdmin):
+    """
+    Admin class for following background geocoding jobs.
+    """
+    list_display = ('__str__', 'status', 'processed', 'updated', 'failed',
+                    'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('user', 'status', 'processed', 'updated', 'failed',
+                       'error', 'created_at', 'updated_at', 'finished_at')
+    exclude = ('cars',)
+
+    def has_add_permission(self, request):
+        return False
 
 
 class ContactFormSubmissionAdmin(admin.ModelAdmin):
@@ -253,4 +425,7 @@ admin.site.register(Review, ReviewAdmin)
 admin.site.register(UserProfile, UserProfileAdmin)
 admin.site.register(Payment, PaymentAdmin)
 admin.site.register(CancellationRequest, CancellationRequestAdmin)
+admin.site.register(RefundJob, RefundJobAdmin)
+admin.site.register(ImportJob, ImportJobAdmin)
+admin.site.register(GeocodeJob, GeocodeJobAdmin)
 admin.site.register(ContactFormSubmission, ContactFormSubmissionAdmin)
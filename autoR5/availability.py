@@ -0,0 +1,215 @@
+"""
+Availability engine for the 'autoR5' Django web application.
+
+This module answers the two questions every booking flow needs:
+"is car X free for [start, end)?" and "which cars are free for
+[start, end)?". Both are resolved with a single half-open interval
+overlap query against the composite
+(car, status, return_date, rental_date) index on 'Booking', so the
+cost stays flat no matter how much booking history a car has.
+
+- 'datetime', 'time' and 'timedelta' from 'datetime' for turning
+    calendar dates into datetimes and back.
+- 'Exists', 'OuterRef' and 'Q' from 'django.db.models' for building
+    the overlap subquery.
+- 'parse_date' from 'django.utils.dateparse' and 'timezone' from
+    'django.utils' for reading date ranges from query strings.
+- 'Booking' and 'Car' from '.models' for accessing model classes.
+
+Usage:
+The helpers are shared by the 'book_car' and 'cars_list' views and by
+the 'Car' admin, so every part of the application agrees on what
+"booked" means. Confirmed bookings always hold their car; Pending ones
+only until their checkout hold expires (see 'autoR5.reservations'), so
+abandoned carts release their dates without any clean-up job.
+"""
+from datetime import datetime, time, timedelta
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .models import Booking, Car
+
+# Booking statuses that hold a car for their rental period.
+BLOCKING_STATUSES = ('Pending', 'Confirmed')
+
+
+def blocking(now=None):
+    """
+    Return the condition matching bookings that hold their car.
+
+    Confirmed bookings always do. A Pending booking only holds its car
+    while its checkout hold is live: until 'hold_expires_at', or
+    indefinitely when no expiry is set (a payment that is processing).
+    """
+    now = now or timezone.now()
+    return Q(status='Confirmed') | Q(
+        Q(hold_expires_at__isnull=True) | Q(hold_expires_at__gt=now),
+        status='Pending')
+
+
+def overlapping_bookings(start, end=None, now=None):
+    """
+    Return the bookings that overlap the half-open window [start, end).
+
+    Purpose:
+    Two intervals [a, b) and [c, d) overlap exactly when a < d and
+    c < b. This covers bookings that start inside the window, end
+    inside it, or fully enclose it, while a booking returned at the
+    moment another one starts is not a conflict.
+
+    Args:
+    - 'start': Aware datetime at which the requested window opens.
+    - 'end': Aware datetime at which the requested window closes, or
+    None for an open-ended window.
+    - 'now': The time at which holds are evaluated, for tests.
+
+    Returns:
+    A 'Booking' queryset restricted to blocking bookings (see
+    'blocking'). Bookings without a return date are treated as
+    open-ended.
+    """
+    bookings = Booking.objects.filter(
+        Q(return_date__gt=start) | Q(return_date__isnull=True),
+        blocking(now),
+        status__in=BLOCKING_STATUSES,
+    )
+    if end is not None:
+        bookings = bookings.filter(rental_date__lt=end)
+    return bookings
+
+
+def is_car_available(car, start, end=None, exclude_booking=None):
+    """
+    Check whether a car has no blocking booking in [start, end).
+
+    Args:
+    - 'car': The 'Car' instance or primary key to check.
+    - 'start': Aware datetime at which the requested window opens.
+    - 'end': Aware datetime at which the requested window closes.
+    - 'exclude_booking': Optional booking (or primary key) to ignore,
+    used when re-validating an existing booking.
+
+    Returns:
+    True when the car is free for the whole window, False otherwise.
+    """
+    bookings = overlapping_bookings(start, end).filter(car=car)
+    if exclude_booking is not None:
+        bookings = bookings.exclude(pk=getattr(
+            exclude_booking, 'pk', exclude_booking))
+    return not bookings.exists()
+
+
+def available_cars(start, end=None, queryset=None):
+    """
+    Restrict a 'Car' queryset to cars that are free for [start, end).
+
+    Purpose:
+    The check runs as a correlated 'NOT EXISTS' subquery, so the
+    database evaluates it in the same statement as any other filter,
+    ordering or pagination applied to the queryset.
+
+    Args:
+    - 'start': Aware datetime at which the requested window opens.
+    - 'end': Aware datetime at which the requested window closes.
+    - 'queryset': Optional 'Car' queryset to narrow down. Defaults to
+    all cars.
+
+    Returns:
+    A lazy 'Car' queryset.
+    """
+    if queryset is None:
+        queryset = Car.objects.all()
+    return queryset.filter(~Exists(
+        overlapping_bookings(start, end).filter(car=OuterRef('pk'))))
+
+
+def booked_cars(start, end=None, queryset=None):
+    """
+    Restrict a 'Car' queryset to cars with a blocking booking in
+    [start, end).
+
+    This is the complement of 'available_cars' and is used by the
+    admin availability filter.
+
+    Returns:
+    A lazy 'Car' queryset.
+    """
+    if queryset is None:
+        queryset = Car.objects.all()
+    return queryset.filter(Exists(
+        overlapping_bookings(start, end).filter(car=OuterRef('pk'))))
+
+
+def parse_date_range(start, end):
+    """
+    Turn a pair of 'YYYY-MM-DD' strings into an availability window.
+
+    Purpose:
+    Search forms submit plain calendar dates. Each date is converted
+    to midnight in the current time zone so the window lines up with
+    the datetimes stored on 'Booking'.
+
+    Args:
+    - 'start': The first day of the rental, as a string.
+    - 'end': The return day, as a string.
+
+    Returns:
+    A tuple of aware datetimes '(start, end)', or None when either
+    value is missing or malformed, or when 'end' is not after 'start'.
+    """
+    try:
+        start_date = parse_date(start or '')
+        end_date = parse_date(end or '')
+    except ValueError:
+        return None
+    if not start_date or not end_date or end_date <= start_date:
+        return None
+    return (
+        timezone.make_aware(datetime.combine(start_date, time.min)),
+        timezone.make_aware(datetime.combine(end_date, time.min)),
+    )
+
+
+def booked_ranges(car, since=None):
+    """
+    Return the days a car is held, merged into inclusive date ranges.
+
+    Purpose:
+    The booking date picker only needs to know which days cannot be
+    picked. Instead of expanding every booking day by day, the blocking
+    bookings from 'since' onwards are read in rental order and merged
+    into non-overlapping '[first_day, last_day]' ranges. Ranges that
+    touch or overlap are folded together, so the work is linear in the
+    number of bookings and the payload is one pair per range.
+
+    A booking holds its car over '[rental_date, return_date)', so the
+    last held day is the day before a midnight return, matching what
+    'is_car_available' accepts for a new rental.
+
+    Args:
+    - 'car': The 'Car' instance or primary key.
+    - 'since': First calendar day of interest. Defaults to today.
+
+    Returns:
+    A list of '(first_day, last_day)' tuples of 'date' objects.
+    """
+    if since is None:
+        since = timezone.localdate()
+    since_start = timezone.make_aware(datetime.combine(since, time.min))
+    bookings = overlapping_bookings(since_start).filter(
+        car=car).order_by('rental_date').values_list(
+            'rental_date', 'return_date')
+
+    ranges = []
+    for rental_date, return_date in bookings:
+        first_day = max(timezone.localdate(rental_date), since)
+        if return_date is None:
+            last_day = first_day
+        else:
+            last_day = max(timezone.localdate(
+                return_date - timedelta(microseconds=1)), first_day)
+        if ranges and first_day <= ranges[-1][1] + timedelta(days=1):
+            ranges[-1][1] = max(ranges[-1][1], last_day)
+        else:
+            ranges.append([first_day, last_day])
+    return [(first_day, last_day) for first_day, last_day in ranges]
@@ -0,0 +1,188 @@
+"""
+Faceted search support for the fleet filter sidebar.
+
+This module computes the option lists and counts for every filter of
+the 'cars_list' sidebar (make, model, year, car type, fuel type and
+location) in one pass.
+
+- 'time' for seeding the cache version.
+- 'settings' from 'django.conf' for the cache timeout.
+- 'cache' from 'django.core.cache' for sharing facet rows between
+    requests.
+- 'Count' from 'django.db.models' for the grouped aggregate.
+- 'Car' from '.models' for accessing the fleet.
+
+Usage:
+'facet_rows' runs a single 'GROUP BY' over the six filter columns and
+returns one row per distinct combination together with the number of
+cars sharing it. 'facet_counts' then derives cross-filtered counts for
+every facet from those rows in Python: each facet is counted against
+all selected filters except its own, so users can still see and switch
+to the alternatives of a filter they have already set.
+
+'cached_facet_rows' keeps the result of 'facet_rows' in Django's cache
+framework, so the home page, the fleet page and the facet endpoint
+only hit the database after the fleet has changed. Entries are keyed
+by a version number stored in the cache itself: 'invalidate_facets'
+(called from the 'Car' signal receivers) bumps the version, and every
+worker sharing the cache backend picks up fresh rows on its next read.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from .models import Car
+
+# (query parameter, Car field) pairs in sidebar order.
+FACETS = (
+    ('make', 'make'),
+    ('model', 'model'),
+    ('year', 'year'),
+    ('car_type', 'car_type'),
+    ('fuel_type', 'fuel_type'),
+    ('location', 'location_city'),
+)
+
+FACET_CACHE_VERSION_KEY = 'autoR5:facets:version'
+FACET_CACHE_ROWS_KEY = 'autoR5:facets:rows:{}'
+
+# Upper bound on staleness for caches that are not shared between
+# processes (such as the default local memory cache).
+FACET_CACHE_TIMEOUT = getattr(settings, 'FACET_CACHE_TIMEOUT', 60 * 60)
+
+FACET_LABELS = {
+    'car_type': dict(Car.CAR_TYPES),
+    'fuel_type': dict(Car.FUEL_TYPES),
+}
+
+
+def facet_rows():
+    """
+    Return every distinct combination of facet values with its count.
+
+    Returns:
+    A list of dictionaries keyed by the 'Car' field names of 'FACETS'
+    plus 'count', produced by one grouped aggregate query.
+    """
+    fields = [field for _, field in FACETS]
+    return list(Car.objects.values(*fields).annotate(
+        count=Count('id')).order_by())
+
+
+def facet_version():
+    """
+    Return the current facet cache version, creating it if needed.
+
+    A missing version is seeded from the clock rather than a fixed
+    number, so an evicted version key can never bring back rows cached
+    under an earlier version.
+    """
+    version = cache.get(FACET_CACHE_VERSION_KEY)
+    if version is None:
+        cache.add(FACET_CACHE_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(FACET_CACHE_VERSION_KEY)
+    return version
+
+
+def cached_facet_rows():
+    """
+    Return 'facet_rows', filling the cache on first use.
+
+    Returns:
+    The same list as 'facet_rows', read from the cache entry of the
+    current version when present.
+    """
+    key = FACET_CACHE_ROWS_KEY.format(facet_version())
+    rows = cache.get(key)
+    if rows is None:
+        rows = facet_rows()
+        cache.set(key, rows, FACET_CACHE_TIMEOUT)
+    return rows
+
+
+def invalidate_facets():
+    """
+    Mark every cached facet list as stale by bumping the version.
+
+    Usage:
+    Called from the 'post_save' and 'post_delete' receivers of 'Car'
+    in 'autoR5.signals'. Old entries are not deleted; they are simply
+    no longer read and expire on their own.
+    """
+    try:
+        cache.incr(FACET_CACHE_VERSION_KEY)
+    except ValueError:
+        cache.add(FACET_CACHE_VERSION_KEY, time.time_ns(), None)
+
+
+def facet_values(field, rows=None):
+    """
+    Return the sorted distinct, non-empty values of one 'Car' field.
+
+    Args:
+    - 'field': A 'Car' field name listed in 'FACETS'.
+    - 'rows': Optional pre-computed facet rows. Defaults to the cached
+    rows.
+
+    Returns:
+    A list of values, equivalent to a 'SELECT DISTINCT' on the field.
+    """
+    if rows is None:
+        rows = cached_facet_rows()
+    return sorted({row[field] for row in rows
+                   if row[field] is not None and row[field] != ''})
+
+
+def facet_counts(selection, rows=None):
+    """
+    Compute cross-filtered option counts for every facet.
+
+    Purpose:
+    A combination row counts towards facet F when it matches every
+    selected filter other than F. Rows that match all selected filters
+    count towards every facet, rows that miss exactly one selected
+    filter only count towards that filter, and all other rows are
+    skipped.
+
+    Args:
+    - 'selection': A mapping of query parameter names (see 'FACETS')
+    to the currently selected values. Empty values are ignored.
+    - 'rows': Optional pre-computed result of 'facet_rows'. Defaults
+    to the cached rows.
+
+    Returns:
+    A dictionary with 'total', the number of cars matching the whole
+    selection, and 'facets', mapping each query parameter to a sorted
+    list of '{"value", "text", "count"}' options.
+    """
+    if rows is None:
+        rows = cached_facet_rows()
+    selected = {param: str(selection[param]) for param, _ in FACETS
+                if selection.get(param)}
+
+    total = 0
+    counts = {param: {} for param, _ in FACETS}
+    for row in rows:
+        missed = [param for param, field in FACETS
+                  if param in selected and str(row[field]) != selected[param]]
+        if len(missed) > 1:
+            continue
+        if not missed:
+            total += row['count']
+        for param, field in FACETS:
+            if missed and missed[0] != param:
+                continue
+            value = row[field]
+            if value is None or value == '':
+                continue
+            counts[param][value] = counts[param].get(value, 0) + row['count']
+
+    facets = {}
+    for param, _ in FACETS:
+        labels = FACET_LABELS.get(param, {})
+        facets[param] = [
+            {'value': value, 'text': labels.get(value, value),
+             'count': count}
+            for value, count in sorted(counts[param].items())
+        ]
+    return {'total': total, 'facets': facets}
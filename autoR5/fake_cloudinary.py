@@ -0,0 +1,116 @@
+"""
+An in-memory stand-in for the parts of the 'cloudinary' library used by
+the 'autoR5' Django web application.
+
+- 'threading' for recording calls made from worker threads.
+- 'time' for simulating network latency.
+- 'itertools.count' for generating public ids.
+- 'cloudinary.exceptions' for its error classes.
+
+Usage:
+Patch the 'cloudinary' module of the code under test with an instance:
+
+    fake = FakeCloudinary(public_ids=['car_images/known'])
+    with patch('autoR5.images.cloudinary', fake):
+        resolve_images(['car_images/known', 'https://example.com/a.jpg'])
+    fake.calls  # [('search', 'car_images/known'), ...]
+
+'FakeCloudinary' mirrors 'cloudinary.Search' and
+'cloudinary.uploader.upload'. Searches find the public ids passed to
+the constructor and those uploaded since; every call is recorded in
+'calls'. 'latency' delays each call, so tests can tell concurrent
+resolution from serial, and errors queued with 'fail_next' are raised
+by the following calls.
+"""
+import threading
+import time
+from itertools import count
+import cloudinary.exceptions
+
+
+class FakeSearch:
+    """
+    A fake 'cloudinary.Search' supporting 'public_id:' expressions.
+    """
+
+    def __init__(self, fake):
+        self.fake = fake
+        self.public_id = None
+
+    def expression(self, expression):
+        self.public_id = expression.split('public_id:', 1)[-1]
+        return self
+
+    def execute(self):
+        self.fake._call('search', self.public_id)
+        found = self.public_id in self.fake.public_ids
+        return {
+            'total_count': int(found),
+            'resources': [{'public_id': self.public_id}] if found else [],
+        }
+
+
+class FakeUploader:
+    """
+    A fake 'cloudinary.uploader' module.
+    """
+
+    def __init__(self, fake):
+        self.fake = fake
+
+    def upload(self, file, **options):
+        self.fake._call('upload', file)
+        public_id = f'car_images/fake_{next(self.fake.ids)}'
+        self.fake.public_ids.add(public_id)
+        return {'public_id': public_id, 'secure_url': file}
+
+
+class FakeCloudinary:
+    """
+    A drop-in replacement for the 'cloudinary' module in tests.
+
+    Attributes:
+    - 'uploader': The fake 'cloudinary.uploader'.
+    - 'exceptions': The real 'cloudinary.exceptions' module, so
+    'except' clauses of the code under test keep working.
+    - 'public_ids': The public ids Cloudinary knows.
+    - 'calls': Every API call made, as (method, argument).
+    - 'failures': Exceptions raised, in order, by the next API calls.
+    """
+    exceptions = cloudinary.exceptions
+
+    def __init__(self, public_ids=(), latency=0):
+        self.public_ids = set(public_ids)
+        self.latency = latency
+        self.calls = []
+        self.failures = []
+        self.ids = count(1)
+        self.lock = threading.Lock()
+        self.uploader = FakeUploader(self)
+
+    def Search(self):  # noqa: N802 - mirrors 'cloudinary.Search'.
+        return FakeSearch(self)
+
+    def _call(self, method, argument):
+        with self.lock:
+            self.calls.append((method, argument))
+            failure = self.failures.pop(0) if self.failures else None
+        if self.latency:
+            time.sleep(self.latency)
+        if failure:
+            raise failure
+
+    def fail_next(self, error=None):
+        """
+        Make the next API call raise 'error' (a generic Cloudinary
+        error by default).
+        """
+        self.failures.append(
+            error or cloudinary.exceptions.Error('Network error'))
+
+    def call_count(self, method=None):
+        """
+        Return the number of recorded calls of 'method', or of all
+        calls.
+        """
+        return sum(1 for call in self.calls if method in (None, call[0]))
@@ -0,0 +1,66 @@
+"""
+An in-memory stand-in for the geopy geocoders used by the 'autoR5'
+Django web application.
+
+- 'threading' for recording calls safely.
+- 'geopy.exc' for its error classes.
+- 'Location' from 'geopy.location' for building results.
+
+Usage:
+Pass an instance wherever a geocoder is accepted, or patch
+'autoR5.geocoding.make_geocoder' to return it:
+
+    fake = FakeGeocoder({
+        (53.3498, -6.2603): ({'city': 'Dublin'}, 'O'Connell Street'),
+    })
+    geocode_cars(Car.objects.all(), geocoder=fake, rate=0)
+    fake.calls  # [(Decimal('53.3498'), Decimal('-6.2603')), ...]
+
+'reverse' answers the points passed to the constructor, rounded the
+same way as the cached points, and returns None for any other point.
+Every call is recorded in 'calls', and errors queued with 'fail_next'
+are raised by the following calls.
+"""
+import threading
+import geopy.exc
+from geopy.location import Location
+
+
+class FakeGeocoder:
+    """
+    A drop-in replacement for 'geopy.geocoders.Nominatim' in tests.
+
+    Attributes:
+    - 'locations': A dictionary mapping (latitude, longitude) to the
+    raw 'address' dictionary and the full address of the point.
+    - 'calls': Every queried point.
+    - 'failures': Exceptions raised, in order, by the next calls.
+    """
+
+    def __init__(self, locations=None):
+        self.locations = {
+            (round(float(latitude), 4), round(float(longitude), 4)): value
+            for (latitude, longitude), value in (locations or {}).items()}
+        self.calls = []
+        self.failures = []
+        self.lock = threading.Lock()
+
+    def reverse(self, query, exactly_one=True, **kwargs):
+        latitude, longitude = query
+        with self.lock:
+            self.calls.append((latitude, longitude))
+            if self.failures:
+                raise self.failures.pop(0)
+        key = (round(float(latitude), 4), round(float(longitude), 4))
+        if key not in self.locations:
+            return None
+        address, full_address = self.locations[key]
+        return Location(full_address, (float(latitude), float(longitude)),
+                        {'address': address, 'display_name': full_address})
+
+    def fail_next(self, error=None):
+        """
+        Make the next call raise 'error' (a service error by default).
+        """
+        self.failures.append(
+            error or geopy.exc.GeocoderServiceError('Service unavailable'))
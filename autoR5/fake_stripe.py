@@ -0,0 +1,144 @@
+"""
+An in-memory stand-in for the parts of the 'stripe' library used by
+the 'autoR5' Django web application.
+
+- 'hashlib', 'hmac' and 'time' for signing webhook payloads.
+- 'itertools.count' for generating object ids.
+- 'stripe' for its error classes and 'StripeObject'.
+
+Usage:
+Patch the 'stripe' module of the code under test with an instance:
+
+    fake = FakeStripe()
+    with patch('autoR5.refunds.stripe', fake):
+        process_refund_jobs()
+    fake.calls  # [('Refund', 'create', {...}), ...]
+
+'FakeStripe' mirrors 'stripe.PaymentIntent' and 'stripe.Refund' with
+'create', 'retrieve', 'modify' and 'cancel', records every call in
+'calls' and honours idempotency keys like the real API: a repeated
+'create' with the same key returns the original object without creating
+another. Like Stripe, 'cancel' refuses intents that already succeeded.
+Errors queued with 'fail_next' are raised by the following calls,
+which lets tests exercise retries without a network.
+
+'sign_webhook' produces a valid 'Stripe-Signature' header for a webhook
+payload, so tests can post events to the real, signature-checking
+endpoint.
+"""
+import hashlib
+import hmac
+import time
+from itertools import count
+import stripe
+from stripe.stripe_object import StripeObject
+
+
+class FakeResource:
+    """
+    A fake Stripe API resource, such as 'PaymentIntent' or 'Refund'.
+    """
+
+    def __init__(self, fake, name, prefix, defaults):
+        self.fake = fake
+        self.name = name
+        self.prefix = prefix
+        self.defaults = defaults
+        self.objects = {}
+        self.idempotent = {}
+
+    def _call(self, method, params):
+        self.fake.calls.append((self.name, method, params))
+        if self.fake.failures:
+            raise self.fake.failures.pop(0)
+
+    def create(self, idempotency_key=None, **params):
+        self._call('create', dict(params, idempotency_key=idempotency_key))
+        if idempotency_key in self.idempotent:
+            return self.idempotent[idempotency_key]
+        object_id = f'{self.prefix}_fake_{next(self.fake.ids)}'
+        values = dict(self.defaults, id=object_id, **params)
+        if self.name == 'PaymentIntent':
+            values['client_secret'] = f'{object_id}_secret_fake'
+        obj = StripeObject.construct_from(values, 'sk_test_fake')
+        self.objects[object_id] = obj
+        if idempotency_key:
+            self.idempotent[idempotency_key] = obj
+        return obj
+
+    def _get(self, object_id):
+        try:
+            return self.objects[object_id]
+        except KeyError:
+            raise stripe.error.InvalidRequestError(
+                f'No such {self.name}: {object_id}', 'id')
+
+    def retrieve(self, object_id, **params):
+        self._call('retrieve', dict(params, id=object_id))
+        return self._get(object_id)
+
+    def modify(self, object_id, **params):
+        self._call('modify', dict(params, id=object_id))
+        obj = self._get(object_id)
+        obj.update(params)
+        return obj
+
+    def cancel(self, object_id, **params):
+        self._call('cancel', dict(params, id=object_id))
+        obj = self._get(object_id)
+        if obj.status in ('succeeded', 'canceled'):
+            raise stripe.error.InvalidRequestError(
+                f'This {self.name} has a status of {obj.status}.', 'id')
+        obj.status = 'canceled'
+        return obj
+
+
+class FakeStripe:
+    """
+    A drop-in replacement for the 'stripe' module in tests.
+
+    Attributes:
+    - 'PaymentIntent' and 'Refund': The fake resources.
+    - 'error': The real 'stripe.error' module, so 'except' clauses of
+    the code under test keep working.
+    - 'calls': Every API call made, as (resource, method, params).
+    - 'failures': Exceptions raised, in order, by the next API calls.
+    """
+    error = stripe.error
+
+    def __init__(self):
+        self.api_key = None
+        self.calls = []
+        self.failures = []
+        self.ids = count(1)
+        self.PaymentIntent = FakeResource(
+            self, 'PaymentIntent', 'pi',
+            {'status': 'requires_payment_method', 'currency': 'eur'})
+        self.Refund = FakeResource(self, 'Refund', 're',
+                                   {'status': 'succeeded'})
+
+    def fail_next(self, error=None):
+        """
+        Make the next API call raise 'error' (a connection error by
+        default).
+        """
+        self.failures.append(
+            error or stripe.error.APIConnectionError('Network error'))
+
+    def call_count(self, name=None, method=None):
+        """
+        Return the number of recorded calls matching the arguments.
+        """
+        return sum(1 for call in self.calls
+                   if name in (None, call[0]) and method in (None, call[1]))
+
+
+def sign_webhook(payload, secret, timestamp=None):
+    """
+    Return the 'Stripe-Signature' header Stripe would send with
+    'payload' (a string) for an endpoint signed with 'secret'.
+    """
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(),
+                         hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
@@ -343,6 +343,9 @@ class CsvImportForm(forms.Form):
 
     Attributes:
         - csv_import: A FileField for selecting and uploading a CSV file.
+        - background: Queue the import for the 'process_imports' worker
+        instead of importing it within the request. Large files are
+        always queued.
 
     Usage:
         To use this form, instantiate it in a view and provide it to a
@@ -352,3 +355,5 @@ class CsvImportForm(forms.Form):
         None
     """
     csv_import = forms.FileField(label='Select CSV File')
+    background = forms.BooleanField(
+        required=False, label='Import in the background')
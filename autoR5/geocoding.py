@@ -0,0 +1,306 @@
+"""
+Batched reverse geocoding of the fleet for the 'autoR5' Django web
+application.
+
+The 'Update Location' admin action used to call Nominatim for every
+selected car, one after the other inside the admin's request, and save
+each car separately. A fleet of thousands took hours, ran into the
+provider's usage limits, and an address without a 'city' crashed the
+action.
+
+- 'time' for pacing requests.
+- 'Decimal' from 'decimal' for rounding coordinates.
+- 'timedelta' from 'datetime' for the claim timeout.
+- 'Nominatim' from 'geopy.geocoders' for the geocoding service.
+- 'GeopyError' from 'geopy.exc' for failed lookups.
+- 'settings' from 'django.conf' for the precision, rate and timeout.
+- 'transaction' from 'django.db' for claiming jobs atomically.
+- 'Q' from 'django.db.models' for finding stalled jobs.
+- 'timezone' from 'django.utils' for timestamps.
+- 'invalidate_facets' from '.facets' for refreshing the cached city
+    filter, since bulk writes do not send the 'Car' signals.
+- 'Car', 'GeocodedLocation' and 'GeocodeJob' from '.models' for
+    accessing the data.
+
+Usage:
+The admin action queues a 'GeocodeJob' with 'queue_geocoding'.
+'process_geocode_jobs' (run by the 'process_geocoding' management
+command) claims it and calls 'geocode_cars', which walks the cars in
+batches:
+
+- Coordinates are rounded to 'GEOCODE_PRECISION' decimal places and
+  de-duplicated, so cars at the same spot cost one lookup.
+- Points already in the 'GeocodedLocation' table are read with one
+  query per batch; the others are looked up at most 'GEOCODE_RATE'
+  times per second and stored for good.
+- The cars of a batch are written with one 'bulk_update'.
+
+'geocoder' is any object with a geopy style 'reverse' method; tests pass
+'autoR5.fake_geocoder.FakeGeocoder'.
+"""
+import time
+from decimal import Decimal
+from datetime import timedelta
+from geopy.exc import GeopyError
+from geopy.geocoders import Nominatim
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .facets import invalidate_facets
+from .models import Car, GeocodedLocation, GeocodeJob
+
+# Decimal places kept when caching a point; 4 is about 11 metres.
+GEOCODE_PRECISION = getattr(settings, 'GEOCODE_PRECISION', 4)
+
+# Maximum number of requests per second. Nominatim's usage policy
+# allows one.
+GEOCODE_RATE = getattr(settings, 'GEOCODE_RATE', 1)
+
+# How long, in seconds, a running job may go without reporting progress
+# before another worker takes it over.
+GEOCODE_CLAIM_TIMEOUT = getattr(settings, 'GEOCODE_CLAIM_TIMEOUT', 10 * 60)
+
+# Address keys holding the locality, most specific first.
+CITY_KEYS = ('city', 'town', 'village', 'hamlet', 'municipality',
+             'suburb', 'county', 'state')
+
+ADDRESS_MAX_LENGTH = Car._meta.get_field('location_address').max_length
+
+
+class RateLimiter:
+    """
+    Spaces calls so that at most 'rate' happen per second.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_call = 0
+
+    def wait(self):
+        """
+        Sleep until the next call is allowed.
+        """
+        now = time.monotonic()
+        if self.next_call > now:
+            time.sleep(self.next_call - now)
+            now = self.next_call
+        self.next_call = now + self.interval
+
+
+def make_geocoder():
+    """
+    Return the geocoding service used outside of tests.
+    """
+    return Nominatim(user_agent='autoR5', timeout=10)
+
+
+def round_point(latitude, longitude):
+    """
+    Return a point rounded to 'GEOCODE_PRECISION' decimal places.
+    """
+    quantum = Decimal(1).scaleb(-GEOCODE_PRECISION)
+    return (Decimal(str(latitude)).quantize(quantum),
+            Decimal(str(longitude)).quantize(quantum))
+
+
+def point_key(point):
+    """
+    Return the cache key of a rounded point.
+    """
+    return f'{point[0]},{point[1]}'
+
+
+def location_fields(location):
+    """
+    Return the city and address of a geopy location.
+
+    Falls back from 'city' to towns, villages and broader areas, since
+    many addresses have no 'city'. Either value is None when missing.
+    """
+    if location is None:
+        return None, None
+    address = location.raw.get('address', {})
+    city = next((address[key] for key in CITY_KEYS if address.get(key)),
+                None)
+    full_address = location.address or None
+    if full_address:
+        full_address = full_address[:ADDRESS_MAX_LENGTH]
+    return city, full_address
+
+
+def geocode_points(points, geocoder, limiter):
+    """
+    Reverse geocode rounded points, using and filling the cache.
+
+    Args:
+    - 'points': Rounded (latitude, longitude) pairs; duplicates are
+    looked up once.
+    - 'geocoder': The geocoding service.
+    - 'limiter': The 'RateLimiter' pacing the lookups.
+
+    Returns:
+    A dictionary mapping the key of every point that could be looked
+    up to its (city, address), and the number of requests sent to the
+    service. Points whose lookup failed are missing from the
+    dictionary and will be retried by a later job.
+    """
+    points = {point_key(point): point for point in points}
+    found = {key: (city, address) for key, city, address in
+             GeocodedLocation.objects.filter(key__in=points)
+             .values_list('key', 'city', 'address')}
+    fresh = []
+    lookups = 0
+    for key, point in sorted(points.items()):
+        if key in found:
+            continue
+        limiter.wait()
+        lookups += 1
+        try:
+            location = geocoder.reverse(point, exactly_one=True,
+                                        language='en')
+        except GeopyError:
+            continue
+        found[key] = location_fields(location)
+        fresh.append(GeocodedLocation(
+            key=key, latitude=point[0], longitude=point[1],
+            city=found[key][0], address=found[key][1]))
+    GeocodedLocation.objects.bulk_create(fresh, ignore_conflicts=True)
+    return found, lookups
+
+
+def geocode_cars(cars, geocoder=None, rate=None, batch_size=100,
+                 progress=None):
+    """
+    Fill in the city and address of cars from their coordinates.
+
+    Args:
+    - 'cars': A 'Car' queryset.
+    - 'geocoder': The geocoding service. Defaults to Nominatim.
+    - 'rate': The maximum number of lookups per second. Defaults to
+    'GEOCODE_RATE'.
+    - 'batch_size': The number of cars handled per batch.
+    - 'progress': Called with the results so far after every batch.
+
+    Returns:
+    A dictionary with the number of cars 'processed', 'updated' and
+    'failed' (their point could not be geocoded) and the number of
+    'lookups' sent to the service.
+    """
+    geocoder = geocoder or make_geocoder()
+    limiter = RateLimiter(GEOCODE_RATE if rate is None else rate)
+    results = {'processed': 0, 'updated': 0, 'failed': 0, 'lookups': 0}
+    last_id = 0
+
+    while True:
+        batch = list(cars.filter(id__gt=last_id).order_by('id')
+                     .values_list('id', 'latitude', 'longitude',
+                                  'location_city')[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        points = {car_id: round_point(latitude, longitude)
+                  for car_id, latitude, longitude, _ in batch}
+        found, lookups = geocode_points(
+            set(points.values()), geocoder, limiter)
+        results['lookups'] += lookups
+
+        updates = []
+        for car_id, _, _, current_city in batch:
+            city, address = found.get(point_key(points[car_id]),
+                                      (None, None))
+            if address is None:
+                results['failed'] += 1
+                continue
+            updates.append(Car(pk=car_id, location_city=city or current_city,
+                               location_address=address))
+        Car.objects.bulk_update(updates,
+                                ['location_city', 'location_address'])
+        results['processed'] += len(batch)
+        results['updated'] += len(updates)
+        if progress:
+            progress(results)
+
+    if results['updated']:
+        invalidate_facets()
+    return results
+
+
+def queue_geocoding(car_ids, user=None):
+    """
+    Queue a job geocoding the given cars.
+
+    Returns:
+    The new 'GeocodeJob'.
+    """
+    job = GeocodeJob.objects.create(user=user)
+    job.cars.add(*car_ids)
+    return job
+
+
+def claim_geocode_job(now=None):
+    """
+    Claim the oldest queued or stalled geocoding job for this worker.
+
+    Returns:
+    The claimed 'GeocodeJob', now 'Running', or None when there is no
+    job to run.
+    """
+    now = now or timezone.now()
+    stalled = now - timedelta(seconds=GEOCODE_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        job = (GeocodeJob.objects.select_for_update(skip_locked=True)
+               .filter(Q(status='Queued') |
+                       Q(status='Running', updated_at__lt=stalled))
+               .order_by('created_at', 'id').first())
+        if job is None:
+            return None
+        job.status = 'Running'
+        job.updated_at = now
+        job.save(update_fields=['status', 'updated_at'])
+    return job
+
+
+def run_geocode_job(job, geocoder=None, rate=None, batch_size=100):
+    """
+    Geocode the cars of a claimed job, recording progress on the job.
+
+    Returns:
+    The results of 'geocode_cars', or None when the job failed.
+    """
+    def report(results):
+        GeocodeJob.objects.filter(pk=job.pk).update(
+            processed=results['processed'], updated=results['updated'],
+            failed=results['failed'], updated_at=timezone.now())
+
+    try:
+        results = geocode_cars(job.cars.all(), geocoder, rate, batch_size,
+                               progress=report)
+    except Exception as error:
+        job.status = 'Failed'
+        job.error = str(error) or error.__class__.__name__
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return None
+
+    job.processed = results['processed']
+    job.updated = results['updated']
+    job.failed = results['failed']
+    job.status = 'Succeeded'
+    job.finished_at = job.updated_at = timezone.now()
+    job.save()
+    return results
+
+
+def process_geocode_jobs(geocoder=None, rate=None, batch_size=100,
+                         now=None):
+    """
+    Claim and run one geocoding job.
+
+    Returns:
+    The job that was run, or None when there was nothing to do.
+    """
+    job = claim_geocode_job(now)
+    if job is not None:
+        run_geocode_job(job, geocoder, rate, batch_size)
+    return job
@@ -0,0 +1,114 @@
+"""
+Cloudinary image resolution for the 'autoR5' Django web application.
+
+Every image referenced by an imported car has to be looked up on
+Cloudinary, and uploaded when it is not there yet. Done one row at a
+time inside the admin request, that was one or two blocking network
+calls per car.
+
+- 'ThreadPoolExecutor' from 'concurrent.futures' for resolving images
+    concurrently.
+- 'cloudinary' and 'cloudinary.uploader' for the Cloudinary API.
+- 'settings' from 'django.conf' for the pool size and cache timeout.
+- 'cache' from 'django.core.cache' for remembering resolved images.
+
+Usage:
+'resolve_images' takes the image references of many cars, drops
+duplicates and those already in Django's cache, and resolves the rest
+on a pool of 'IMAGE_RESOLVE_WORKERS' threads. Resolved public ids are
+cached for 'IMAGE_CACHE_TIMEOUT' seconds, both under the reference and
+under the public id itself, so the public ids found in a later CSV
+export are recognised without calling Cloudinary again.
+
+Tests patch the 'cloudinary' module used here with
+'autoR5.fake_cloudinary.FakeCloudinary'.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import cloudinary
+import cloudinary.uploader
+from django.conf import settings
+from django.core.cache import cache
+
+# Maximum number of concurrent requests to Cloudinary.
+IMAGE_RESOLVE_WORKERS = getattr(settings, 'IMAGE_RESOLVE_WORKERS', 8)
+
+# How long, in seconds, a resolved public id is remembered.
+IMAGE_CACHE_TIMEOUT = getattr(
+    settings, 'IMAGE_CACHE_TIMEOUT', 30 * 24 * 60 * 60)
+
+IMAGE_CACHE_KEY = 'autoR5:images:{}'
+
+
+def resolve_image(reference):
+    """
+    Return the Cloudinary public id of an image, uploading it when
+    Cloudinary does not know it yet.
+
+    Args:
+    - 'reference': A public id, or a URL or path to upload.
+
+    Raises:
+    - 'cloudinary.exceptions.Error': If a Cloudinary call fails.
+    - 'OSError': If a local file to upload cannot be read.
+    Network errors of the HTTP client are raised as they are.
+    """
+    result = cloudinary.Search().expression(
+        f"public_id:{reference}").execute()
+    if result['total_count'] > 0:
+        return result['resources'][0]['public_id']
+    return cloudinary.uploader.upload(reference)['public_id']
+
+
+def _resolve(reference):
+    """
+    Resolve one reference on a worker thread, returning the exception
+    instead of raising it.
+
+    Any exception is caught, not only Cloudinary's own errors, since an
+    exception escaping a worker thread would abort the whole import
+    instead of failing the rows that use this image.
+    """
+    try:
+        return resolve_image(reference), None
+    except Exception as error:
+        return None, error
+
+
+def resolve_images(references, workers=None):
+    """
+    Resolve many image references concurrently.
+
+    Args:
+    - 'references': Image references; duplicates are looked up once.
+    - 'workers': The size of the thread pool. Defaults to
+    'IMAGE_RESOLVE_WORKERS'.
+
+    Returns:
+    A tuple of two dictionaries: the public id of every resolved
+    reference, and the error message of every reference that could not
+    be resolved.
+    """
+    references = set(references)
+    keys = {IMAGE_CACHE_KEY.format(reference): reference
+            for reference in references}
+    resolved = {keys[key]: public_id
+                for key, public_id in cache.get_many(keys).items()}
+    missing = sorted(references - resolved.keys())
+    errors = {}
+    if not missing:
+        return resolved, errors
+
+    with ThreadPoolExecutor(
+            max_workers=min(workers or IMAGE_RESOLVE_WORKERS,
+                            len(missing))) as pool:
+        outcomes = pool.map(_resolve, missing)
+        fresh = {}
+        for reference, (public_id, error) in zip(missing, outcomes):
+            if error is not None:
+                errors[reference] = f'Image {reference!r}: {error}'
+                continue
+            resolved[reference] = public_id
+            fresh[IMAGE_CACHE_KEY.format(reference)] = public_id
+            fresh[IMAGE_CACHE_KEY.format(public_id)] = public_id
+    cache.set_many(fresh, IMAGE_CACHE_TIMEOUT)
+    return resolved, errors
@@ -0,0 +1,153 @@
+"""
+Background fleet imports for the 'autoR5' Django web application.
+
+Even streamed and batched, a large CSV import run inside the admin's
+request can outlast the gunicorn worker timeout. Large uploads are
+therefore stored in the database as 'ImportJob' rows and imported by a
+worker, which can run on another host than the web process.
+
+- 'csv' for writing the failed rows.
+- 'io' for building the failed rows file.
+- 'timedelta' from 'datetime' for the claim timeout.
+- 'settings' from 'django.conf' for the size limit and claim timeout.
+- 'ContentFile' from 'django.core.files.base' for saving the failed
+    rows.
+- 'transaction' from 'django.db' for claiming jobs atomically.
+- 'Q' from 'django.db.models' for finding stalled jobs.
+- 'timezone' from 'django.utils' for timestamps.
+- 'CAR_CSV_FIELDS' and 'import_cars' from '.car_import' for the import
+    itself.
+- 'ImportJob' from '.models' for accessing the jobs.
+
+Usage:
+The admin import queues uploads larger than 'IMPORT_INLINE_MAX_BYTES',
+or any upload when asked to, with 'queue_import'.
+'process_import_jobs' (run by the 'process_imports' management command)
+claims the oldest queued job and imports it with every batch committed
+on its own, recording the number of rows parsed, created, updated and
+failed on the job after each batch. The failed rows are saved as a CSV
+file the admin can download.
+
+A job whose worker died is claimed again once it has not reported
+progress for 'IMPORT_CLAIM_TIMEOUT' seconds. Importing a file twice is
+harmless, since cars are matched on their license plate.
+"""
+import csv
+import io
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .car_import import CAR_CSV_FIELDS, import_cars
+from .models import ImportJob
+
+# Uploads up to this size, in bytes, are imported within the request.
+IMPORT_INLINE_MAX_BYTES = getattr(
+    settings, 'IMPORT_INLINE_MAX_BYTES', 1024 * 1024)
+
+# How long, in seconds, a running job may go without reporting progress
+# before another worker takes it over.
+IMPORT_CLAIM_TIMEOUT = getattr(settings, 'IMPORT_CLAIM_TIMEOUT', 10 * 60)
+
+
+def queue_import(csv_file, user=None):
+    """
+    Store an uploaded CSV file and queue it for the worker.
+
+    Returns:
+    The new 'ImportJob'.
+    """
+    job = ImportJob(user=user)
+    job.file.save(csv_file.name, csv_file, save=False)
+    job.save()
+    return job
+
+
+def claim_import_job(now=None):
+    """
+    Claim the oldest queued or stalled import job for this worker.
+
+    Returns:
+    The claimed 'ImportJob', now 'Running', or None when there is no
+    job to run.
+    """
+    now = now or timezone.now()
+    stalled = now - timedelta(seconds=IMPORT_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        job = (ImportJob.objects.select_for_update(skip_locked=True)
+               .filter(Q(status='Queued') |
+                       Q(status='Running', updated_at__lt=stalled))
+               .order_by('created_at', 'id').first())
+        if job is None:
+            return None
+        job.status = 'Running'
+        job.updated_at = now
+        job.save(update_fields=['status', 'updated_at'])
+    return job
+
+
+def failures_csv(failures):
+    """
+    Return the failed rows of an import as CSV text, with their line
+    number and error in front of the original columns.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Line', 'Error', *CAR_CSV_FIELDS])
+    for line_num, row, error in failures:
+        writer.writerow([line_num, error, *row])
+    return output.getvalue()
+
+
+def run_import_job(job, batch_size=1000):
+    """
+    Import the file of a claimed job, recording progress on the job.
+
+    Returns:
+    The results of 'import_cars', or None when the import failed.
+    """
+    def report(results):
+        ImportJob.objects.filter(pk=job.pk).update(
+            rows=results['rows'], created=results['created'],
+            updated=results['updated'], failed=results['failed'],
+            updated_at=timezone.now())
+
+    try:
+        with job.file.open('rb') as csv_file:
+            results = import_cars(csv_file, batch_size, atomic=False,
+                                  progress=report)
+    except Exception as error:
+        job.status = 'Failed'
+        job.error = str(error) or error.__class__.__name__
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return None
+
+    job.rows = results['rows']
+    job.created = results['created']
+    job.updated = results['updated']
+    job.failed = results['failed']
+    if results['failures']:
+        job.failures_file.save(
+            f'failures_{job.pk}.csv',
+            ContentFile(failures_csv(results['failures']).encode('utf-8')),
+            save=False)
+    job.status = 'Succeeded'
+    job.finished_at = job.updated_at = timezone.now()
+    job.save()
+    return results
+
+
+def process_import_jobs(batch_size=1000, now=None):
+    """
+    Claim and run one import job.
+
+    Returns:
+    The job that was run, or None when there was nothing to do.
+    """
+    job = claim_import_job(now)
+    if job is not None:
+        run_import_job(job, batch_size)
+    return job
@@ -0,0 +1,129 @@
+"""
+Management command benchmarking the availability engine.
+
+The command fills the 'Booking' table with synthetic rentals in
+growing steps (for example 1k, 10k, 100k and 1M rows) and times the
+two availability questions after each step:
+
+- 'is_car_available': one car, one date window.
+- 'available_cars': the whole fleet, one date window.
+
+With the composite availability index in place the per-query latency
+should stay flat as the table grows. All synthetic rows are created
+inside a transaction that is rolled back at the end, so the command
+can be pointed at a development database without leaving data behind.
+
+Usage:
+    python manage.py benchmark_availability --bookings 1000000
+"""
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from autoR5.availability import available_cars, is_car_available
+from autoR5.models import Booking, Car
+
+BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    """
+    Benchmark availability queries against a growing booking table.
+    """
+    help = ('Time availability queries while growing the booking table '
+            'to the requested size. All data is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bookings', type=int, default=1000000,
+            help='Total number of synthetic bookings to create.')
+        parser.add_argument(
+            '--cars', type=int, default=500,
+            help='Number of synthetic cars the bookings are spread over.')
+        parser.add_argument(
+            '--queries', type=int, default=200,
+            help='Number of timed queries per measurement step.')
+
+    def handle(self, *args, **options):
+        total = options['bookings']
+        steps = []
+        step = 1000
+        while step < total:
+            steps.append(step)
+            step *= 10
+        steps.append(total)
+
+        with transaction.atomic():
+            cars = self._create_cars(options['cars'])
+            user = User.objects.create_user(
+                username=f'benchmark-{time.time_ns()}')
+            created = 0
+            self.stdout.write(
+                f"{'bookings':>10} {'is_car_available':>20} "
+                f"{'available_cars':>18}")
+            for step in steps:
+                while created < step:
+                    batch = min(BATCH_SIZE, step - created)
+                    self._create_bookings(user, cars, created, batch)
+                    created += batch
+                self._analyze()
+                single, fleet = self._measure(cars, options['queries'])
+                self.stdout.write(
+                    f'{created:>10} {single:>17.3f} ms {fleet:>15.3f} ms')
+            transaction.set_rollback(True)
+
+    def _create_cars(self, count):
+        prefix = time.time_ns()
+        Car.objects.bulk_create([
+            Car(make='Bench', model='Mark', year=2023,
+                license_plate=f'B{prefix}-{i}',
+                daily_rate=Decimal('50.00'))
+            for i in range(count)
+        ])
+        return list(Car.objects.filter(
+            license_plate__startswith=f'B{prefix}-'))
+
+    def _create_bookings(self, user, cars, offset, count):
+        # Bookings are laid out back to back per car, spread over the
+        # past so the measured window sits in front of a long history.
+        now = timezone.now()
+        bookings = []
+        for i in range(offset, offset + count):
+            car = cars[i % len(cars)]
+            slot = i // len(cars)
+            return_date = now - timedelta(days=3 * slot + 1)
+            bookings.append(Booking(
+                user=user, car=car,
+                rental_date=return_date - timedelta(days=2),
+                return_date=return_date,
+                total_cost=Decimal('100.00'),
+                status=random.choice(('Completed', 'Canceled',
+                                      'Confirmed')),
+            ))
+        Booking.objects.bulk_create(bookings, batch_size=BATCH_SIZE)
+
+    def _analyze(self):
+        if connection.vendor in ('postgresql', 'sqlite'):
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Booking._meta.db_table}')
+
+    def _measure(self, cars, queries):
+        start = timezone.now() + timedelta(days=1)
+        end = start + timedelta(days=3)
+        fleet = Car.objects.filter(pk__in=[car.pk for car in cars])
+
+        began = time.perf_counter()
+        for _ in range(queries):
+            is_car_available(random.choice(cars), start, end)
+        single = (time.perf_counter() - began) * 1000 / queries
+
+        fleet_queries = max(1, queries // 10)
+        began = time.perf_counter()
+        for _ in range(fleet_queries):
+            available_cars(start, end, fleet).count()
+        whole = (time.perf_counter() - began) * 1000 / fleet_queries
+        return single, whole
@@ -0,0 +1,39 @@
+"""
+Management command completing the rentals that have ended.
+
+Confirmed bookings whose return date has passed are moved to
+'Completed' and their cars released (see 'autoR5.completion'). The work
+is done with set-based 'UPDATE' statements in bounded batches, so the
+command stays fast with hundreds of thousands of bookings.
+
+Schedule it to run regularly, for example every ten minutes from cron
+or the Heroku Scheduler.
+
+Usage:
+    python manage.py complete_bookings
+    python manage.py complete_bookings --batch-size 5000
+"""
+from django.core.management.base import BaseCommand
+from autoR5.completion import complete_expired_bookings
+
+
+class Command(BaseCommand):
+    """
+    Complete expired confirmed bookings and release their cars.
+    """
+    help = ('Move confirmed bookings whose return date has passed to '
+            'Completed and mark their cars available.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Maximum number of bookings updated per batch.')
+
+    def handle(self, *args, **options):
+        results = complete_expired_bookings(
+            batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Completed {results['completed']} booking(s) and released "
+            f"{results['cars']} car(s) in {results['batches']} batch(es), "
+            f"{results['elapsed']:.2f}s "
+            f"({results['per_second']:.0f} bookings/s)."))
@@ -0,0 +1,54 @@
+"""
+Management command reverse geocoding the queued cars.
+
+The 'Update Location' admin action queues the selected cars as a
+'GeocodeJob' (see 'autoR5.geocoding'). This command is the worker that
+fills in their city and address: identical points are looked up once,
+known points come from the 'GeocodedLocation' cache and the geocoding
+service is called at most '--rate' times per second.
+
+Run it once (it processes every queued job and exits) or keep it
+running with '--loop' as a worker process.
+
+Usage:
+    python manage.py process_geocoding
+    python manage.py process_geocoding --loop --rate 1
+"""
+import time
+from django.core.management.base import BaseCommand
+from autoR5.geocoding import GEOCODE_RATE, process_geocode_jobs
+
+
+class Command(BaseCommand):
+    """
+    Reverse geocode the cars of the queued geocoding jobs.
+    """
+    help = ('Fill in the city and address of the cars queued by the '
+            'Update Location admin action.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Number of cars updated per batch.')
+        parser.add_argument(
+            '--rate', type=float, default=GEOCODE_RATE,
+            help='Maximum number of geocoding requests per second.')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep polling for queued jobs instead of exiting.')
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='Seconds to wait between polls when idle with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            job = process_geocode_jobs(rate=options['rate'],
+                                       batch_size=options['batch_size'])
+            if job is not None:
+                self.stdout.write(
+                    f"{job}: {job.status}, {job.processed} car(s), "
+                    f"{job.updated} updated, {job.failed} failed.")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
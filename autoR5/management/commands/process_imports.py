@@ -0,0 +1,49 @@
+"""
+Management command importing the queued fleet CSV files.
+
+Large uploads of the admin CSV import are stored in the database as
+'ImportJob' rows (see 'autoR5.import_jobs'). This command is the worker
+that imports them, one job at a time, recording its progress on the job
+for the admin page to show. It runs as the 'importer' process of the
+'Procfile'.
+
+Without '--loop' it imports every queued file and exits.
+
+Usage:
+    python manage.py process_imports
+    python manage.py process_imports --loop --interval 5
+"""
+import time
+from django.core.management.base import BaseCommand
+from autoR5.import_jobs import process_import_jobs
+
+
+class Command(BaseCommand):
+    """
+    Import the queued fleet CSV files.
+    """
+    help = 'Import the fleet CSV files queued from the admin.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows written per batch.')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep polling for queued imports instead of exiting.')
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='Seconds to wait between polls when idle with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            job = process_import_jobs(options['batch_size'])
+            if job is not None:
+                self.stdout.write(
+                    f"{job}: {job.status}, {job.rows} row(s), "
+                    f"{job.created} created, {job.updated} updated, "
+                    f"{job.failed} failed.")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,54 @@
+"""
+Management command issuing the queued Stripe refunds.
+
+Approved cancellation requests of paid bookings are queued as
+'RefundJob' rows (see 'autoR5.refunds'). This command is the worker
+that issues them: it claims due jobs in batches, calls Stripe at most
+'--rate' times per second and reschedules failed attempts with
+exponential backoff.
+
+Run it once (for example from a scheduler) or keep it running with
+'--loop' as a worker process next to the web process.
+
+Usage:
+    python manage.py process_refunds
+    python manage.py process_refunds --loop --batch-size 100 --rate 20
+"""
+import time
+from django.core.management.base import BaseCommand
+from autoR5.refunds import process_refund_jobs
+
+
+class Command(BaseCommand):
+    """
+    Issue queued refunds in rate-limited batches.
+    """
+    help = 'Issue the queued Stripe refunds of approved cancellations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=50,
+            help='Maximum number of refunds claimed per batch.')
+        parser.add_argument(
+            '--rate', type=float, default=10,
+            help='Maximum number of Stripe calls per second.')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep polling for due refunds instead of exiting.')
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='Seconds to wait between polls when idle with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            results = process_refund_jobs(options['batch_size'],
+                                          options['rate'])
+            processed = results['succeeded'] + results['failed']
+            if processed:
+                self.stdout.write(
+                    f"Refunds: {results['succeeded']} succeeded, "
+                    f"{results['failed']} failed.")
+            if not options['loop']:
+                break
+            if processed < options['batch_size']:
+                time.sleep(options['interval'])
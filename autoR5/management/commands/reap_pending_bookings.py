@@ -0,0 +1,63 @@
+"""
+Management command cleaning up abandoned Pending bookings.
+
+Every submitted booking form creates a Pending booking and payment.
+Bookings that are still unpaid after 'PENDING_BOOKING_TTL' seconds are
+canceled, releasing their dates, or deleted with '--delete' (see
+'autoR5.abandoned'). The work is done in batches with set-based
+statements and is safe to run while customers are checking out.
+
+Run it from a scheduler (cron or the Heroku Scheduler, for example every
+fifteen minutes) or keep it running with '--loop'.
+
+Usage:
+    python manage.py reap_pending_bookings
+    python manage.py reap_pending_bookings --ttl 3600 --delete
+    python manage.py reap_pending_bookings --loop --interval 600
+"""
+import time
+from django.core.management.base import BaseCommand
+from autoR5.abandoned import reap_abandoned_bookings
+
+
+class Command(BaseCommand):
+    """
+    Cancel or delete Pending bookings that were never paid.
+    """
+    help = ('Cancel (or delete) Pending bookings older than the '
+            'time-to-live that have no successful payment.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl', type=int, default=None,
+            help='Age in seconds after which an unpaid booking is '
+                 'abandoned (default: PENDING_BOOKING_TTL).')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Maximum number of bookings handled per batch.')
+        parser.add_argument(
+            '--delete', action='store_true',
+            help='Delete abandoned bookings and their payments instead '
+                 'of canceling them.')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running instead of exiting after one pass.')
+        parser.add_argument(
+            '--interval', type=float, default=600,
+            help='Seconds to wait between passes with --loop.')
+
+    def handle(self, *args, **options):
+        action = 'Deleted' if options['delete'] else 'Canceled'
+        while True:
+            results = reap_abandoned_bookings(
+                ttl=options['ttl'], batch_size=options['batch_size'],
+                delete=options['delete'])
+            self.stdout.write(
+                f"{action} {results['bookings']} booking(s) and "
+                f"{results['payments']} payment(s) in "
+                f"{results['batches']} batch(es), skipped "
+                f"{results['skipped']} in use, {results['elapsed']:.2f}s "
+                f"({results['per_second']:.0f} bookings/s).")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,37 @@
+"""
+Management command recomputing the denormalized car ratings.
+
+The 'rating_sum', 'rating_count' and 'rating_average' columns of 'Car'
+are kept up to date by the 'Review' signal receivers. Changes that
+bypass signals (such as 'QuerySet.update', raw SQL or fixtures loaded
+with 'loaddata') can leave them stale; this command rebuilds them from
+the approved reviews in a single 'UPDATE' statement.
+
+Usage:
+    python manage.py rebuild_ratings
+    python manage.py rebuild_ratings --car 12 --car 15
+"""
+from django.core.management.base import BaseCommand
+from autoR5.models import Car
+from autoR5.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the rating aggregates of the fleet from approved reviews.
+    """
+    help = ('Recompute the rating sum, count and average of every car '
+            'from its approved reviews.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--car', type=int, action='append', dest='cars',
+            help='Only rebuild the car with this id (repeatable).')
+
+    def handle(self, *args, **options):
+        queryset = Car.objects.all()
+        if options['cars']:
+            queryset = queryset.filter(pk__in=options['cars'])
+        updated = rebuild_ratings(queryset)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt ratings for {updated} car(s).'))
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-16 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autoR5', '0018_alter_car_car_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['car', 'status', 'return_date', 'rental_date'], name='booking_availability_idx'),
+        ),
+    ]
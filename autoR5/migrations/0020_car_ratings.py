@@ -0,0 +1,46 @@
+# Generated by Django 4.2.5 on 2026-10-16 22:17
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Avg, Count, Sum
+
+
+def populate_ratings(apps, schema_editor):
+    Car = apps.get_model('autoR5', 'Car')
+    Review = apps.get_model('autoR5', 'Review')
+    totals = Review.objects.filter(approved=True).values('car').annotate(
+        total=Sum('rating'), count=Count('id'), average=Avg('rating'))
+    for row in totals:
+        Car.objects.filter(pk=row['car']).update(
+            rating_sum=row['total'], rating_count=row['count'],
+            rating_average=round(Decimal(row['average']), 2))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autoR5', '0019_booking_availability_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='rating_average',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='car',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='car',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['-rating_average', '-rating_count', 'id'], name='car_rating_idx'),
+        ),
+        migrations.RunPython(populate_ratings, migrations.RunPython.noop),
+    ]
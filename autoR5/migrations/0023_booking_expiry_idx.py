@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-16 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autoR5', '0022_stripeevent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status', 'return_date'], name='booking_expiry_idx'),
+        ),
+    ]
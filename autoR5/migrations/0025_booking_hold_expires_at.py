@@ -0,0 +1,37 @@
+# Generated by Django 4.2.5 on 2026-10-17 01:05
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_holds(apps, schema_editor):
+    """
+    Give the Pending bookings made before checkout holds existed the
+    hold they would have had, so they stop blocking their car and can
+    be reaped. Only a processing payment leaves a Pending booking
+    without a hold.
+    """
+    Booking = apps.get_model('autoR5', 'Booking')
+    ttl = timedelta(seconds=getattr(settings, 'BOOKING_HOLD_TTL', 15 * 60))
+    Booking.objects.filter(
+        status='Pending', hold_expires_at__isnull=True).update(
+            hold_expires_at=F('created_at') + ttl)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autoR5', '0024_booking_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_holds, migrations.RunPython.noop),
+    ]
@@ -4,10 +4,16 @@ and imports necessary for the AutoR5 project.
 
 It includes the following imports and models:
 
+- `io` and `os` for reading import files back as a stream and naming
+    import jobs after their file.
 - `Decimal` from the `decimal` module for
     precise decimal arithmetic.
+- `settings` from `django.conf` for the import file chunk size.
 - `User` model from `django.contrib.auth.models`
     for user authentication and management.
+- `File` from `django.core.files.base` and `Storage` from
+    `django.core.files.storage` for keeping import files in the
+    database.
 - `MinValueValidator` and `MaxValueValidator`
     from `django.core.validators` for value validation.
 - `models` from `django.db` for defining custom
@@ -18,17 +24,25 @@ It includes the following imports and models:
     time and time zones.
 - `CloudinaryField` from `cloudinary.models`
     for integrating Cloudinary image storage.
+- `rental_cost` from `.pricing` for pricing bookings.
 
 These elements are used to create and manage models for the AutoR5 project.
 """
 
+import io
+import os
 from decimal import Decimal
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files.base import File
+from django.core.files.storage import Storage
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.deconstruct import deconstructible
 from cloudinary.models import CloudinaryField
+from .pricing import rental_cost
 
 
 class Car(models.Model):
@@ -56,6 +70,10 @@ class Car(models.Model):
         (e.g., 'SUV').
         fuel_type (str, optional): The type of fuel the car uses
         (e.g., 'Petrol').
+        rating_sum (int): The sum of the ratings of approved reviews.
+        rating_count (int): The number of approved reviews.
+        rating_average (Decimal): The average rating of approved
+        reviews, or 0 when there are none.
 
     Methods:
         __str__(): Returns a human-readable string
@@ -67,6 +85,10 @@ class Car(models.Model):
         should be selected
         from predefined choices (CAR_TYPES and FUEL_TYPES) using
         the specified format.
+
+        The rating fields are denormalized from approved reviews and
+        kept up to date by the 'Review' signal receivers (see
+        'autoR5.ratings'). They are not edited directly.
     """
     make = models.CharField(max_length=50)
     model = models.CharField(max_length=50)
@@ -102,6 +124,23 @@ class Car(models.Model):
     fuel_type = models.CharField(
         max_length=20, choices=FUEL_TYPES, blank=True, null=True
     )
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.DecimalField(
+        max_digits=3, decimal_places=2, default=Decimal("0.00"),
+        editable=False)
+
+    class Meta:
+        """
+        Index serving the "sort by rating" option of the fleet listing,
+        matching the ordering used by 'autoR5.pagination.CAR_SORTS'.
+        """
+        indexes = [
+            models.Index(
+                fields=['-rating_average', '-rating_count', 'id'],
+                name='car_rating_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.year} {self.make} {self.model}"
@@ -141,6 +180,14 @@ class Booking(models.Model):
     - `status`: A choice field for booking status, which can be
     'Pending,' 'Confirmed,' 'Completed,' or 'Canceled'.
 
+    - `created_at`: When the booking was made. Pending bookings that
+    stay unpaid for too long are canceled by the
+    'reap_pending_bookings' management command.
+
+    - `hold_expires_at`: Until when a Pending booking holds its car
+    during checkout (see 'autoR5.reservations'). Empty means the hold
+    does not expire, for example while a payment is processing.
+
     Methods:
     - `__str__`: Returns a string representation of the booking in the format
     "Booking for {car} by {user}".
@@ -148,9 +195,13 @@ class Booking(models.Model):
     - `calculate_total_cost`: Calculates the total cost of
     the booking based on the rental period and car's daily rate.
 
-    - `save`: Overrides the default `save` method to automatically
-    update the booking and car availability status when the
-    booking is complete and calculate the total cost before saving.
+    - `pricing_key`: Returns the car and dates the total cost depends
+    on.
+
+    - `save`: Overrides the default `save` method to calculate the
+    total cost before saving when the booking is new or its car or
+    dates changed. Finished rentals are completed by the
+    'complete_bookings' management command, not on save.
 
     This model represents user bookings in the AutoR5 project.
     """
@@ -169,6 +220,38 @@ class Booking(models.Model):
     status = models.CharField(
         max_length=20, choices=BOOKING_STATUS_CHOICES, default="Pending"
     )
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    hold_expires_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        """
+        Composite index serving the half-open interval overlap query
+        used by the availability engine ('autoR5.availability').
+
+        'return_date' comes before 'rental_date' because the lower
+        bound (return_date > start) is the selective one: it skips the
+        whole rental history of a car, whereas almost every past
+        booking satisfies rental_date < end.
+
+        'booking_expiry_idx' serves the fleet-wide search for confirmed
+        bookings whose return date has passed ('autoR5.completion'), and
+        'booking_abandoned_idx' the search for old pending bookings
+        ('autoR5.abandoned').
+        """
+        indexes = [
+            models.Index(
+                fields=['car', 'status', 'return_date', 'rental_date'],
+                name='booking_availability_idx',
+            ),
+            models.Index(
+                fields=['status', 'return_date'],
+                name='booking_expiry_idx',
+            ),
+            models.Index(
+                fields=['status', 'created_at'],
+                name='booking_abandoned_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"Booking for {self.car} by {self.user}"
@@ -185,8 +268,8 @@ class Booking(models.Model):
         - It calculates the number of days between the `rental_date` and
         `return_date` and ensures it's at least 1 day.
 
-        - It converts the car's daily rate to a Decimal and multiplies
-        it by the rental period to determine the total cost.
+        - It multiplies the car's daily rate by the rental period to
+        determine the total cost (see `autoR5.pricing.rental_cost`).
 
         If `return_date` is not specified (i.e., the booking is pending):
         - The total cost is set to Decimal('0.00').
@@ -204,24 +287,39 @@ class Booking(models.Model):
         - Call this method on a Booking instance to calculate the total cost.
         """
         if self.return_date:
-            rental_period = (self.return_date - self.rental_date).days
-            if rental_period < 1:
-                rental_period = 1
-            car_daily_rate = Decimal(str(self.car.daily_rate))
-            self.total_cost = car_daily_rate * Decimal(rental_period)
+            self.total_cost = rental_cost(
+                self.car.daily_rate, self.rental_date, self.return_date)
         else:
             self.total_cost = Decimal("0.00")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._priced_as = instance.pricing_key()
+        return instance
+
+    def pricing_key(self):
+        """
+        Return the (car_id, rental_date, return_date) the total cost
+        depends on, or None when one of them was not loaded.
+        """
+        try:
+            return tuple(self.__dict__[field] for field in
+                         ('car_id', 'rental_date', 'return_date'))
+        except KeyError:
+            return None
+
     def save(self, *args, **kwargs):
-        if (
-            self.status == "Confirmed"
-            and self.return_date
-            and self.return_date < timezone.now()
-        ):
-            self.status = "Completed"
-            self.car.is_available = True
-        self.calculate_total_cost()
+        # Finished rentals are moved to 'Completed' by the
+        # 'complete_bookings' management command ('autoR5.completion').
+        # The total is only recomputed when the car or dates changed,
+        # so status changes do not load the car.
+        key = self.pricing_key()
+        if (self.total_cost is None or key is None
+                or key != getattr(self, '_priced_as', None)):
+            self.calculate_total_cost()
         super().save(*args, **kwargs)
+        self._priced_as = self.pricing_key()
 
 
 class Payment(models.Model):
@@ -330,6 +428,462 @@ class CancellationRequest(models.Model):
         return f"Cancellation request for {self.booking}"
 
 
+class RefundJob(models.Model):
+    """
+    Represents a queued Stripe refund for a paid booking.
+
+    Approving a cancellation request of a paid booking only creates a
+    refund job; the refund itself is issued later by the
+    'process_refunds' worker (see 'autoR5.refunds'), which retries
+    failed attempts with exponential backoff.
+
+    Job Status Choices:
+    - 'Queued': The refund is waiting to be issued, possibly after a
+    failed attempt.
+    - 'Succeeded': Stripe accepted the refund.
+    - 'Failed': The refund failed too often and needs manual attention.
+
+    Fields:
+    - payment (OneToOneField): The payment to refund. There is at most
+    one job per payment, so a payment is never refunded twice.
+
+    - cancellation_request (ForeignKey, optional): The approved
+    cancellation request that queued the job.
+
+    - status (CharField): The job status (default is 'Queued').
+
+    - attempts (PositiveIntegerField): The number of refund attempts
+    made so far.
+
+    - next_attempt_at (DateTimeField): When the worker may next pick up
+    the job.
+
+    - last_error (TextField): The error of the last failed attempt.
+
+    - refund_id (CharField, optional): The Stripe refund id, once the
+    refund succeeded.
+
+    - created_at (DateTimeField): When the job was queued
+    (auto-generated).
+
+    - updated_at (DateTimeField): When the job last changed
+    (auto-generated).
+
+    Properties:
+    - idempotency_key: The Stripe idempotency key of the refund, derived
+    from the payment so retries never create a second refund.
+
+    Methods:
+    - __str__: Returns a string representation of the refund job.
+    """
+    JOB_STATUS_CHOICES = (
+        ("Queued", "Queued"),
+        ("Succeeded", "Succeeded"),
+        ("Failed", "Failed"),
+    )
+
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE)
+    cancellation_request = models.ForeignKey(
+        CancellationRequest, on_delete=models.SET_NULL,
+        blank=True, null=True)
+    status = models.CharField(
+        max_length=20, choices=JOB_STATUS_CHOICES, default="Queued")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    refund_id = models.CharField(max_length=255, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        """
+        Index serving the worker's "due jobs" query.
+        """
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'],
+                         name='refund_job_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Refund job for {self.payment}"
+
+    @property
+    def idempotency_key(self):
+        """
+        The Stripe idempotency key used for every attempt of this job.
+        """
+        return f"refund-payment-{self.payment_id}"
+
+
+class StripeEvent(models.Model):
+    """
+    Records a Stripe webhook event that has been processed.
+
+    Stripe delivers every event at least once and retries deliveries
+    that timed out, so the same event can arrive several times, even
+    concurrently. The unique 'event_id' lets the webhook handler (see
+    'autoR5.payments.handle_stripe_event') apply each event only once.
+
+    Fields:
+    - event_id (CharField): The Stripe event id, unique.
+
+    - event_type (CharField): The event type, such as
+    'payment_intent.succeeded'.
+
+    - received_at (DateTimeField): When the event was processed
+    (auto-generated).
+
+    Methods:
+    - __str__: Returns a string representation of the event.
+    """
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.event_type} ({self.event_id})"
+
+
+# Size, in bytes, of the chunks an import file is stored in.
+IMPORT_FILE_CHUNK_SIZE = getattr(
+    settings, 'IMPORT_FILE_CHUNK_SIZE', 1024 * 1024)
+
+
+class ImportFile(models.Model):
+    """
+    Represents a file of a background CSV import, stored in the
+    database.
+
+    The web process saves uploads and the 'process_imports' worker
+    reads them. On Heroku they run on separate dynos, each with its own
+    ephemeral disk, so the files are kept in the database both share
+    (see 'ImportJobStorage'). The content is split into
+    'ImportFileChunk' rows, so neither saving nor reading a file holds
+    all of it in memory.
+
+    Fields:
+    - name (CharField): The unique name of the file.
+
+    - size (PositiveBigIntegerField): The size of the file in bytes.
+
+    - created_at (DateTimeField): When the file was saved
+    (auto-generated).
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class ImportFileChunk(models.Model):
+    """
+    Represents a part of an 'ImportFile'.
+
+    Every chunk but the last holds exactly 'IMPORT_FILE_CHUNK_SIZE'
+    bytes, so the chunk holding any position of the file is known
+    without reading the others.
+
+    Fields:
+    - file (ForeignKey): The file the chunk belongs to.
+
+    - index (PositiveIntegerField): The position of the chunk in the
+    file, starting at 0.
+
+    - data (BinaryField): The content of the chunk.
+    """
+    file = models.ForeignKey(
+        ImportFile, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['file', 'index'],
+                                    name='import_file_chunk_unique'),
+        ]
+
+
+class ImportFileReader(io.RawIOBase):
+    """
+    Seekable stream over the chunks of an 'ImportFile', loading one
+    chunk at a time.
+    """
+
+    def __init__(self, import_file):
+        super().__init__()
+        self.file_id = import_file.pk
+        self.size = import_file.size
+        self.position = 0
+        self.chunk = (None, b'')
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        start = {io.SEEK_SET: 0, io.SEEK_CUR: self.position,
+                 io.SEEK_END: self.size}[whence]
+        self.position = max(start + offset, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        index, offset = divmod(self.position, IMPORT_FILE_CHUNK_SIZE)
+        if self.chunk[0] != index:
+            self.chunk = (index, bytes(
+                ImportFileChunk.objects.filter(
+                    file_id=self.file_id, index=index)
+                .values_list('data', flat=True).get()))
+        data = self.chunk[1][offset:offset + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+@deconstructible
+class ImportJobStorage(Storage):
+    """
+    Storage keeping the files of import jobs in the 'ImportFile' table.
+
+    The media storage of the project is Cloudinary, which is meant for
+    images and serves files at public URLs. Import files hold fleet
+    data and are only downloaded through the admin, so this storage has
+    no URLs.
+    """
+
+    def _open(self, name, mode='rb'):
+        import_file = ImportFile.objects.filter(name=name).first()
+        if import_file is None:
+            raise FileNotFoundError(name)
+        return File(io.BufferedReader(ImportFileReader(import_file),
+                                      IMPORT_FILE_CHUNK_SIZE), name=name)
+
+    def _save(self, name, content):
+        with transaction.atomic():
+            import_file = ImportFile.objects.create(name=name)
+            pending = bytearray()
+            index = 0
+            for data in content.chunks(IMPORT_FILE_CHUNK_SIZE):
+                pending += data
+                import_file.size += len(data)
+                while len(pending) >= IMPORT_FILE_CHUNK_SIZE:
+                    ImportFileChunk.objects.create(
+                        file=import_file, index=index,
+                        data=bytes(pending[:IMPORT_FILE_CHUNK_SIZE]))
+                    del pending[:IMPORT_FILE_CHUNK_SIZE]
+                    index += 1
+            if pending:
+                ImportFileChunk.objects.create(
+                    file=import_file, index=index, data=bytes(pending))
+            import_file.save(update_fields=['size'])
+        return name
+
+    def delete(self, name):
+        ImportFile.objects.filter(name=name).delete()
+
+    def exists(self, name):
+        return ImportFile.objects.filter(name=name).exists()
+
+    def size(self, name):
+        return ImportFile.objects.filter(name=name).values_list(
+            'size', flat=True).get()
+
+
+class ImportJob(models.Model):
+    """
+    Represents a fleet CSV import processed in the background.
+
+    Large uploads are stored in the database and imported by the
+    'process_imports' worker (see 'autoR5.import_jobs') instead of
+    inside the admin's request. The worker records its progress on the
+    job, which the admin page polls.
+
+    Job Status Choices:
+    - 'Queued': The file is waiting for a worker.
+    - 'Running': A worker is importing the file.
+    - 'Succeeded': The file was imported; some rows may have failed.
+    - 'Failed': The import stopped with an error.
+
+    Fields:
+    - file (FileField): The uploaded CSV file.
+
+    - user (ForeignKey, optional): The staff member who uploaded it.
+
+    - status (CharField): The job status (default is 'Queued').
+
+    - rows, created, updated and failed (PositiveIntegerField): The
+    number of rows parsed, cars created and updated and rows skipped
+    so far.
+
+    - failures_file (FileField, optional): A CSV file of the skipped
+    rows with their line number and error, once the job is done.
+
+    - error (TextField): The error that stopped a failed job.
+
+    - created_at (DateTimeField): When the job was queued
+    (auto-generated).
+
+    - updated_at (DateTimeField): When the job last reported progress.
+
+    - finished_at (DateTimeField, optional): When the job ended.
+
+    Methods:
+    - __str__: Returns a string representation of the import job.
+    """
+    JOB_STATUS_CHOICES = (
+        ("Queued", "Queued"),
+        ("Running", "Running"),
+        ("Succeeded", "Succeeded"),
+        ("Failed", "Failed"),
+    )
+
+    file = models.FileField(upload_to='car_imports/',
+                            storage=ImportJobStorage())
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, blank=True, null=True)
+    status = models.CharField(
+        max_length=20, choices=JOB_STATUS_CHOICES, default="Queued")
+    rows = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    failures_file = models.FileField(
+        upload_to='car_import_failures/', storage=ImportJobStorage(),
+        blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        """
+        Index serving the worker's "next job" query.
+        """
+        indexes = [
+            models.Index(fields=['status', 'created_at'],
+                         name='import_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Import of {os.path.basename(self.file.name)}"
+
+
+class GeocodedLocation(models.Model):
+    """
+    Caches the reverse geocoding of a point.
+
+    Coordinates are rounded to 'GEOCODE_PRECISION' decimal places (see
+    'autoR5.geocoding') before they are looked up, so cars parked at
+    the same spot share one entry and the geocoding service is asked
+    about each point only once.
+
+    Fields:
+    - key (CharField): The rounded '<latitude>,<longitude>', unique.
+
+    - latitude and longitude (DecimalField): The rounded coordinates.
+
+    - city (CharField, optional): The city, town or village of the
+    point, when the service returned one.
+
+    - address (CharField, optional): The full address of the point.
+
+    - created_at (DateTimeField): When the point was geocoded
+    (auto-generated).
+
+    Methods:
+    - __str__: Returns a string representation of the location.
+    """
+    key = models.CharField(max_length=50, unique=True)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    city = models.CharField(max_length=255, blank=True, null=True)
+    address = models.CharField(max_length=255, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.address}"
+
+
+class GeocodeJob(models.Model):
+    """
+    Represents a batch of cars whose location is reverse geocoded in
+    the background.
+
+    The 'Update Location' admin action queues a job for the selected
+    cars; the 'process_geocoding' worker (see 'autoR5.geocoding')
+    resolves their coordinates at a limited rate and records its
+    progress on the job.
+
+    Job Status Choices:
+    - 'Queued': The job is waiting for a worker.
+    - 'Running': A worker is geocoding the cars.
+    - 'Succeeded': Every car was processed; some may have failed.
+    - 'Failed': The job stopped with an error.
+
+    Fields:
+    - cars (ManyToManyField): The cars to geocode.
+
+    - user (ForeignKey, optional): The staff member who queued the job.
+
+    - status (CharField): The job status (default is 'Queued').
+
+    - processed, updated and failed (PositiveIntegerField): The number
+    of cars processed, updated and left unchanged because their point
+    could not be geocoded, so far.
+
+    - error (TextField): The error that stopped a failed job.
+
+    - created_at (DateTimeField): When the job was queued
+    (auto-generated).
+
+    - updated_at (DateTimeField): When the job last reported progress.
+
+    - finished_at (DateTimeField, optional): When the job ended.
+
+    Methods:
+    - __str__: Returns a string representation of the geocoding job.
+    """
+    JOB_STATUS_CHOICES = (
+        ("Queued", "Queued"),
+        ("Running", "Running"),
+        ("Succeeded", "Succeeded"),
+        ("Failed", "Failed"),
+    )
+
+    cars = models.ManyToManyField(Car)
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, blank=True, null=True)
+    status = models.CharField(
+        max_length=20, choices=JOB_STATUS_CHOICES, default="Queued")
+    processed = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        """
+        Index serving the worker's "next job" query.
+        """
+        indexes = [
+            models.Index(fields=['status', 'created_at'],
+                         name='geocode_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Geocoding job {self.pk}"
+
+
 class Review(models.Model):
     """
     Represents a user review for a specific car.
@@ -0,0 +1,168 @@
+"""
+Keyset (cursor) pagination for the 'autoR5' Django web application.
+
+Offset pagination ('Paginator') needs a 'COUNT(*)' query for the page
+numbers and makes the database walk past every skipped row on deep
+pages. Keyset pagination instead remembers the ordering key of the
+last row shown and asks for the rows that come after it, which the
+database answers with an index range scan no matter how deep the page.
+
+- 'base64' and 'json' for encoding the opaque cursor.
+- 'DjangoJSONEncoder' from 'django.core.serializers.json' for
+    serializing decimals and dates inside the cursor.
+- 'ValidationError' from 'django.core.exceptions' for rejecting
+    cursors that do not match the ordering fields.
+- 'Q' from 'django.db.models' for building the keyset filter.
+
+Usage:
+'keyset_page' is used by the 'cars_list' and 'cars_list_json' views
+and for the reviews of the 'car_detail' and 'car_reviews' views.
+The ordering must end in a unique, non-null field (such as 'id') so
+every row has a distinct position.
+"""
+import base64
+import json
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+# Stable ordering of the fleet listing, with 'id' as the tie-breaker.
+CAR_ORDERING = ('daily_rate', 'id')
+
+# Orderings selectable with the 'sort' query parameter. The rating
+# ordering is served by the 'car_rating_idx' index on 'Car'.
+CAR_SORTS = {
+    'price': CAR_ORDERING,
+    'rating': ('-rating_average', '-rating_count', 'id'),
+}
+
+
+# Newest reviews first on the car detail page.
+REVIEW_ORDERING = ('-id',)
+
+
+def car_ordering(sort):
+    """
+    Return the fleet ordering for a 'sort' value, defaulting to price.
+    """
+    return CAR_SORTS.get(sort, CAR_ORDERING)
+
+
+class KeysetPage:
+    """
+    A page of results produced by 'keyset_page'.
+
+    Attributes:
+    - 'object_list': The objects on this page.
+    - 'next_cursor': The cursor of the following page, or None when
+    this is the last page.
+
+    Usage:
+    Iterate over the page like a list. 'has_next' mirrors the
+    attribute of the same name on Django's 'Page' so templates can
+    treat both kinds of page alike.
+    """
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(values):
+    """
+    Encode the ordering key of a row as an opaque, URL-safe cursor.
+    """
+    data = json.dumps(list(values), cls=DjangoJSONEncoder,
+                      separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by 'encode_cursor'.
+
+    Returns:
+    The list of ordering key values, or None when the cursor is empty
+    or malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def keyset_filter(ordering, values):
+    """
+    Build the filter selecting rows that sort after 'values'.
+
+    Purpose:
+    For an ordering (a, b, c) the rows after (x, y, z) are those with
+    a > x, or a = x and b > y, or a = x, b = y and c > z. Descending
+    fields ('-name') use '<' instead of '>'.
+
+    Args:
+    - 'ordering': The ordering fields, as passed to 'order_by'.
+    - 'values': The ordering key of the last row already shown.
+
+    Returns:
+    A 'Q' object.
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+def keyset_page(queryset, after=None, per_page=8, ordering=CAR_ORDERING):
+    """
+    Return one page of 'queryset' following the cursor 'after'.
+
+    Purpose:
+    Fetches 'per_page + 1' rows in a single query; the extra row only
+    tells whether a next page exists, so no 'COUNT(*)' is needed.
+
+    Args:
+    - 'queryset': The queryset to paginate. Its ordering is replaced
+    by 'ordering'.
+    - 'after': The cursor of the requested page. An empty or invalid
+    cursor yields the first page.
+    - 'per_page': The number of objects per page.
+    - 'ordering': The ordering fields. The last field must be unique.
+
+    Returns:
+    A 'KeysetPage'.
+    """
+    queryset = queryset.order_by(*ordering)
+    values = decode_cursor(after)
+    if values is not None and len(values) == len(ordering):
+        try:
+            queryset = queryset.filter(keyset_filter(ordering, values))
+        except (ValidationError, ValueError, TypeError):
+            pass
+
+    rows = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            [getattr(last, field.lstrip('-')) for field in ordering])
+    return KeysetPage(rows, next_cursor)
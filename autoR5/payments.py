@@ -0,0 +1,220 @@
+"""
+Stripe PaymentIntent handling for the 'autoR5' Django web application.
+
+The checkout page used to create a new PaymentIntent on every visit, so
+reloading the page or coming back to a pending booking left a trail of
+abandoned intents in Stripe and cost a network round trip each time.
+Every booking now has a single intent that is reused until the amount
+to charge changes.
+
+- 'stripe' for creating and updating PaymentIntents.
+- 'settings' from 'django.conf' for the Stripe key.
+- 'IntegrityError' and 'transaction' from 'django.db' for applying
+    webhook events exactly once.
+- 'is_car_available' from '.availability' and 'locked_car' from
+    '.reservations' for re-checking the dates of a late payment.
+- 'Booking', 'Payment', 'RefundJob' and 'StripeEvent' from '.models'
+    for accessing the data.
+
+Usage:
+'payment_intent_for' returns the client secret of the booking's intent.
+The secret is stored on 'Payment.payment_intent' (it starts with the
+intent id, which 'intent_id_from' extracts), so repeated visits to the
+checkout page make no Stripe calls at all. Creation sends an idempotency
+key derived from the booking and the amount, so a request retried after
+a timeout gets the intent Stripe already created.
+
+'handle_stripe_event' applies the 'payment_intent.*' events delivered
+to the Stripe webhook to the 'Payment' and its 'Booking', so payment
+state is correct even when the user closes the tab before returning to
+the confirmation page, which only reads the database.
+
+A payment can succeed after the booking's checkout hold lapsed and
+somebody else booked the dates. Before confirming, the dates are
+checked again under the car's lock; when they are taken, or the
+booking was already released (see 'autoR5.abandoned'), the booking is
+canceled and a 'RefundJob' returns the money instead.
+"""
+import stripe
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from .availability import is_car_available
+from .reservations import locked_car
+from .models import Booking, Payment, RefundJob, StripeEvent
+
+# Stripe client secrets are '<intent id>_secret_<random>'.
+CLIENT_SECRET_SEPARATOR = '_secret_'
+
+# The payment and booking status each event leads to, and the payment
+# statuses it may be applied to. Stripe does not guarantee the order of
+# deliveries, so a late 'processing' or 'payment_failed' event never
+# undoes a payment that already succeeded. A success is also recorded
+# on a 'Canceled' payment, whose booking was released, to refund it.
+PAYMENT_EVENT_TRANSITIONS = {
+    'payment_intent.succeeded': ('Paid', 'Confirmed',
+                                 ('Pending', 'Failed', 'Canceled')),
+    'payment_intent.processing': ('Pending', 'Pending', ('Pending',)),
+    'payment_intent.payment_failed': ('Failed', 'Canceled', ('Pending',)),
+    'payment_intent.canceled': ('Canceled', 'Canceled', ('Pending',)),
+}
+
+
+def amount_in_cents(amount):
+    """
+    Convert a decimal amount in euros to the integer Stripe expects.
+    """
+    return int(amount * 100)
+
+
+def intent_id_from(value):
+    """
+    Return the intent id of a stored intent id or client secret.
+    """
+    if not value:
+        return value
+    return value.split(CLIENT_SECRET_SEPARATOR)[0]
+
+
+def booking_payment(booking):
+    """
+    Return the payment of a booking, creating a pending one if the
+    booking has none yet.
+    """
+    payment = Payment.objects.filter(booking=booking).order_by('id').first()
+    if payment is None:
+        payment = Payment.objects.create(
+            user=booking.user,
+            booking=booking,
+            amount=booking.total_cost,
+            payment_method='Stripe',
+            payment_status='Pending',
+        )
+    return payment
+
+
+def payment_intent_for(booking, payment=None):
+    """
+    Return the client secret of the PaymentIntent paying for a booking.
+
+    Purpose:
+    Reuses the intent stored on the booking's payment when there is
+    one. When the booking's total changed since, the existing intent's
+    amount is updated instead of creating another one. A new intent is
+    only created for a payment without one.
+
+    Args:
+    - 'booking': The 'Booking' being paid for.
+    - 'payment': Its 'Payment', looked up (or created) when omitted.
+
+    Returns:
+    The client secret of the intent.
+
+    Raises:
+    - 'stripe.error.StripeError': If a Stripe call fails. Nothing is
+    stored in that case.
+    """
+    if payment is None:
+        payment = booking_payment(booking)
+    amount = amount_in_cents(booking.total_cost)
+    stored = payment.payment_intent
+
+    if stored and CLIENT_SECRET_SEPARATOR in stored:
+        if amount_in_cents(payment.amount) == amount:
+            return stored
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        intent = stripe.PaymentIntent.modify(
+            intent_id_from(stored), amount=amount)
+    elif stored:
+        # Only the intent id is known (the booking confirmation stores
+        # it); fetch the intent once to get its client secret back.
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        intent = stripe.PaymentIntent.retrieve(stored)
+        if intent.amount != amount:
+            intent = stripe.PaymentIntent.modify(intent.id, amount=amount)
+    else:
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        intent = stripe.PaymentIntent.create(
+            amount=amount,
+            currency='eur',
+            metadata={'booking_id': booking.id},
+            idempotency_key=f'booking-{booking.id}-intent-{amount}',
+        )
+
+    payment.payment_intent = intent.client_secret
+    payment.amount = booking.total_cost
+    payment.save(update_fields=['payment_intent', 'amount'])
+    return intent.client_secret
+
+
+def handle_stripe_event(event):
+    """
+    Apply a verified Stripe webhook event to the payment it concerns.
+
+    Purpose:
+    Records the event id in 'StripeEvent' and updates the 'Payment' and
+    'Booking' of the intent's 'booking_id' metadata in one transaction.
+    The payment row is locked with 'select_for_update', so concurrent
+    deliveries for the same booking are applied one after the other,
+    and an event that was already recorded is skipped.
+
+    A successful payment only confirms its booking if the payment was
+    not canceled and the car is still free for the booking's dates,
+    checked while holding the car's lock. Otherwise the booking is
+    canceled and a refund is queued.
+
+    Args:
+    - 'event': The event returned by 'stripe.Webhook.construct_event'.
+
+    Returns:
+    True when the event changed a payment, False when it was a
+    duplicate, of an unhandled type or not applicable.
+    """
+    transition = PAYMENT_EVENT_TRANSITIONS.get(event['type'])
+    if transition is None:
+        return False
+    payment_status, booking_status, from_statuses = transition
+    intent = event['data']['object']
+    booking_id = (intent.get('metadata') or {}).get('booking_id')
+
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                StripeEvent.objects.create(
+                    event_id=event['id'], event_type=event['type'])
+        except IntegrityError:
+            return False
+        if not booking_id:
+            return False
+        payment = (Payment.objects.select_for_update()
+                   .filter(booking_id=booking_id).order_by('id').first())
+        if payment is None or payment.payment_status not in from_statuses:
+            return False
+
+        released = payment.payment_status == 'Canceled'
+        payment.payment_status = payment_status
+        if payment_status != 'Paid':
+            apply_payment_event(payment, booking_status)
+            return True
+
+        payment.payment_intent = intent['id']
+        booking = Booking.objects.get(pk=payment.booking_id)
+        with locked_car(booking.car_id):
+            if released or not is_car_available(
+                    booking.car_id, booking.rental_date, booking.return_date,
+                    exclude_booking=booking):
+                booking_status = 'Canceled'
+                RefundJob.objects.get_or_create(payment=payment)
+            apply_payment_event(payment, booking_status)
+    return True
+
+
+def apply_payment_event(payment, booking_status):
+    """
+    Save the new status of a payment and set its booking's status.
+    """
+    payment.save(update_fields=['payment_status', 'payment_intent'])
+    # A queryset update skips 'Booking.save', which would load the car to
+    # recompute a total that does not change here. Once Stripe has the
+    # payment the checkout hold no longer expires.
+    Booking.objects.filter(pk=payment.booking_id).update(
+        status=booking_status, hold_expires_at=None)
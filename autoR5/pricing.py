@@ -0,0 +1,94 @@
+"""
+Rental pricing for the 'autoR5' Django web application.
+
+A rental costs the car's daily rate for every full day between the
+rental and return date, with a minimum of one day; a partly used last
+day is not charged. The rule lives here so bookings and quotes are
+priced the same way.
+
+- 'Decimal' from 'decimal' for exact money arithmetic.
+- 'apps' from 'django.apps' for loading the 'Car' model lazily, since
+    'autoR5.models' itself prices bookings with this module.
+
+Usage:
+'rental_cost' prices one rental from a daily rate. 'Booking' uses it
+when its car or dates change, and 'autoR5.quotes' with the rates it
+caches for the whole fleet. To price many rentals, pass those cached
+rates to 'price_rentals', or load the rates of the cars involved with
+one query through 'rate_table':
+
+    costs = price_rentals(rentals, cached_rates())
+    costs = price_rentals(rentals, rate_table({car_id for car_id, _, _
+                                               in rentals}))
+"""
+from decimal import Decimal
+from django.apps import apps
+
+ZERO = Decimal('0.00')
+
+
+def to_decimal(amount):
+    """
+    Return 'amount' as a 'Decimal', converting floats through their
+    string representation so 100.1 does not become 100.0999...
+    """
+    if isinstance(amount, Decimal):
+        return amount
+    return Decimal(str(amount))
+
+
+def rental_days(start, end):
+    """
+    Return the number of full days charged for a rental, at least one.
+    """
+    return max((end - start).days, 1)
+
+
+def rental_cost(daily_rate, start, end):
+    """
+    Return the cost of renting a car at 'daily_rate' from 'start' to
+    'end', or 0 while the return date is not known.
+    """
+    if not end:
+        return ZERO
+    return to_decimal(daily_rate) * rental_days(start, end)
+
+
+def rate_table(car_ids):
+    """
+    Load the daily rates of the given cars with a single query.
+
+    Returns:
+    A dictionary mapping car ids to their daily rate.
+    """
+    car_model = apps.get_model('autoR5', 'Car')
+    return dict(car_model.objects.filter(pk__in=car_ids)
+                .values_list('id', 'daily_rate'))
+
+
+def price_rentals(rentals, rates=None):
+    """
+    Price many rentals at once.
+
+    Args:
+    - 'rentals': (car_id, start, end) triples.
+    - 'rates': A rate table as returned by 'rate_table', or the
+    (daily_rate, is_available) tuples of 'autoR5.quotes.cached_rates'.
+    Loaded for the cars of 'rentals' when omitted.
+
+    Returns:
+    A list with the cost of every rental, in order.
+
+    Raises:
+    - 'KeyError': If a rental's car is not in the rate table.
+    """
+    rentals = list(rentals)
+    if rates is None:
+        rates = rate_table({car_id for car_id, _, _ in rentals})
+    costs = []
+    for car_id, start, end in rentals:
+        daily_rate = rates[car_id]
+        if isinstance(daily_rate, tuple):
+            daily_rate = daily_rate[0]
+        costs.append(rental_cost(daily_rate, start, end))
+    return costs
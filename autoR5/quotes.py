@@ -0,0 +1,79 @@
+"""
+Side-effect-free price quotes for the 'autoR5' Django web application.
+
+Seeing a price used to require submitting the booking form, which
+writes a Pending 'Booking' and 'Payment' that are left behind when the
+customer does not pay. Quotes are computed without writing anything,
+so the write path is only taken when the customer commits.
+
+- 'cache' from 'django.core.cache' for sharing the rate table between
+    requests.
+- 'facet_version' and 'FACET_CACHE_TIMEOUT' from '.facets' for keying
+    the rate table by the fleet version.
+- 'is_car_available' from '.availability' for the indexed overlap
+    check.
+- 'rental_cost' and 'rental_days' from '.pricing' for the pricing rule.
+- 'Car' from '.models' for loading the rates.
+
+Usage:
+'quote' prices a rental of one car and checks its availability. The
+daily rates of the whole fleet are cached under the facet cache version,
+which the 'Car' signal receivers bump on every change, so a quote costs
+one cache read and one indexed 'EXISTS' query.
+"""
+from django.core.cache import cache
+from .availability import is_car_available
+from .facets import FACET_CACHE_TIMEOUT, facet_version
+from .models import Car
+from .pricing import rental_cost, rental_days
+
+RATE_CACHE_KEY = 'autoR5:quotes:rates:{}'
+
+
+def cached_rates():
+    """
+    Return the daily rate and 'is_available' flag of every car.
+
+    Returns:
+    A dictionary mapping car ids to (daily_rate, is_available) tuples,
+    read from the cache entry of the current fleet version when
+    present.
+    """
+    key = RATE_CACHE_KEY.format(facet_version())
+    rates = cache.get(key)
+    if rates is None:
+        rates = {car_id: (daily_rate, is_available)
+                 for car_id, daily_rate, is_available in
+                 Car.objects.values_list('id', 'daily_rate', 'is_available')}
+        cache.set(key, rates, FACET_CACHE_TIMEOUT)
+    return rates
+
+
+def quote(car_id, start, end):
+    """
+    Price a rental of a car and check whether it can be booked.
+
+    Args:
+    - 'car_id': The primary key of the car.
+    - 'start': Aware datetime at which the rental starts.
+    - 'end': Aware datetime at which the car is returned.
+
+    Returns:
+    A dictionary with the 'car', 'start', 'end', charged 'days',
+    'daily_rate', 'total', 'currency' and whether the car is
+    'available', or None when the car does not exist.
+    """
+    rates = cached_rates()
+    if car_id not in rates:
+        return None
+    daily_rate, is_available = rates[car_id]
+    return {
+        'car': car_id,
+        'start': start,
+        'end': end,
+        'days': rental_days(start, end),
+        'daily_rate': daily_rate,
+        'total': rental_cost(daily_rate, start, end),
+        'currency': 'eur',
+        'available': is_available and is_car_available(car_id, start, end),
+    }
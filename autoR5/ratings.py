@@ -0,0 +1,131 @@
+"""
+Denormalized review aggregates for the 'autoR5' Django web application.
+
+Every 'Car' carries 'rating_sum', 'rating_count' and 'rating_average'
+columns summarizing its approved reviews, so pages can show an average
+rating and the fleet listing can sort by rating with an indexed column
+sort instead of a 'GROUP BY' over the reviews table.
+
+- 'F', 'OuterRef', 'Subquery', 'Sum', 'Count' and 'Value' from
+    'django.db.models' for building the update expressions.
+- 'DecimalField' and 'FloatField' from 'django.db.models' as cast
+    targets.
+- 'Cast', 'Coalesce' and 'NullIf' from 'django.db.models.functions'
+    for the division-safe average.
+- 'Car' and 'Review' from '.models' for accessing the data.
+
+Usage:
+'apply_rating_change' is called by the 'Review' signal receivers
+whenever a review is approved, re-rated, moved to another car or
+deleted. It issues one 'UPDATE' per affected car that adjusts the
+counters in the database itself, so concurrent reviews never overwrite
+each other. 'rebuild_ratings' recomputes the columns from scratch for
+a whole queryset in a single statement and backs the 'rebuild_ratings'
+management command.
+"""
+from django.db.models import (Count, DecimalField, F, FloatField,
+                              OuterRef, Subquery, Sum, Value)
+from django.db.models.functions import Cast, Coalesce, NullIf
+from .models import Car, Review
+
+
+def rating_contribution(rating, approved):
+    """
+    Return the (sum, count) a review adds to its car's aggregates.
+
+    Only approved reviews count towards the rating.
+    """
+    return (rating, 1) if approved else (0, 0)
+
+
+def average_expression(rating_sum, rating_count):
+    """
+    Build the expression computing 'rating_average' from a sum and
+    count expression, evaluating to 0 when there are no ratings.
+    """
+    average = Cast(rating_sum, FloatField()) / NullIf(rating_count, 0)
+    return Cast(Coalesce(average, Value(0.0)),
+                DecimalField(max_digits=3, decimal_places=2))
+
+
+def apply_rating_delta(car_id, sum_delta, count_delta):
+    """
+    Add 'sum_delta' and 'count_delta' to a car's rating aggregates.
+
+    Purpose:
+    The counters are adjusted with 'F()' expressions, so the change is
+    applied atomically by the database and the car row is never read.
+    The average is recomputed in the same 'UPDATE' statement.
+
+    Args:
+    - 'car_id': The primary key of the car.
+    - 'sum_delta': The change of the sum of approved ratings.
+    - 'count_delta': The change of the number of approved reviews.
+    """
+    if not (sum_delta or count_delta):
+        return
+    rating_sum = F('rating_sum') + sum_delta
+    rating_count = F('rating_count') + count_delta
+    Car.objects.filter(pk=car_id).update(
+        rating_sum=rating_sum,
+        rating_count=rating_count,
+        rating_average=average_expression(rating_sum, rating_count),
+    )
+
+
+def apply_rating_change(old, new):
+    """
+    Update the aggregates for a review going from state 'old' to 'new'.
+
+    Args:
+    - 'old': A (car_id, rating, approved) tuple describing the review
+    before the change, or None when it has just been created.
+    - 'new': The same tuple after the change, or None when the review
+    has been deleted.
+    """
+    deltas = {}
+    if old is not None:
+        car_id, rating, approved = old
+        total, count = rating_contribution(rating, approved)
+        deltas[car_id] = (-total, -count)
+    if new is not None:
+        car_id, rating, approved = new
+        total, count = rating_contribution(rating, approved)
+        old_total, old_count = deltas.get(car_id, (0, 0))
+        deltas[car_id] = (old_total + total, old_count + count)
+    for car_id, (sum_delta, count_delta) in deltas.items():
+        apply_rating_delta(car_id, sum_delta, count_delta)
+
+
+def rebuild_ratings(queryset=None):
+    """
+    Recompute the rating aggregates of every car in 'queryset'.
+
+    Purpose:
+    Repairs the denormalized columns after bulk changes that bypass
+    the signal receivers (such as 'QuerySet.update' or raw SQL). All
+    cars are updated by a single 'UPDATE' with correlated subqueries
+    over the approved reviews.
+
+    Args:
+    - 'queryset': The 'Car' queryset to rebuild. Defaults to the whole
+    fleet.
+
+    Returns:
+    The number of cars updated.
+    """
+    if queryset is None:
+        queryset = Car.objects.all()
+    approved = Review.objects.filter(
+        car=OuterRef('pk'), approved=True).order_by().values('car')
+    rating_sum = Coalesce(
+        Subquery(approved.annotate(total=Sum('rating')).values('total')),
+        0)
+    rating_count = Coalesce(
+        Subquery(approved.annotate(count=Count('id')).values('count')),
+        0)
+    return queryset.update(
+        rating_sum=rating_sum,
+        rating_count=rating_count,
+        rating_average=average_expression(rating_sum, rating_count),
+    )
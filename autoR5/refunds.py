@@ -0,0 +1,297 @@
+"""
+Asynchronous refund pipeline for the 'autoR5' Django web application.
+
+Approving a cancellation request used to call Stripe from inside the
+'post_save' signal, holding the admin's request on a network call and
+failing the save halfway through when Stripe was unreachable. Refunds
+are now queued as 'RefundJob' rows and issued by a worker.
+
+- 'time' for pacing refunds to a controlled rate.
+- 'timedelta' from 'datetime' for the retry backoff.
+- 'stripe' for issuing refunds.
+- 'settings' from 'django.conf' for the Stripe key and retry limits.
+- 'transaction' from 'django.db' for claiming jobs atomically.
+- 'timezone' from 'django.utils' for scheduling attempts.
+- 'intent_id_from' from '.payments' for the intent of a payment.
+- 'invalidate_facets' from '.facets' for refreshing the cached filter
+    options after bulk updates of cars.
+- 'Booking', 'Car', 'CancellationRequest', 'Payment' and 'RefundJob'
+    from '.models' for accessing the data.
+
+Usage:
+'queue_refund' is called by the 'CancellationRequest' signal receiver.
+Unpaid bookings are canceled straight away since no money has to be
+returned; paid ones get a 'RefundJob' and return immediately.
+
+'process_refund_jobs' (run by the 'process_refunds' management command)
+claims a batch of due jobs and issues their refunds at most 'rate' per
+second. Every attempt of a job sends the same idempotency key, derived
+from the payment, so a retry after a timeout can never refund twice.
+Failed attempts are retried with exponential backoff until
+'REFUND_MAX_ATTEMPTS' is reached.
+
+'approve_cancellation_requests' approves many requests at once for
+staff handling a mass cancellation: a fixed number of queries in one
+transaction, state changes written with 'bulk_update' and all refund
+jobs created with a single 'bulk_create', bypassing the per-request
+signal.
+"""
+import time
+from datetime import timedelta
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .facets import invalidate_facets
+from .payments import intent_id_from
+from .models import Booking, Car, CancellationRequest, Payment, RefundJob
+
+REFUND_MAX_ATTEMPTS = getattr(settings, 'REFUND_MAX_ATTEMPTS', 5)
+
+# Delay before the first retry, in seconds; doubled on every attempt.
+REFUND_RETRY_DELAY = getattr(settings, 'REFUND_RETRY_DELAY', 60)
+
+# How long a claimed job is hidden from other workers, in seconds.
+REFUND_CLAIM_TIMEOUT = 5 * 60
+
+
+class RefundProcessingError(Exception):
+    """
+    Custom exception for handling refund processing errors.
+
+    This exception is raised when there is an error during
+    the processing of a refund transaction. It allows for more
+    specific error handling in scenarios where refunds encounter
+    issues.
+
+    Attributes:
+    - None
+
+    Usage:
+    This exception class is used to raise errors when refund processing
+    encounters issues and may be caught and handled to provide more detailed
+    feedback to users or log the error for debugging.
+
+    Returns:
+    None
+    """
+
+
+def cancel_booking(booking, payment, payment_status):
+    """
+    Cancel a booking, set its payment status and free its car.
+    """
+    payment.payment_status = payment_status
+    payment.save()
+    booking.status = 'Canceled'
+    booking.save()
+    car = booking.car
+    car.is_available = True
+    car.save()
+
+
+def queue_refund(cancellation_request):
+    """
+    Cancel the booking of an approved cancellation request.
+
+    Purpose:
+    Unpaid bookings are canceled immediately. For paid bookings a
+    'RefundJob' is queued (at most one per payment) and the booking is
+    canceled by the worker once the refund succeeded.
+
+    Args:
+    - 'cancellation_request': The approved 'CancellationRequest'.
+
+    Returns:
+    The 'RefundJob' of the payment, or None when nothing was paid.
+
+    Raises:
+    - 'RefundProcessingError': If the booking or its payment does not
+    exist.
+    """
+    try:
+        booking = Booking.objects.select_related('car').get(
+            id=cancellation_request.booking_id)
+        payment = Payment.objects.get(booking=booking)
+    except (Booking.DoesNotExist, Payment.DoesNotExist):
+        raise RefundProcessingError('Error processing refund')
+
+    if payment.payment_status != 'Paid':
+        cancel_booking(booking, payment, 'Canceled')
+        return None
+
+    job, _ = RefundJob.objects.get_or_create(
+        payment=payment,
+        defaults={'cancellation_request': cancellation_request})
+    return job
+
+
+def approve_cancellation_requests(request_ids):
+    """
+    Approve many cancellation requests in one transaction.
+
+    Purpose:
+    Loads the requests, their bookings, cars and payments with a fixed
+    number of queries, cancels unpaid bookings, queues one refund job
+    per paid payment and writes every change with 'bulk_update' and
+    'bulk_create'. The 'CancellationRequest' signal is not sent; the
+    refunds are issued later by the 'process_refunds' worker.
+
+    Args:
+    - 'request_ids': The ids of the cancellation requests to approve.
+
+    Returns:
+    A dictionary mapping every requested id to its outcome:
+    'refund_queued', 'canceled', 'already_approved', 'missing_payment'
+    or 'not_found'.
+    """
+    request_ids = {int(request_id) for request_id in request_ids}
+    results = {request_id: 'not_found' for request_id in request_ids}
+    approved, bookings, cars, payments, jobs = [], {}, {}, {}, []
+
+    with transaction.atomic():
+        cancellation_requests = list(
+            CancellationRequest.objects.select_for_update()
+            .filter(pk__in=request_ids).order_by('id'))
+        booking_ids = {cr.booking_id for cr in cancellation_requests}
+        booking_map = Booking.objects.select_related('car').in_bulk(
+            booking_ids)
+        payment_map = {
+            payment.booking_id: payment for payment in
+            Payment.objects.filter(booking_id__in=booking_ids).order_by('id')
+        }
+        queued = set(RefundJob.objects.filter(
+            payment__in=payment_map.values()).values_list(
+                'payment_id', flat=True))
+
+        for cancellation_request in cancellation_requests:
+            if cancellation_request.approved:
+                results[cancellation_request.id] = 'already_approved'
+                continue
+            payment = payment_map.get(cancellation_request.booking_id)
+            if payment is None:
+                results[cancellation_request.id] = 'missing_payment'
+                continue
+
+            cancellation_request.approved = True
+            approved.append(cancellation_request)
+            if payment.payment_status == 'Paid':
+                if payment.id not in queued:
+                    queued.add(payment.id)
+                    jobs.append(RefundJob(
+                        payment=payment,
+                        cancellation_request=cancellation_request))
+                results[cancellation_request.id] = 'refund_queued'
+            else:
+                booking = booking_map[cancellation_request.booking_id]
+                payment.payment_status = 'Canceled'
+                booking.status = 'Canceled'
+                booking.car.is_available = True
+                payments[payment.id] = payment
+                bookings[booking.id] = booking
+                cars[booking.car.id] = booking.car
+                results[cancellation_request.id] = 'canceled'
+
+        CancellationRequest.objects.bulk_update(approved, ['approved'])
+        Payment.objects.bulk_update(payments.values(), ['payment_status'])
+        Booking.objects.bulk_update(bookings.values(), ['status'])
+        Car.objects.bulk_update(cars.values(), ['is_available'])
+        RefundJob.objects.bulk_create(jobs)
+
+    if cars:
+        invalidate_facets()
+    return results
+
+
+def claim_refund_jobs(batch_size, now=None):
+    """
+    Claim up to 'batch_size' due refund jobs for this worker.
+
+    Purpose:
+    The due jobs are locked with 'SKIP LOCKED' (where the database
+    supports it) and their 'next_attempt_at' is pushed back by
+    'REFUND_CLAIM_TIMEOUT', so concurrent workers pick different jobs.
+    A worker that dies mid-batch only delays its jobs until the claim
+    expires.
+
+    Returns:
+    A list of 'RefundJob' objects with their payment, booking and car
+    loaded.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            RefundJob.objects.select_for_update(skip_locked=True)
+            .filter(status='Queued', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size])
+        RefundJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            next_attempt_at=now + timedelta(seconds=REFUND_CLAIM_TIMEOUT))
+    return list(
+        RefundJob.objects.filter(pk__in=[job.pk for job in jobs])
+        .select_related('payment__booking__car')
+        .order_by('next_attempt_at', 'id'))
+
+
+def process_refund_job(job, now=None):
+    """
+    Issue the refund of one job and record the outcome.
+
+    Returns:
+    True when the refund succeeded, False otherwise.
+    """
+    now = now or timezone.now()
+    payment = job.payment
+    job.attempts += 1
+    try:
+        refund = stripe.Refund.create(
+            payment_intent=intent_id_from(payment.payment_intent),
+            idempotency_key=job.idempotency_key,
+        )
+        if refund.status not in ('succeeded', 'pending'):
+            raise RefundProcessingError(
+                f'Refund {refund.id} is {refund.status}')
+    except (stripe.error.StripeError, RefundProcessingError) as e:
+        job.last_error = str(e)
+        if job.attempts >= REFUND_MAX_ATTEMPTS:
+            job.status = 'Failed'
+        else:
+            delay = REFUND_RETRY_DELAY * 2 ** (job.attempts - 1)
+            job.next_attempt_at = now + timedelta(seconds=delay)
+        job.save()
+        return False
+
+    with transaction.atomic():
+        cancel_booking(payment.booking, payment, 'Refunded')
+        job.status = 'Succeeded'
+        job.refund_id = refund.id
+        job.last_error = ''
+        job.save()
+    return True
+
+
+def process_refund_jobs(batch_size=50, rate=None, now=None):
+    """
+    Process one batch of due refund jobs.
+
+    Args:
+    - 'batch_size': The maximum number of jobs to process.
+    - 'rate': The maximum number of Stripe calls per second, or None
+    for no limit.
+    - 'now': The current time, for tests.
+
+    Returns:
+    A dictionary with the number of 'succeeded' and 'failed' jobs.
+    """
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    results = {'succeeded': 0, 'failed': 0}
+    interval = 1 / rate if rate else 0
+    for job in claim_refund_jobs(batch_size, now):
+        started = time.monotonic()
+        if process_refund_job(job, now):
+            results['succeeded'] += 1
+        else:
+            results['failed'] += 1
+        remaining = interval - (time.monotonic() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+    return results
@@ -0,0 +1,149 @@
+"""
+Concurrency-safe booking reservations for the 'autoR5' Django web
+application.
+
+Checking that a car is free and inserting the booking used to be two
+independent statements, so two customers submitting the booking form
+for the same car and dates at the same moment could both pass the
+check and both be booked.
+
+- 'threading' for serializing reservations on databases without row
+    locks.
+- 'contextmanager' from 'contextlib' for the car lock.
+- 'timedelta' from 'datetime' for the hold expiry.
+- 'settings' from 'django.conf' for the hold duration.
+- 'connection' and 'transaction' from 'django.db' for locking the car
+    inside a transaction.
+- 'F' from 'django.db.models' for the no-op update taking the SQLite
+    write lock.
+- 'timezone' from 'django.utils' for the current time.
+- 'is_car_available' from '.availability' for the overlap check.
+- 'Booking', 'Car' and 'Payment' from '.models' for accessing the data.
+
+Usage:
+'reserve_booking' saves a new Pending booking and its Pending payment in
+one transaction that first locks the car row with 'SELECT ... FOR
+UPDATE'. Every reservation of a car therefore waits for the previous
+one to commit before running its own availability check, and a
+conflicting one raises 'BookingConflict'.
+
+A reservation holds the car for 'BOOKING_HOLD_TTL' seconds. The hold is
+stored on 'Booking.hold_expires_at' and honoured by the availability
+engine, so the dates are protected while the customer pays and freed
+automatically once the hold lapses. 'renew_hold' restarts the hold when
+the customer opens the checkout page, provided the dates are still free.
+A failed payment cancels the booking, releasing the dates at once.
+
+SQLite has no row locks. There, reservations of a process are
+serialized with a lock, and the transaction opens with a no-op
+'UPDATE' of the car that takes the database write lock, so other
+processes wait as well.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .availability import is_car_available
+from .models import Booking, Car, Payment
+
+# How long, in seconds, a Pending booking holds its car during checkout.
+BOOKING_HOLD_TTL = getattr(settings, 'BOOKING_HOLD_TTL', 15 * 60)
+
+# Serializes reservations on databases without 'SELECT ... FOR UPDATE'.
+_reservation_lock = threading.Lock()
+
+
+class BookingConflict(Exception):
+    """
+    Raised when the requested dates overlap a booking of the car.
+    """
+
+
+@contextmanager
+def locked_car(car_id):
+    """
+    Run the block in a transaction holding the lock of a car.
+    """
+    if connection.features.has_select_for_update:
+        with transaction.atomic():
+            list(Car.objects.select_for_update().filter(pk=car_id)
+                 .values_list('pk', flat=True))
+            yield
+    else:
+        with _reservation_lock, transaction.atomic():
+            Car.objects.filter(pk=car_id).update(
+                is_available=F('is_available'))
+            yield
+
+
+def hold_expiry(now=None):
+    """
+    Return when a hold placed at 'now' expires.
+    """
+    return (now or timezone.now()) + timedelta(seconds=BOOKING_HOLD_TTL)
+
+
+def reserve_booking(booking):
+    """
+    Save a new booking if its car is free, atomically.
+
+    Args:
+    - 'booking': An unsaved 'Booking' with its user, car and dates set.
+
+    Returns:
+    The saved 'Booking', with status 'Pending', a hold of
+    'BOOKING_HOLD_TTL' seconds and a pending 'Payment'.
+
+    Raises:
+    - 'BookingConflict': If the car is booked for an overlapping period.
+    Nothing is saved in that case.
+    """
+    with locked_car(booking.car_id):
+        if not is_car_available(booking.car_id, booking.rental_date,
+                                booking.return_date):
+            raise BookingConflict(
+                'This car is already booked for the selected dates.')
+        booking.status = 'Pending'
+        booking.hold_expires_at = hold_expiry()
+        booking.save()
+        Payment.objects.create(
+            user=booking.user,
+            booking=booking,
+            amount=booking.total_cost,
+            payment_method='Stripe',
+            payment_status='Pending',
+        )
+    return booking
+
+
+def renew_hold(booking):
+    """
+    Restart the hold of a Pending booking.
+
+    Purpose:
+    Called when the customer opens the checkout page. A hold that has
+    lapsed is only renewed if nobody else booked the dates meanwhile,
+    so the customer never pays for dates that are no longer theirs.
+    Holds without an expiry are left alone.
+
+    Args:
+    - 'booking': The Pending 'Booking' being checked out.
+
+    Raises:
+    - 'BookingConflict': If the dates have been taken since the hold
+    lapsed.
+    """
+    if booking.hold_expires_at is None:
+        return
+    with locked_car(booking.car_id):
+        if not is_car_available(booking.car_id, booking.rental_date,
+                                booking.return_date,
+                                exclude_booking=booking):
+            raise BookingConflict(
+                'This car has been booked for the selected dates.')
+        booking.hold_expires_at = hold_expiry()
+        Booking.objects.filter(pk=booking.pk, status='Pending').update(
+            hold_expires_at=booking.hold_expires_at)
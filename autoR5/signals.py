@@ -2,23 +2,27 @@
 Imported modules and classes for handling payments and
 user-related operations.
 
-This module includes imports for handling payments using Stripe,
-as well as signals and models related to user operations.
+This module includes imports for queueing refunds, as well as
+signals and models related to user operations.
 
 Modules:
-- stripe: Provides functionality for processing payments
-through Stripe.
 - django.db.models.signals: Contains signals to trigger actions
 on specific model events.
 - django.dispatch: Enables the creation and handling of
 custom signals.
 - django.contrib.auth.models.User: Provides the User model
 for user management.
+- .facets.invalidate_facets: Marks the cached filter options as
+stale.
+- .ratings.apply_rating_change: Keeps the denormalized car ratings
+up to date.
+- .refunds: Queues refunds for approved cancellation requests.
+'RefundProcessingError' is re-exported here for existing imports.
 
 Custom Classes:
+- Car: Model for the rental fleet.
 - CancellationRequest: Model for handling cancellation requests.
-- Booking: Model for managing car booking information.
-- Payment: Model for recording payment details.
+- Review: Model for user reviews of cars.
 - UserProfile: Model for extending user profiles.
 
 Usage:
@@ -29,33 +33,13 @@ operations, and data modeling.
 Returns:
 None
 """
-import stripe
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import CancellationRequest, Booking, Payment, UserProfile
-
-
-class RefundProcessingError(Exception):
-    """
-    Custom exception for handling refund processing errors.
-
-    This exception is raised when there is an error during
-    the processing of a refund transaction. It allows for more
-    specific error handling in scenarios where refunds encounter
-    issues.
-
-    Attributes:
-    - None
-
-    Usage:
-    This exception class is used to raise errors when refund processing
-    encounters issues and may be caught and handled to provide more detailed
-    feedback to users or log the error for debugging.
-
-    Returns:
-    None
-    """
+from .facets import invalidate_facets
+from .models import Car, CancellationRequest, Review, UserProfile
+from .ratings import apply_rating_change
+from .refunds import RefundProcessingError, queue_refund
 
 
 @receiver(post_save, sender=User)
@@ -85,64 +69,120 @@ def create_user_profile(sender, instance, created, **kwargs):
         UserProfile.objects.create(user=instance)
 
 
+@receiver(post_save, sender=Car)
+@receiver(post_delete, sender=Car)
+def invalidate_car_facets(sender, instance, **kwargs):
+    """
+    Signal receiver function for refreshing the cached filter options.
+
+    This function is triggered whenever a car is saved or deleted and
+    bumps the facet cache version, so the home page, the fleet page
+    and the facet endpoint rebuild their option lists on the next
+    request.
+
+    Args:
+        sender: The sender of the signal.
+        instance: The 'Car' instance being saved or deleted.
+        **kwargs: Additional keyword arguments.
+
+    Returns:
+        None
+    """
+    invalidate_facets()
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, raw=False, **kwargs):
+    """
+    Signal receiver function for recording a review's previous state.
+
+    This function is triggered before a review is saved and stores the
+    car, rating and approval the review had in the database on the
+    instance, so 'update_car_rating' can apply the difference.
+
+    Args:
+        sender: The sender of the signal.
+        instance: The 'Review' instance being saved.
+        raw: Whether the review is being loaded from a fixture.
+        **kwargs: Additional keyword arguments.
+
+    Returns:
+        None
+    """
+    instance._previous_rating = None
+    if instance.pk and not raw:
+        instance._previous_rating = Review.objects.filter(
+            pk=instance.pk).values_list(
+                'car_id', 'rating', 'approved').first()
+
+
+@receiver(post_save, sender=Review)
+def update_car_rating(sender, instance, raw=False, **kwargs):
+    """
+    Signal receiver function for maintaining the car rating aggregates.
+
+    This function is triggered after a review is saved and adjusts the
+    'rating_sum', 'rating_count' and 'rating_average' columns of the
+    affected car(s) when the review is approved, unapproved, re-rated
+    or moved to another car.
+
+    Args:
+        sender: The sender of the signal.
+        instance: The 'Review' instance being saved.
+        raw: Whether the review is being loaded from a fixture.
+        **kwargs: Additional keyword arguments.
+
+    Returns:
+        None
+    """
+    if raw:
+        return
+    apply_rating_change(
+        getattr(instance, '_previous_rating', None),
+        (instance.car_id, instance.rating, instance.approved))
+    instance._previous_rating = (
+        instance.car_id, instance.rating, instance.approved)
+
+
+@receiver(post_delete, sender=Review)
+def remove_car_rating(sender, instance, **kwargs):
+    """
+    Signal receiver function for removing a deleted review's rating.
+
+    Args:
+        sender: The sender of the signal.
+        instance: The 'Review' instance being deleted.
+        **kwargs: Additional keyword arguments.
+
+    Returns:
+        None
+    """
+    apply_rating_change(
+        (instance.car_id, instance.rating, instance.approved), None)
+
+
 @receiver(post_save, sender=CancellationRequest)
 def process_cancellation_request(sender, instance, created, **kwargs):
     """
-    Signal receiver function for creating a user profile upon user creation.
+    Signal receiver function for processing approved cancellation requests.
 
-    This function is a signal receiver that is triggered when a new user
-    is created. Upon user creation, it creates a corresponding user profile.
+    This function is triggered whenever a cancellation request is saved.
+    Once the request is approved, an unpaid booking is canceled straight
+    away, while a paid one gets a refund job that the 'process_refunds'
+    worker issues later. No Stripe call is made here, so approving a
+    request returns immediately.
 
     Args:
         sender: The sender of the signal.
-        instance: The instance of the User model being created.
-        created: A boolean indicating whether the User instance is created.
+        instance: The 'CancellationRequest' instance being saved.
+        created: A boolean indicating whether the instance is created.
         **kwargs: Additional keyword arguments.
 
     Returns:
         None
 
-    Usage:
-    This function is connected to the post-save signal of the User model and
-    is responsible for creating a user profile associated with the newly
-    created user. It is automatically called when a new user is registered.
+    Raises:
+        RefundProcessingError: If the booking or its payment is missing.
     """
     if instance.approved:
-        try:
-            booking = Booking.objects.get(id=instance.booking_id)
-            payment = Payment.objects.get(booking=booking)
-
-            if payment.payment_status != 'Paid':
-                booking.status = 'Canceled'
-                booking.save()
-                payment.payment_status = 'Canceled'
-                payment.save()
-                car = booking.car
-                car.is_available = True
-                car.save()
-                return
-
-            # Retrieve the payment intent associated with the payment
-            payment_intent_id = payment.payment_intent
-            car = booking.car
-
-            # Create a refund with Stripe
-            refund = stripe.Refund.create(
-                payment_intent=payment_intent_id
-            )
-
-            # Check the refund status and handle accordingly
-            if refund.status == 'succeeded':
-                payment.payment_status = 'Refunded'
-                payment.save()
-                booking.status = 'Canceled'
-                booking.save()
-                car.is_available = True
-                car.save()
-            else:
-                raise RefundProcessingError('Refund processing failed')
-        except (
-                stripe.error.StripeError,
-                Booking.DoesNotExist,
-                Payment.DoesNotExist):
-            raise RefundProcessingError('Error processing refund')
+        queue_refund(instance)
@@ -6,6 +6,9 @@ that are imported and used within the 'autoR5' Django application.
 
 Modules and Libraries:
 - decimal: Provides support for decimal floating point arithmetic.
+- csv: Reads exported and failed-row CSV files.
+- gzip: Decompresses compressed exports.
+- json: Decodes JSON and ndjson responses.
 - time: Allows access to time-related functions.
 - os: Provides a portable way of using operating system-dependent
     functionality.
@@ -20,7 +23,10 @@ Modules and Libraries:
 - PIL (Python Imaging Library): Allows image processing.
 - django.utils.timezone: Provides timezone-related utilities.
 - django.test: Supports testing and test client functionality.
+- django.test.utils.CaptureQueriesContext: Records executed queries.
 - django.contrib.auth.models.User: Represents user information.
+- django.core.cache.cache: Gives access to the default cache.
+- django.db.connection: Gives access to the database connection.
 - django.core.exceptions.ValidationError: Handles validation errors.
 - django.core.files.uploadedfile.SimpleUploadedFile: Represents
     uploaded files.
@@ -46,29 +52,51 @@ Modules and Libraries:
 - .forms: Imports custom forms used in the application.
 - .models: Imports custom database models.
 - .views: Imports view functions and classes.
+- .availability: Imports the booking availability engine.
+- .facets: Imports the faceted search helpers.
+- .pagination: Imports the keyset pagination helpers.
+- .refunds: Imports the refund queue and worker.
+- .fake_stripe: Imports the in-memory Stripe double.
+- .car_import, .images and .import_jobs: Import the fleet CSV import,
+    its image resolution and its background jobs.
+- .exports: Imports the streaming CSV exports.
+- .fake_cloudinary: Imports the in-memory Cloudinary double.
+- .geocoding and .fake_geocoder: Import the batched reverse geocoding
+    and its stub geocoder.
+- django.core.management.call_command: Runs management commands.
 
 Note:
 This docstring serves as an overview of the imported modules and classes in
     the 'autoR5' application.
 """
 from decimal import Decimal
+import csv
+import gzip
+import importlib
+import json
 import time
 import os
 import inspect
 import random
 import string
-from io import BytesIO
+import threading
+from io import BytesIO, StringIO
 from datetime import date, datetime, timedelta
 from unittest import mock
 from unittest.mock import patch, Mock
 import stripe
 from PIL import Image
+from django.apps import apps as django_apps
 from django.utils import timezone
-from django.test import (TestCase, override_settings,
+from django.test import (TestCase, TransactionTestCase, override_settings,
                          Client, LiveServerTestCase)
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse, resolve
 from django.http import HttpResponseRedirect
 from django.urls.exceptions import NoReverseMatch
@@ -87,8 +115,27 @@ from .forms import (ContactForm, CustomSignupForm, BookingForm,
                     ReviewForm, CancellationRequestForm,
                     UserProfileForm, CsvImportForm)
 from .models import (Car, Booking, Payment, CancellationRequest,
-                     Review, UserProfile, ContactFormSubmission)
+                     GeocodedLocation, GeocodeJob, ImportFile,
+                     ImportFileChunk, ImportJob, RefundJob, Review,
+                     StripeEvent, UserProfile, ContactFormSubmission)
 from . import views
+from . import availability
+from . import car_import
+from . import exports
+from . import facets
+from . import geocoding
+from . import images
+from . import import_jobs
+from . import pagination
+from . import pricing
+from . import quotes
+from . import refunds
+from .abandoned import reap_abandoned_bookings
+from .completion import complete_expired_bookings
+from .reservations import BookingConflict, renew_hold, reserve_booking
+from .fake_stripe import FakeStripe, sign_webhook
+from .fake_cloudinary import FakeCloudinary
+from .fake_geocoder import FakeGeocoder
 
 
 class CarModelTest(TestCase):
@@ -636,7 +683,7 @@ class BookingModelTest(TestCase):
 
         This test method creates a booking instance with status
         'Confirmed' and a return date in the past. It verifies that
-        the status is automatically updated to 'Completed' and checks
+        the completion job updates the status to 'Completed' and checks
         if the car becomes available after the booking is completed.
 
         Attributes:
@@ -644,7 +691,8 @@ class BookingModelTest(TestCase):
 
         Usage:
         The test creates a booking with a past return date and 'Confirmed'
-        tatus. It then refreshes the booking instance from the database and
+        status for an unavailable car and runs 'complete_expired_bookings'.
+        It then refreshes the booking instance from the database and
         checks if the status has changed to 'Completed'. Additionally, the
         method verifies that the associated car becomes available after the
         booking is completed.
@@ -655,6 +703,7 @@ class BookingModelTest(TestCase):
         """
         rental_date = timezone.make_aware(datetime(2023, 1, 1, 12, 0, 0))
         return_date = timezone.make_aware(datetime(2023, 1, 4, 12, 0, 0))
+        Car.objects.filter(pk=self.car.pk).update(is_available=False)
         booking = Booking.objects.create(
             user=self.user,
             car=self.car,
@@ -663,7 +712,11 @@ class BookingModelTest(TestCase):
             status='Confirmed',
         )
 
+        results = complete_expired_bookings()
+
         booking.refresh_from_db()
+        self.car.refresh_from_db()
+        self.assertEqual(results['completed'], 1)
         self.assertEqual(booking.status, 'Completed')
         self.assertTrue(self.car.is_available)
 
@@ -705,6 +758,614 @@ class BookingModelTest(TestCase):
         self.assertEqual(booking.total_cost, Decimal('400.00'))
 
 
+class CompleteBookingsTest(TestCase):
+    """
+    Test the fleet-wide completion job in 'autoR5.completion' and the
+    'complete_bookings' management command.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="completion", password="testpassword")
+        self.now = timezone.now()
+        self.cars = [
+            Car.objects.create(
+                make="Make", model="Model", year=2023,
+                license_plate=f"DONE{i}", daily_rate=50, is_available=False)
+            for i in range(3)
+        ]
+
+    def book(self, car, days_ago, status='Confirmed'):
+        """
+        Create a two-day booking of 'car' that ended 'days_ago' days
+        ago (negative values end in the future).
+        """
+        return_date = self.now - timedelta(days=days_ago)
+        return Booking.objects.create(
+            user=self.user, car=car, status=status,
+            rental_date=return_date - timedelta(days=2),
+            return_date=return_date)
+
+    def test_expired_bookings_are_completed_in_batches(self):
+        """
+        Test that every expired confirmed booking is completed with a
+        fixed number of queries per batch, leaving other bookings alone.
+        """
+        expired = [self.book(self.cars[i % 2], days_ago=3 + i)
+                   for i in range(5)]
+        current = self.book(self.cars[2], days_ago=-1)
+        pending = self.book(self.cars[2], days_ago=5, status='Pending')
+
+        with CaptureQueriesContext(connection) as queries:
+            results = complete_expired_bookings(self.now, batch_size=2)
+
+        self.assertEqual(results['completed'], 5)
+        self.assertEqual(results['batches'], 3)
+        # Three statements per batch plus the final empty 'SELECT'.
+        statements = [query for query in queries.captured_queries
+                      if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 3 * 3 + 1)
+        self.assertEqual(
+            set(Booking.objects.filter(status='Completed')
+                .values_list('id', flat=True)),
+            {booking.id for booking in expired})
+        current.refresh_from_db()
+        pending.refresh_from_db()
+        self.assertEqual(current.status, 'Confirmed')
+        self.assertEqual(pending.status, 'Pending')
+
+    def test_car_out_on_another_booking_stays_unavailable(self):
+        """
+        Test that a car is only released when no other confirmed
+        booking of it is in progress.
+        """
+        self.book(self.cars[0], days_ago=1)
+        self.book(self.cars[1], days_ago=1)
+        Booking.objects.create(
+            user=self.user, car=self.cars[1], status='Confirmed',
+            rental_date=self.now - timedelta(hours=1),
+            return_date=self.now + timedelta(days=1))
+
+        results = complete_expired_bookings(self.now)
+
+        self.assertEqual(results['cars'], 1)
+        self.assertEqual(
+            list(Car.objects.filter(is_available=True)
+                 .values_list('id', flat=True)),
+            [self.cars[0].id])
+
+    def test_command_reports_throughput(self):
+        """
+        Test that the management command reports what it completed.
+        """
+        self.book(self.cars[0], days_ago=1)
+        out = StringIO()
+
+        call_command('complete_bookings', '--batch-size', '10', stdout=out)
+
+        self.assertIn('Completed 1 booking(s) and released 1 car(s) in '
+                      '1 batch(es)', out.getvalue())
+        self.assertIn('bookings/s', out.getvalue())
+
+
+class ReapPendingBookingsTest(TestCase):
+    """
+    Test the clean-up of abandoned Pending bookings in
+    'autoR5.abandoned' and the 'reap_pending_bookings' command.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="reaper", password="testpassword")
+        self.car = Car.objects.create(
+            make="Make", model="Model", year=2023, license_plate="REAP1",
+            daily_rate=50)
+        self.now = timezone.now()
+
+    def book(self, hours_ago, payment_status='Pending', held=True,
+             payment_intent=None):
+        """
+        Create a Pending booking made 'hours_ago' hours ago, whose
+        checkout hold lapsed (or was cleared when not 'held'), with a
+        payment in 'payment_status'.
+        """
+        start = self.now + timedelta(days=Booking.objects.count() * 3)
+        created_at = self.now - timedelta(hours=hours_ago)
+        booking = Booking.objects.create(
+            user=self.user, car=self.car, rental_date=start,
+            return_date=start + timedelta(days=2), created_at=created_at,
+            hold_expires_at=(created_at + timedelta(minutes=15)
+                             if held else None))
+        Payment.objects.create(
+            user=self.user, booking=booking, amount=booking.total_cost,
+            payment_method='Stripe', payment_status=payment_status,
+            payment_intent=payment_intent)
+        return booking
+
+    def test_old_unpaid_bookings_are_canceled(self):
+        """
+        Test that only old bookings without a successful payment are
+        canceled, in batches, releasing their dates.
+        """
+        abandoned = [self.book(hours_ago=5) for _ in range(3)]
+        abandoned.append(self.book(hours_ago=5, payment_status='Failed'))
+        fresh = self.book(hours_ago=0)
+        paid = self.book(hours_ago=5, payment_status='Paid')
+
+        results = reap_abandoned_bookings(
+            ttl=2 * 60 * 60, batch_size=2, now=self.now)
+
+        self.assertEqual(results['bookings'], 4)
+        self.assertEqual(results['payments'], 4)
+        self.assertEqual(results['batches'], 2)
+        self.assertEqual(
+            set(Booking.objects.filter(status='Canceled')
+                .values_list('id', flat=True)),
+            {booking.id for booking in abandoned})
+        self.assertFalse(Payment.objects.filter(
+            booking__in=abandoned).exclude(
+                payment_status='Canceled').exists())
+        self.assertEqual(Booking.objects.get(pk=fresh.pk).status, 'Pending')
+        self.assertEqual(Booking.objects.get(pk=paid.pk).status, 'Pending')
+        self.assertTrue(availability.is_car_available(
+            self.car, abandoned[0].rental_date, abandoned[0].return_date))
+
+    def test_delete_removes_bookings_and_payments(self):
+        """
+        Test that '--delete' removes abandoned bookings with their
+        payments and reports the counts.
+        """
+        self.book(hours_ago=5)
+        self.book(hours_ago=0)
+        out = StringIO()
+
+        call_command('reap_pending_bookings', '--ttl', '3600', '--delete',
+                     stdout=out)
+
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertIn('Deleted 1 booking(s) and 1 payment(s) in 1 batch(es)',
+                      out.getvalue())
+
+    def test_checkout_of_reaped_booking_redirects(self):
+        """
+        Test that a canceled booking cannot be checked out anymore.
+        """
+        booking = self.book(hours_ago=5)
+        reap_abandoned_bookings(ttl=60, now=self.now)
+        self.client.login(username="reaper", password="testpassword")
+
+        response = self.client.get(reverse('checkout', kwargs={
+            'car_id': self.car.id, 'booking_id': booking.id}))
+
+        self.assertRedirects(
+            response, reverse('book_car', kwargs={'car_id': self.car.id}),
+            fetch_redirect_response=False)
+
+    def test_processing_payment_is_not_reaped(self):
+        """
+        Test that a booking whose payment is processing, which has no
+        hold expiry, is never reaped.
+        """
+        booking = self.book(hours_ago=5, held=False)
+
+        results = reap_abandoned_bookings(ttl=60, now=self.now)
+
+        self.assertEqual(results['bookings'], 0)
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, 'Pending')
+
+    @patch('autoR5.abandoned.stripe', new_callable=FakeStripe)
+    def test_reaping_cancels_the_payment_intent(self, fake_stripe):
+        """
+        Test that the PaymentIntent of a reaped booking is canceled and
+        that a booking whose intent Stripe refuses to cancel is skipped.
+        """
+        abandoned_intent = fake_stripe.PaymentIntent.create(amount=100)
+        paid_intent = fake_stripe.PaymentIntent.create(amount=100)
+        paid_intent.status = 'succeeded'
+        abandoned = self.book(
+            hours_ago=5, payment_intent=abandoned_intent.client_secret)
+        paying = self.book(hours_ago=5, payment_intent=paid_intent.id)
+
+        results = reap_abandoned_bookings(ttl=60, now=self.now)
+
+        self.assertEqual(results['bookings'], 1)
+        self.assertEqual(results['skipped'], 1)
+        self.assertEqual(abandoned_intent.status, 'canceled')
+        self.assertEqual(Booking.objects.get(pk=abandoned.pk).status,
+                         'Canceled')
+        self.assertEqual(Booking.objects.get(pk=paying.pk).status, 'Pending')
+        self.assertEqual(
+            Payment.objects.get(booking=paying).payment_status, 'Pending')
+
+    def test_intents_are_canceled_outside_the_transaction(self):
+        """
+        Test that Stripe is called before the batch's rows are locked.
+        """
+        self.book(hours_ago=5, payment_intent='pi_outside')
+        depth = len(connection.atomic_blocks)
+        depths = []
+
+        def cancel(payment_intent):
+            depths.append(len(connection.atomic_blocks))
+            return True
+
+        with patch('autoR5.abandoned.cancel_intent', side_effect=cancel):
+            results = reap_abandoned_bookings(ttl=60, now=self.now)
+
+        self.assertEqual(results['bookings'], 1)
+        self.assertEqual(depths, [depth])
+
+    def test_bookings_without_hold_are_backfilled(self):
+        """
+        Test that migration 0025 gives Pending bookings made before
+        holds existed a lapsed hold, so they stop blocking their car and
+        are reaped, while other bookings keep theirs.
+        """
+        legacy = self.book(hours_ago=5, held=False)
+        confirmed = self.book(hours_ago=5, held=False)
+        Booking.objects.filter(pk=confirmed.pk).update(status='Confirmed')
+        migration = importlib.import_module(
+            'autoR5.migrations.0025_booking_hold_expires_at')
+
+        migration.backfill_holds(django_apps, None)
+
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.hold_expires_at,
+                         legacy.created_at + timedelta(minutes=15))
+        self.assertIsNone(
+            Booking.objects.get(pk=confirmed.pk).hold_expires_at)
+        self.assertTrue(availability.is_car_available(
+            self.car, legacy.rental_date, legacy.return_date))
+        self.assertEqual(
+            reap_abandoned_bookings(ttl=60, now=self.now)['bookings'], 1)
+
+    @override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+    def test_success_on_reaped_booking_is_refunded(self):
+        """
+        Test that a payment succeeding after its booking was reaped is
+        refunded instead of confirming the released booking.
+        """
+        booking = self.book(hours_ago=5)
+        reap_abandoned_bookings(ttl=60, now=self.now)
+        payload = json.dumps({
+            'id': 'evt_reaped', 'object': 'event',
+            'type': 'payment_intent.succeeded',
+            'data': {'object': {
+                'id': 'pi_reaped', 'object': 'payment_intent',
+                'metadata': {'booking_id': str(booking.id)}}},
+        })
+
+        self.client.post(
+            reverse('stripe_webhook'), payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=sign_webhook(payload, 'whsec_test'))
+
+        payment = Payment.objects.get(booking=booking)
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status,
+                         'Canceled')
+        self.assertEqual(payment.payment_status, 'Paid')
+        self.assertTrue(RefundJob.objects.filter(payment=payment).exists())
+
+
+class ReservationTest(TransactionTestCase):
+    """
+    Test that 'reserve_booking' never double-books a car, even when
+    many customers submit the booking form at the same moment.
+
+    Usage:
+    The stress test starts several threads, each with its own database
+    connection, that wait on a barrier and then reserve overlapping
+    dates of the same car. On PostgreSQL the reservations are serialized
+    by the row lock on the car, on SQLite by the process-wide fallback
+    lock; either way exactly one of them must succeed.
+    """
+    THREADS = 8
+
+    def setUp(self):
+        self.car = Car.objects.create(
+            make="Make", model="Model", year=2023, license_plate="LOCK1",
+            daily_rate=50)
+        self.users = [
+            User.objects.create_user(username=f"racer{i}", password="pw")
+            for i in range(self.THREADS)]
+        self.start = timezone.now() + timedelta(days=10)
+
+    def booking(self, user, offset_days=0):
+        start = self.start + timedelta(days=offset_days)
+        return Booking(user=user, car=self.car, rental_date=start,
+                       return_date=start + timedelta(days=3))
+
+    def test_parallel_reservations_do_not_double_book(self):
+        """
+        Test that of many simultaneous reservations for overlapping
+        dates exactly one succeeds and the others get a conflict.
+        """
+        barrier = threading.Barrier(self.THREADS)
+        outcomes = []
+
+        def reserve(index):
+            try:
+                barrier.wait()
+                reserve_booking(self.booking(self.users[index], index % 2))
+                outcomes.append('booked')
+            except BookingConflict:
+                outcomes.append('conflict')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reserve, args=(i,))
+                   for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes.count('booked'), 1)
+        self.assertEqual(outcomes.count('conflict'), self.THREADS - 1)
+        self.assertEqual(Booking.objects.filter(car=self.car).count(), 1)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_conflict_saves_nothing(self):
+        """
+        Test that a conflicting reservation raises 'BookingConflict'
+        without saving a booking or payment, while adjacent dates can
+        still be booked.
+        """
+        reserve_booking(self.booking(self.users[0]))
+
+        with self.assertRaises(BookingConflict):
+            reserve_booking(self.booking(self.users[1], offset_days=2))
+        reserve_booking(self.booking(self.users[1], offset_days=3))
+
+        self.assertEqual(Booking.objects.count(), 2)
+        self.assertEqual(Payment.objects.count(), 2)
+
+
+class BookingHoldTest(TestCase):
+    """
+    Test the checkout holds of Pending bookings: they protect the dates
+    while live, lapse on their own and are renewed at checkout.
+    """
+
+    def setUp(self):
+        self.car = Car.objects.create(
+            make="Make", model="Model", year=2023, license_plate="HOLD1",
+            daily_rate=50)
+        self.first = User.objects.create_user(
+            username="first", password="testpassword")
+        self.second = User.objects.create_user(
+            username="second", password="testpassword")
+        self.start = timezone.now() + timedelta(days=5)
+        self.end = self.start + timedelta(days=2)
+
+    def reserve(self, user):
+        return reserve_booking(Booking(
+            user=user, car=self.car, rental_date=self.start,
+            return_date=self.end))
+
+    def expire(self, booking):
+        Booking.objects.filter(pk=booking.pk).update(
+            hold_expires_at=timezone.now() - timedelta(seconds=1))
+        booking.refresh_from_db()
+
+    def deliver(self, booking, event_type, event_id='evt_hold'):
+        """
+        Post a signed 'payment_intent.*' event for 'booking' to the
+        webhook.
+        """
+        payload = json.dumps({
+            'id': event_id, 'object': 'event', 'type': event_type,
+            'data': {'object': {
+                'id': f'pi_hold_{booking.id}', 'object': 'payment_intent',
+                'metadata': {'booking_id': str(booking.id)}}},
+        })
+        return self.client.post(
+            reverse('stripe_webhook'), payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=sign_webhook(payload, 'whsec_test'))
+
+    def test_live_hold_blocks_and_expired_hold_releases(self):
+        """
+        Test that a live hold blocks the dates and that they are free
+        again as soon as it lapses.
+        """
+        booking = self.reserve(self.first)
+        self.assertGreater(booking.hold_expires_at, timezone.now())
+        with self.assertRaises(BookingConflict):
+            self.reserve(self.second)
+
+        self.expire(booking)
+
+        self.assertTrue(availability.is_car_available(
+            self.car, self.start, self.end))
+        self.assertEqual(self.reserve(self.second).status, 'Pending')
+
+    def test_renew_hold_checks_the_dates_again(self):
+        """
+        Test that a lapsed hold is renewed while the dates are free and
+        refused once somebody else booked them.
+        """
+        booking = self.reserve(self.first)
+        self.expire(booking)
+
+        renew_hold(booking)
+        self.assertGreater(
+            Booking.objects.get(pk=booking.pk).hold_expires_at,
+            timezone.now())
+
+        self.expire(booking)
+        self.reserve(self.second)
+        with self.assertRaises(BookingConflict):
+            renew_hold(booking)
+
+    def test_checkout_after_dates_were_taken_redirects(self):
+        """
+        Test that checking out a booking whose dates were taken after
+        its hold lapsed sends the customer back to the booking form.
+        """
+        booking = self.reserve(self.first)
+        self.expire(booking)
+        self.reserve(self.second)
+        self.client.login(username="first", password="testpassword")
+
+        response = self.client.get(reverse('checkout', kwargs={
+            'car_id': self.car.id, 'booking_id': booking.id}))
+
+        self.assertRedirects(
+            response, reverse('book_car', kwargs={'car_id': self.car.id}),
+            fetch_redirect_response=False)
+
+    @override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+    def test_processing_payment_keeps_the_hold(self):
+        """
+        Test that a booking whose payment is processing keeps its dates
+        after the checkout hold would have lapsed.
+        """
+        booking = self.reserve(self.first)
+        self.deliver(booking, 'payment_intent.processing')
+
+        self.assertIsNone(Booking.objects.get(pk=booking.pk).hold_expires_at)
+        self.assertTrue(availability.overlapping_bookings(
+            self.start, self.end, now=timezone.now() + timedelta(days=1),
+        ).filter(car=self.car).exists())
+
+    @override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+    def test_late_payment_for_taken_dates_is_refunded(self):
+        """
+        Test that a payment succeeding after its hold lapsed and the
+        dates were booked again cancels its booking and queues a refund
+        instead of confirming a second booking for the same dates.
+        """
+        late = self.reserve(self.first)
+        self.expire(late)
+        taken = self.reserve(self.second)
+        self.deliver(taken, 'payment_intent.succeeded', event_id='evt_1')
+
+        self.deliver(late, 'payment_intent.succeeded', event_id='evt_2')
+
+        payment = Payment.objects.get(booking=late)
+        self.assertEqual(Booking.objects.get(pk=late.pk).status, 'Canceled')
+        self.assertEqual(Booking.objects.get(pk=taken.pk).status,
+                         'Confirmed')
+        self.assertEqual(payment.payment_status, 'Paid')
+        self.assertEqual(payment.payment_intent, f'pi_hold_{late.id}')
+        self.assertTrue(RefundJob.objects.filter(
+            payment=payment, status='Queued').exists())
+
+    @override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+    def test_late_payment_for_free_dates_is_confirmed(self):
+        """
+        Test that a payment succeeding after its hold lapsed still
+        confirms the booking while nobody else took the dates.
+        """
+        booking = self.reserve(self.first)
+        self.expire(booking)
+
+        self.deliver(booking, 'payment_intent.succeeded')
+
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status,
+                         'Confirmed')
+        self.assertFalse(RefundJob.objects.exists())
+
+
+class PricingTest(TestCase):
+    """
+    Test the pricing rule and batch pricing in 'autoR5.pricing' and
+    the repricing of 'Booking' on save.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="pricing", password="testpassword")
+        self.cars = [
+            Car.objects.create(
+                make="Make", model="Model", year=2023,
+                license_plate=f"PRICE{i}", daily_rate=Decimal(40 + i))
+            for i in range(3)
+        ]
+        self.start = timezone.make_aware(datetime(2023, 1, 1, 12, 0, 0))
+
+    def test_price_rentals_uses_one_query(self):
+        """
+        Test that thousands of rentals are priced with a single query
+        for the rate table.
+        """
+        rentals = [
+            (self.cars[i % 3].id, self.start,
+             self.start + timedelta(days=i % 7, hours=1))
+            for i in range(3000)
+        ]
+
+        with self.assertNumQueries(1):
+            costs = pricing.price_rentals(rentals)
+
+        self.assertEqual(len(costs), 3000)
+        self.assertEqual(costs[0], Decimal('40'))
+        self.assertEqual(costs[4], Decimal('41') * 4)
+
+    def test_price_rentals_accepts_cached_rates(self):
+        """
+        Test that the rates cached for quotes price rentals without
+        another query.
+        """
+        cache.clear()
+        rates = quotes.cached_rates()
+        rentals = [(car.id, self.start, self.start + timedelta(days=2))
+                   for car in self.cars]
+
+        with self.assertNumQueries(0):
+            costs = pricing.price_rentals(rentals, rates)
+
+        self.assertEqual(costs, [Decimal('80'), Decimal('82'),
+                                 Decimal('84')])
+
+    def test_partial_days_are_not_charged(self):
+        """
+        Test that only full days are charged, with a minimum of one.
+        """
+        end = self.start + timedelta(days=2, hours=23)
+
+        self.assertEqual(pricing.rental_days(self.start, end), 2)
+        self.assertEqual(pricing.rental_cost(Decimal('40'), self.start, end),
+                         Decimal('80'))
+        self.assertEqual(pricing.rental_days(
+            self.start, self.start + timedelta(hours=3)), 1)
+
+    def test_status_change_does_not_reprice(self):
+        """
+        Test that saving a booking whose car and dates did not change
+        neither loads the car nor changes the total.
+        """
+        Booking.objects.create(
+            user=self.user, car=self.cars[0], rental_date=self.start,
+            return_date=self.start + timedelta(days=3), status='Pending')
+        booking = Booking.objects.get()
+        Car.objects.filter(pk=self.cars[0].pk).update(daily_rate=99)
+
+        booking.status = 'Confirmed'
+        with self.assertNumQueries(1):
+            booking.save()
+
+        booking.refresh_from_db()
+        self.assertEqual(booking.total_cost, Decimal('120.00'))
+
+    def test_date_change_reprices(self):
+        """
+        Test that moving the return date recomputes the total.
+        """
+        Booking.objects.create(
+            user=self.user, car=self.cars[1], rental_date=self.start,
+            return_date=self.start + timedelta(days=2))
+        booking = Booking.objects.get()
+
+        booking.return_date = self.start + timedelta(days=5)
+        booking.save()
+
+        booking.refresh_from_db()
+        self.assertEqual(booking.total_cost, Decimal('205.00'))
+
+
 class PaymentModelTest(TestCase):
     """
     Test the payment-related functionality of the 'Payment' model.
@@ -1601,42 +2262,471 @@ class CarsListViewTest(TestCase):
         text (e.g., "Toyota Corolla" and "Ford Fiesta") are not
         present in the response.
 
-        Attributes:
-            self: The test case instance.
+        Attributes:
+            self: The test case instance.
+
+        Usage:
+        To test the 'cars_list' view with filtering, call this method
+        within a test case. The method constructs a URL with filter
+        parameters, sends a GET request to the 'cars_list'
+        view, captures the response, and performs various assertions
+        to validate the behavior of the view when filtering
+        cars.
+
+        Note:
+        This test method is part of the unit tests for the 'cars_list'
+        view within the Django application. It ensures that the view
+        correctly filters and displays cars based on the provided
+        parameters.
+        """
+
+        filter_url = reverse('cars_list') + \
+            '?make=Honda&model=Civic&year=2022&car_type=Hatchback&' \
+            'fuel_type=Petrol&location=Dublin'
+        response = self.client.get(filter_url)
+
+        self.assertEqual(response.status_code, 200)
+
+        content = response.content.decode("utf-8")
+        pattern = r'<h3 class="card-title display-5">\s+Honda Civic\s+</h3>'
+        self.assertRegex(content, pattern)
+
+        content = response.content.decode("utf-8")
+        pattern = r'<h3 class="card-title display-5">\s+Toyota Corolla\s+</h3>'
+        self.assertNotRegex(content, pattern)
+
+        content = response.content.decode("utf-8")
+        pattern = r'<h3 class="card-title display-5">\s+Ford Fiesta\s+</h3>'
+        self.assertNotRegex(content, pattern)
+
+    def test_cars_list_view_with_date_range(self):
+        """
+        Test the 'cars_list' view with 'start' and 'end' dates.
+
+        A car with a confirmed booking overlapping the requested dates
+        must be left out of the listing, the remaining cars must still
+        be shown, and the dates must be carried over to the pagination
+        links through the 'filter_query' context variable.
+        """
+        user = User.objects.create_user(
+            username="testuser", password="testpassword")
+        honda = Car.objects.get(make="Honda")
+        start = date.today() + timedelta(days=3)
+        Booking.objects.create(
+            user=user, car=honda, status='Confirmed',
+            rental_date=timezone.make_aware(
+                datetime.combine(start, datetime.min.time())),
+            return_date=timezone.make_aware(
+                datetime.combine(start + timedelta(days=3),
+                                 datetime.min.time())))
+
+        response = self.client.get(reverse('cars_list'), {
+            'start': (start + timedelta(days=1)).isoformat(),
+            'end': (start + timedelta(days=2)).isoformat(),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode("utf-8")
+        self.assertNotRegex(
+            content, r'<h3 class="card-title display-5">\s+Honda Civic')
+        self.assertRegex(
+            content, r'<h3 class="card-title display-5">\s+Toyota Corolla')
+        self.assertRegex(
+            content, r'<h3 class="card-title display-5">\s+Ford Fiesta')
+        self.assertIn('start=', response.context['filter_query'])
+
+    def test_cars_list_view_with_invalid_date_range(self):
+        """
+        Test that a malformed or reversed date range is ignored and
+        the full fleet is listed.
+        """
+        response = self.client.get(reverse('cars_list'), {
+            'start': '2030-01-05', 'end': '2030-01-01'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Honda")
+        self.assertEqual(response.context['start'], '')
+
+    def test_cars_list_view_is_ordered(self):
+        """
+        Test that the listing is ordered by daily rate and then id, so
+        pages are deterministic.
+        """
+        response = self.client.get(reverse('cars_list'))
+
+        ids = [car.id for car in response.context['cars']]
+        self.assertEqual(ids, sorted(ids))
+
+    def test_cars_list_view_with_cursor(self):
+        """
+        Test that cursor mode walks the whole fleet without repeats
+        and without a count query.
+        """
+        cars = Car.objects.order_by('daily_rate', 'id')
+        first = pagination.keyset_page(cars, per_page=2)
+        second = pagination.keyset_page(cars, first.next_cursor, per_page=2)
+
+        self.assertEqual([car.make for car in first], ["Honda", "Toyota"])
+        self.assertEqual([car.make for car in second], ["Ford"])
+        self.assertFalse(second.has_next)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cars_list'), {'after': ''})
+        self.assertTrue(response.context['cursor_mode'])
+        self.assertEqual(len(response.context['cars']), 3)
+        self.assertFalse(any('COUNT(' in query['sql']
+                             for query in queries.captured_queries))
+
+    def test_cars_list_view_with_invalid_cursor(self):
+        """
+        Test that a malformed cursor falls back to the first page.
+        """
+        response = self.client.get(reverse('cars_list'),
+                                   {'after': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cars']), 3)
+
+    def test_cars_list_json(self):
+        """
+        Test that the JSON listing applies the filters and returns a
+        cursor only when more cars follow.
+        """
+        response = self.client.get(reverse('cars_list_json'),
+                                   {'fuel_type': 'Petrol'})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([car['make'] for car in data['cars']],
+                         ["Honda", "Ford"])
+        self.assertIsNone(data['next'])
+
+    def test_cars_api_streams_ndjson(self):
+        """
+        Test that the fleet API streams one JSON object per line and
+        applies the 'cars_list' filters.
+        """
+        response = self.client.get(reverse('cars_api'),
+                                   {'fuel_type': 'Petrol'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        cars = [json.loads(line) for line in lines]
+        self.assertEqual([car['make'] for car in cars], ["Honda", "Ford"])
+        self.assertEqual(cars[0]['daily_rate'], '100.00')
+
+    def test_cars_api_field_selection(self):
+        """
+        Test that only the requested fields are returned and that
+        unknown fields are rejected.
+        """
+        response = self.client.get(reverse('cars_api'),
+                                   {'fields': 'make,model'})
+        first = json.loads(
+            b''.join(response.streaming_content).decode().splitlines()[0])
+        self.assertEqual(set(first), {'make', 'model'})
+
+        response = self.client.get(reverse('cars_api'),
+                                   {'fields': 'make,password'})
+        self.assertEqual(response.status_code, 400)
+
+
+class FacetsTest(TestCase):
+    """
+    Unit tests for the faceted search helpers and the 'car_facets'
+    endpoint.
+
+    Usage:
+    'setUpTestData' creates a small fleet spread over two makes and two
+    cities. The tests check that the counts of each facet ignore the
+    facet's own selection but respect every other one, that all counts
+    come from a single query and that the endpoint returns them as JSON.
+
+    Note:
+    This test class is part of the unit tests for the fleet filters in
+    the 'autoR5' Django application.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        for plate, make, model, city, fuel in [
+                ("FCT001", "Toyota", "Corolla", "Dublin", "Petrol"),
+                ("FCT002", "Toyota", "Yaris", "Cork", "Hybrid"),
+                ("FCT003", "Toyota", "Corolla", "Cork", "Petrol"),
+                ("FCT004", "Honda", "Civic", "Dublin", "Petrol")]:
+            Car.objects.create(
+                make=make, model=model, year=2022, license_plate=plate,
+                daily_rate=50.00, car_type="Saloon", fuel_type=fuel,
+                location_city=city)
+
+    def options(self, result, facet):
+        return {option['value']: option['count']
+                for option in result['facets'][facet]}
+
+    def test_facet_counts_are_cross_filtered(self):
+        """
+        Test that a selected filter narrows the other facets but not
+        its own options.
+        """
+        result = facets.facet_counts({'make': 'Toyota', 'location': 'Cork'})
+
+        self.assertEqual(result['total'], 2)
+        self.assertEqual(self.options(result, 'make'),
+                         {'Toyota': 2})
+        self.assertEqual(self.options(result, 'location'),
+                         {'Cork': 2, 'Dublin': 1})
+        self.assertEqual(self.options(result, 'model'),
+                         {'Corolla': 1, 'Yaris': 1})
+        self.assertEqual(self.options(result, 'fuel_type'),
+                         {'Hybrid': 1, 'Petrol': 1})
+
+    def test_facet_counts_use_one_query(self):
+        """
+        Test that all facets are computed from a single query and that
+        later calls are served from the cache.
+        """
+        cache.clear()
+        with self.assertNumQueries(1):
+            facets.facet_counts({'make': 'Honda'})
+        with self.assertNumQueries(0):
+            facets.facet_counts({'make': 'Toyota'})
+
+    def test_car_changes_invalidate_cached_facets(self):
+        """
+        Test that saving and deleting a car refreshes the cached
+        facet lists.
+        """
+        self.assertNotIn('Ford', facets.facet_values('make'))
+
+        car = Car.objects.create(
+            make="Ford", model="Focus", year=2021, license_plate="FCT005",
+            daily_rate=40.00, location_city="Galway")
+        self.assertIn('Ford', facets.facet_values('make'))
+
+        car.delete()
+        self.assertNotIn('Ford', facets.facet_values('make'))
+
+    def test_pages_use_cached_facets(self):
+        """
+        Test that the home page and the fleet filters do not query the
+        database for their options once the cache is warm.
+        """
+        self.client.get(reverse('index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(list(response.context['car_types']), ['Saloon'])
+
+        response = self.client.get(reverse('cars_list'))
+        self.assertEqual(response.context['locations'], ['Cork', 'Dublin'])
+
+    def test_car_facets_endpoint(self):
+        """
+        Test that the 'car_facets' endpoint returns the total and the
+        options of every facet for the query string selection.
+        """
+        response = self.client.get(reverse('car_facets'), {'make': 'Honda'})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(set(data['facets']), {
+            'make', 'model', 'year', 'car_type', 'fuel_type', 'location'})
+        self.assertEqual(self.options(data, 'make'),
+                         {'Honda': 1, 'Toyota': 3})
+
+
+class QuoteApiTest(TestCase):
+    """
+    Unit tests for the side-effect-free '/api/quote/' endpoint.
+
+    Usage:
+    'setUpTestData' creates one car with a booking from the 10th to the
+    12th of June 2030. The tests check the returned price and
+    availability, that nothing is written, that a warm quote costs a
+    single query and that invalid requests are rejected.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="quoter", password="testpassword")
+        cls.car = Car.objects.create(
+            make="Make", model="Model", year=2023, license_plate="QUOTE1",
+            daily_rate=Decimal('45.50'))
+        Booking.objects.create(
+            user=cls.user, car=cls.car, status='Confirmed',
+            rental_date=timezone.make_aware(datetime(2030, 6, 10)),
+            return_date=timezone.make_aware(datetime(2030, 6, 12)))
+
+    def get_quote(self, **params):
+        return self.client.get(reverse('car_quote'), params)
+
+    def test_quote_returns_price_and_availability(self):
+        """
+        Test that a free window is priced and reported available and
+        that nothing is written to the database.
+        """
+        bookings, payments = Booking.objects.count(), Payment.objects.count()
+
+        response = self.get_quote(
+            car=self.car.id, start='2030-06-01', end='2030-06-04')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['days'], 3)
+        self.assertEqual(Decimal(data['total']), Decimal('136.50'))
+        self.assertTrue(data['available'])
+        self.assertEqual(Booking.objects.count(), bookings)
+        self.assertEqual(Payment.objects.count(), payments)
+
+    def test_overlapping_window_is_unavailable(self):
+        """
+        Test that a window overlapping a booking is still priced but
+        reported unavailable.
+        """
+        data = self.get_quote(
+            car=self.car.id, start='2030-06-11', end='2030-06-13').json()
+
+        self.assertEqual(Decimal(data['total']), Decimal('91.00'))
+        self.assertFalse(data['available'])
+
+    def test_warm_quote_uses_one_query(self):
+        """
+        Test that rates are served from the cache, leaving only the
+        availability check, and that a rate change is picked up.
+        """
+        cache.clear()
+        self.get_quote(car=self.car.id, start='2030-07-01', end='2030-07-02')
+
+        with self.assertNumQueries(1):
+            self.get_quote(
+                car=self.car.id, start='2030-07-01', end='2030-07-02')
+
+        self.car.daily_rate = Decimal('60.00')
+        self.car.save()
+        data = self.get_quote(
+            car=self.car.id, start='2030-07-01', end='2030-07-02').json()
+        self.assertEqual(Decimal(data['total']), Decimal('60.00'))
+
+    def test_invalid_requests_are_rejected(self):
+        """
+        Test the error responses for missing parameters, bad date
+        ranges and unknown cars.
+        """
+        self.assertEqual(self.get_quote(
+            start='2030-06-01', end='2030-06-02').status_code, 400)
+        self.assertEqual(self.get_quote(
+            car=self.car.id, start='2030-06-02',
+            end='2030-06-01').status_code, 400)
+        self.assertEqual(self.get_quote(
+            car=self.car.id + 100, start='2030-06-01',
+            end='2030-06-02').status_code, 404)
+
+
+class RatingsTest(TestCase):
+    """
+    Unit tests for the denormalized rating aggregates on 'Car'.
+
+    Usage:
+    'setUp' creates two cars and a user. The tests check that the
+    'Review' signal receivers keep 'rating_sum', 'rating_count' and
+    'rating_average' in step with the approved reviews, that the
+    'rebuild_ratings' command repairs stale values, and that the fleet
+    listing can be sorted by rating.
+
+    Note:
+    This test class is part of the unit tests for the review ratings in
+    the 'autoR5' Django application.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="ratinguser", password="testpassword")
+        self.car = Car.objects.create(
+            make="Toyota", model="Corolla", year=2022,
+            license_plate="RTG001", daily_rate=50.00)
+        self.other_car = Car.objects.create(
+            make="Honda", model="Civic", year=2022,
+            license_plate="RTG002", daily_rate=60.00)
+
+    def review(self, rating, approved=True, car=None):
+        return Review.objects.create(
+            car=car or self.car, user=self.user, rating=rating,
+            comment="Test", approved=approved)
 
-        Usage:
-        To test the 'cars_list' view with filtering, call this method
-        within a test case. The method constructs a URL with filter
-        parameters, sends a GET request to the 'cars_list'
-        view, captures the response, and performs various assertions
-        to validate the behavior of the view when filtering
-        cars.
+    def assertRating(self, car, rating_sum, rating_count, average):
+        car.refresh_from_db()
+        self.assertEqual(car.rating_sum, rating_sum)
+        self.assertEqual(car.rating_count, rating_count)
+        self.assertEqual(car.rating_average, Decimal(average))
 
-        Note:
-        This test method is part of the unit tests for the 'cars_list'
-        view within the Django application. It ensures that the view
-        correctly filters and displays cars based on the provided
-        parameters.
+    def test_only_approved_reviews_count(self):
         """
+        Test that pending reviews are ignored until they are approved.
+        """
+        self.review(5)
+        review = self.review(4, approved=False)
+        self.assertRating(self.car, 5, 1, '5.00')
 
-        filter_url = reverse('cars_list') + \
-            '?make=Honda&model=Civic&year=2022&car_type=Hatchback&' \
-            'fuel_type=Petrol&location=Dublin'
-        response = self.client.get(filter_url)
+        review.approved = True
+        review.save()
+        self.assertRating(self.car, 9, 2, '4.50')
 
-        self.assertEqual(response.status_code, 200)
+    def test_rating_change_and_delete(self):
+        """
+        Test that re-rating, moving and deleting a review update the
+        aggregates of the affected cars.
+        """
+        self.review(5)
+        review = self.review(4)
+        self.review(4)
 
-        content = response.content.decode("utf-8")
-        pattern = r'<h3 class="card-title display-5">\s+Honda Civic\s+</h3>'
-        self.assertRegex(content, pattern)
+        review.rating = 2
+        review.save()
+        self.assertRating(self.car, 11, 3, '3.67')
 
-        content = response.content.decode("utf-8")
-        pattern = r'<h3 class="card-title display-5">\s+Toyota Corolla\s+</h3>'
-        self.assertNotRegex(content, pattern)
+        review.car = self.other_car
+        review.save()
+        self.assertRating(self.car, 9, 2, '4.50')
+        self.assertRating(self.other_car, 2, 1, '2.00')
 
-        content = response.content.decode("utf-8")
-        pattern = r'<h3 class="card-title display-5">\s+Ford Fiesta\s+</h3>'
-        self.assertNotRegex(content, pattern)
+        review.delete()
+        self.assertRating(self.other_car, 0, 0, '0.00')
+
+    def test_rebuild_ratings_command(self):
+        """
+        Test that the 'rebuild_ratings' command recomputes stale
+        aggregates from the approved reviews.
+        """
+        self.review(3)
+        self.review(4)
+        self.review(1, approved=False)
+        Review.objects.filter(rating=1).update(approved=True)
+        Car.objects.update(rating_sum=0, rating_count=0,
+                           rating_average=Decimal('0.00'))
+
+        call_command('rebuild_ratings', stdout=StringIO())
+        self.assertRating(self.car, 8, 3, '2.67')
+        self.assertRating(self.other_car, 0, 0, '0.00')
+
+    def test_cars_list_sorted_by_rating(self):
+        """
+        Test that 'sort=rating' orders the fleet by average rating in
+        both the numbered and cursor modes.
+        """
+        self.review(3)
+        self.review(5, car=self.other_car)
+
+        response = self.client.get(reverse('cars_list'), {'sort': 'rating'})
+        self.assertEqual([car.make for car in response.context['cars']],
+                         ["Honda", "Toyota"])
+        self.assertEqual(response.context['sort'], 'rating')
+
+        data = self.client.get(reverse('cars_list_json'),
+                               {'sort': 'rating', 'after': ''}).json()
+        self.assertEqual([car['make'] for car in data['cars']],
+                         ["Honda", "Toyota"])
+        self.assertEqual(data['cars'][0]['rating_average'], '5.00')
 
 
 class CarDetailTest(TestCase):
@@ -1753,6 +2843,46 @@ class CarDetailTest(TestCase):
         self.assertContains(response, 'Rating:')
         self.assertContains(response, 'Great car!')
 
+    def test_car_detail_reviews_are_bounded(self):
+        """
+        Test that the page renders a fixed number of reviews with a
+        constant number of queries, however many reviews the car has.
+        """
+        for i in range(20):
+            Review.objects.create(
+                car=self.car, user=self.user, rating=4,
+                comment=f'Review {i}', approved=True)
+        url = reverse('car_detail', args=[str(self.car.id)])
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+
+        reviews = response.context['reviews']
+        self.assertEqual(len(reviews), views.REVIEWS_PER_PAGE)
+        self.assertEqual(reviews.object_list[0].comment, 'Review 19')
+        self.assertContains(response, 'review-sentinel')
+
+    def test_car_reviews_endpoint_pages_through_reviews(self):
+        """
+        Test that the 'car_reviews' endpoint returns the remaining
+        approved reviews page by page, newest first.
+        """
+        for i in range(8):
+            Review.objects.create(
+                car=self.car, user=self.user, rating=3,
+                comment=f'Review {i}', approved=(i != 7))
+        url = reverse('car_reviews', args=[self.car.id])
+
+        first = self.client.get(url, {'after': ''}).json()
+        self.assertEqual([review['comment'] for review in first['reviews']],
+                         [f'Review {i}' for i in range(6, 0, -1)])
+        self.assertEqual(first['reviews'][0]['user'], 'testuser')
+
+        second = self.client.get(url, {'after': first['next']}).json()
+        self.assertEqual([review['comment'] for review in second['reviews']],
+                         ['Review 0', 'Great car!'])
+        self.assertIsNone(second['next'])
+
 
 class BookCarViewTest(TestCase):
     """
@@ -2154,6 +3284,190 @@ class BookCarViewTest(TestCase):
 
         self.assertContains(response, 'This car is not available for booking.')
 
+    def test_book_car_view_with_enclosing_booking(self):
+        """
+        Test the 'book_car' view when an existing booking fully
+        encloses the requested dates.
+
+        The previous conflict check only matched bookings starting or
+        ending inside the requested window, so a longer booking around
+        it slipped through. The availability engine must reject it.
+        """
+        self.client.login(username="testuser", password="testpassword")
+        today = timezone.now()
+        Booking.objects.create(
+            user=self.user, car=self.car, status='Confirmed',
+            rental_date=today + timedelta(days=1),
+            return_date=today + timedelta(days=10))
+
+        url = reverse('book_car', kwargs={'car_id': self.car.id})
+        response = self.client.post(url, {
+            'rental_date': date.today() + timedelta(days=3),
+            'return_date': date.today() + timedelta(days=5),
+        }, follow=True)
+
+        self.assertContains(
+            response, 'This car is already booked for the selected dates.')
+        self.assertEqual(Booking.objects.count(), 1)
+
+
+class AvailabilityEngineTest(TestCase):
+    """
+    Unit tests for the availability engine in 'autoR5.availability'.
+
+    This test class verifies that the half-open interval overlap query
+    used by 'book_car', 'cars_list' and the admin treats every kind of
+    overlap as a conflict, ignores bookings that no longer hold the car
+    and lets back-to-back rentals through.
+
+    Usage:
+    'setUp' creates a user, two cars and a confirmed booking on the
+    first car from day 10 to day 15. Each test method then asks the
+    engine about a different requested window.
+
+    Note:
+    This test class is part of the unit tests for the availability
+    engine in the 'autoR5' Django application.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword")
+        self.car = Car.objects.create(
+            make="TestMake", model="TestModel", year=2023,
+            license_plate="AVL001", daily_rate=100.00)
+        self.other_car = Car.objects.create(
+            make="OtherMake", model="OtherModel", year=2023,
+            license_plate="AVL002", daily_rate=100.00)
+        self.start = timezone.now() + timedelta(days=10)
+        self.end = self.start + timedelta(days=5)
+        self.booking = Booking.objects.create(
+            user=self.user, car=self.car, status='Confirmed',
+            rental_date=self.start, return_date=self.end)
+
+    def test_enclosing_window_conflicts(self):
+        """
+        Test that a requested window enclosing, enclosed by or
+        partially overlapping an existing booking is a conflict.
+        """
+        day = timedelta(days=1)
+        windows = [
+            (self.start - day, self.end + day),
+            (self.start + day, self.end - day),
+            (self.start - day, self.start + day),
+            (self.end - day, self.end + day),
+        ]
+        for start, end in windows:
+            self.assertFalse(
+                availability.is_car_available(self.car, start, end))
+
+    def test_back_to_back_window_is_free(self):
+        """
+        Test that a window starting exactly when the booking ends, or
+        ending exactly when it starts, does not conflict.
+        """
+        day = timedelta(days=1)
+        self.assertTrue(availability.is_car_available(
+            self.car, self.end, self.end + day))
+        self.assertTrue(availability.is_car_available(
+            self.car, self.start - day, self.start))
+
+    def test_canceled_and_completed_bookings_ignored(self):
+        """
+        Test that canceled and completed bookings do not hold the car.
+        """
+        for status in ('Canceled', 'Completed'):
+            Booking.objects.filter(pk=self.booking.pk).update(status=status)
+            self.assertTrue(availability.is_car_available(
+                self.car, self.start, self.end))
+
+    def test_available_cars(self):
+        """
+        Test that 'available_cars' and 'booked_cars' split the fleet
+        for a window in a single query each.
+        """
+        with self.assertNumQueries(1):
+            free = list(availability.available_cars(self.start, self.end))
+        self.assertEqual(free, [self.other_car])
+        self.assertEqual(
+            list(availability.booked_cars(self.start, self.end)),
+            [self.car])
+
+
+class BookedDatesTest(TestCase):
+    """
+    Unit tests for the compressed booked-date ranges used by
+    'book_car' and the 'booked_dates' JSON endpoint.
+
+    Usage:
+    'setUp' creates a car with two touching bookings, one separate
+    booking, a canceled booking and a booking that ended in the past.
+    The tests check that only the relevant bookings are reported and
+    that touching bookings are merged into a single range.
+
+    Note:
+    This test class is part of the unit tests for the availability
+    engine in the 'autoR5' Django application.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword")
+        self.car = Car.objects.create(
+            make="TestMake", model="TestModel", year=2023,
+            license_plate="BKD001", daily_rate=100.00)
+        self.today = timezone.localdate()
+
+        def midnight(days):
+            return timezone.make_aware(datetime.combine(
+                self.today + timedelta(days=days), datetime.min.time()))
+
+        for start, end, status in [(2, 5, 'Confirmed'), (5, 7, 'Pending'),
+                                   (10, 12, 'Confirmed'),
+                                   (20, 25, 'Canceled'),
+                                   (-10, -5, 'Confirmed')]:
+            Booking.objects.create(
+                user=self.user, car=self.car, status=status,
+                rental_date=midnight(start), return_date=midnight(end))
+
+    def test_booked_ranges_are_merged(self):
+        """
+        Test that touching bookings merge into one range, that the
+        return day is left free and that canceled and past bookings
+        are left out.
+        """
+        day = timedelta(days=1)
+        self.assertEqual(availability.booked_ranges(self.car), [
+            (self.today + 2 * day, self.today + 6 * day),
+            (self.today + 10 * day, self.today + 11 * day),
+        ])
+
+    def test_booked_dates_endpoint(self):
+        """
+        Test that the 'booked_dates' endpoint returns the merged
+        ranges as ISO formatted dates.
+        """
+        response = self.client.get(
+            reverse('booked_dates', kwargs={'car_id': self.car.id}))
+
+        self.assertEqual(response.status_code, 200)
+        ranges = response.json()['ranges']
+        self.assertEqual(len(ranges), 2)
+        self.assertEqual(ranges[0]['start'],
+                         (self.today + timedelta(days=2)).isoformat())
+
+    def test_book_car_context(self):
+        """
+        Test that 'book_car' renders the merged ranges and embeds
+        them for the date picker.
+        """
+        self.client.login(username="testuser", password="testpassword")
+        response = self.client.get(
+            reverse('book_car', kwargs={'car_id': self.car.id}))
+
+        self.assertEqual(len(response.context['booked_ranges']), 2)
+        self.assertContains(response, 'id="booked-ranges"')
+
 
 class CheckoutViewTest(TestCase):
     """
@@ -2288,7 +3602,8 @@ class CheckoutViewTest(TestCase):
         A GET request is made to the view, and the response is checked
         to ensure it is an instance of 'HttpResponseRedirect.'
         Additionally, it verifies that the URL to which the user is
-        redirected matches the 'checkout' view for the car and booking.
+        redirected is the car's detail page rather than the 'checkout'
+        view itself, which would retry in a loop.
 
         This test is important for confirming that the 'checkout_view'
         method correctly handles Stripe errors and redirects users
@@ -2310,50 +3625,94 @@ class CheckoutViewTest(TestCase):
 
             self.assertIsInstance(response, HttpResponseRedirect)
             self.assertEqual(response.url, reverse(
-                'checkout', kwargs={
-                             'car_id': self.car.id,
-                             'booking_id': self.booking.id}))
+                'car_detail', kwargs={'car_id': self.car.id}))
         except NoReverseMatch:
             # If NoReverseMatch occurs, it's expected due to the error raised
             pass
 
+    @patch('autoR5.payments.stripe', new_callable=FakeStripe)
+    def test_checkout_reuses_payment_intent(self, fake_stripe):
+        """
+        Test that reloading the checkout page reuses the booking's
+        PaymentIntent instead of creating a new one on every visit.
+        """
+        self.client.login(username="testuser", password="testpassword")
+        url = reverse('checkout', kwargs={
+                      'car_id': self.car.id, 'booking_id': self.booking.id})
+
+        secrets = {self.client.get(url).context['intent_client_secret']
+                   for _ in range(3)}
+
+        self.assertEqual(len(secrets), 1)
+        self.assertEqual(fake_stripe.call_count(), 1)
+        create = fake_stripe.calls[0][2]
+        self.assertEqual(create['amount'],
+                         int(self.booking.total_cost * 100))
+        self.assertEqual(
+            create['idempotency_key'],
+            f"booking-{self.booking.id}-intent-{create['amount']}")
+        payment = Payment.objects.get(booking=self.booking)
+        self.assertEqual(payment.payment_intent, secrets.pop())
+
+    @patch('autoR5.payments.stripe', new_callable=FakeStripe)
+    def test_checkout_updates_intent_when_amount_changes(self, fake_stripe):
+        """
+        Test that a changed booking total modifies the existing
+        PaymentIntent rather than creating another one.
+        """
+        self.client.login(username="testuser", password="testpassword")
+        url = reverse('checkout', kwargs={
+                      'car_id': self.car.id, 'booking_id': self.booking.id})
+        secret = self.client.get(url).context['intent_client_secret']
+
+        Booking.objects.filter(pk=self.booking.pk).update(
+            total_cost=Decimal('250.00'))
+        response = self.client.get(url)
+
+        self.assertEqual(response.context['intent_client_secret'], secret)
+        self.assertEqual(fake_stripe.call_count('PaymentIntent', 'create'), 1)
+        self.assertEqual(fake_stripe.call_count('PaymentIntent', 'modify'), 1)
+        self.assertEqual(fake_stripe.calls[-1][2]['amount'], 25000)
+        self.assertEqual(Payment.objects.get(booking=self.booking).amount,
+                         Decimal('250.00'))
 
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
 class BookingConfirmationViewTest(TestCase):
     """
-    Test the 'booking_confirmation' view in the 'autoR5'
-    Django application.
+    Test the 'booking_confirmation' view and the Stripe webhook in the
+    'autoR5' Django application.
 
-    This test class verifies the behavior of the 'booking_confirmation'
-    view, which is responsible for confirming and displaying the booking
-    details and payment status to the user. It includes multiple test
-    methods to cover various scenarios related to booking confirmation
-    and payment status updates.
+    This test class verifies that payment state is driven by signed
+    'payment_intent.*' webhook events posted to the 'stripe_webhook'
+    endpoint, and that the 'booking_confirmation' view only reads that
+    state from the database.
 
     Attributes:
         self: The test case instance.
 
     Usage:
-    This test class sets up a test user, a car, a booking, and a payment
-    using the 'setUp' method. It includes the following test methods:
+    This test class sets up a test user, a car, a pending booking and a
+    pending payment using the 'setUp' method. Events are delivered with
+    the 'deliver' helper, which signs them like Stripe does. It includes
+    the following test methods:
 
-    - 'test_successful_payment': This method tests a scenario where the
-    payment is successful (status='succeeded'). It mocks the Stripe
-    PaymentIntent retrieval to simulate a successful payment and checks
-    if the booking and payment status is updated correctly.
+    - 'test_successful_payment': A 'payment_intent.succeeded' event
+    marks the payment 'Paid' and the booking 'Confirmed'.
 
-    - 'test_pending_payment': This method tests a scenario where the
-    payment is pending (status='processing'). It mocks the Stripe
-    PaymentIntent retrieval to simulate a pending payment and verifies
-    the correct updating of the booking and payment status.
+    - 'test_pending_payment': A 'payment_intent.processing' event keeps
+    both 'Pending'.
 
-    - 'test_failed_payment': This method tests a scenario where the
-    payment fails (status='requires_payment_method'). It mocks the
-    Stripe PaymentIntent retrieval to simulate a failed payment and
-    checks if the booking and payment status is updated as expected.
+    - 'test_failed_payment': A 'payment_intent.payment_failed' event
+    marks the payment 'Failed' and the booking 'Canceled'.
 
-    These tests ensure that the 'booking_confirmation' view handles
-    different payment scenarios correctly and provides users with
-    accurate booking and payment status information.
+    - 'test_duplicate_event_is_applied_once', 'test_late_failure_keeps_
+    successful_payment' and 'test_invalid_signature_is_rejected' cover
+    the dedup table, out-of-order deliveries and signature checks.
+
+    The confirmation page is requested with the Stripe module of the
+    views replaced by 'FakeStripe', which verifies that it makes no
+    Stripe calls.
 
     Note:
     This test class is part of the unit tests for the
@@ -2384,153 +3743,144 @@ class BookingConfirmationViewTest(TestCase):
             car=self.car,
             rental_date=rental_date,
             return_date=return_date,
-            status='Confirmed',
+            status='Pending',
         )
         self.payment = Payment.objects.create(
             user=self.user,
             booking=self.booking,
             amount=Decimal('400.00'),
             payment_method='Stripe',
-            payment_status='Paid',
+            payment_status='Pending',
+            payment_intent='pi_test_secret_abc',
         )
         self.client.login(username='testuser', password='testpassword')
 
-    @patch('stripe.PaymentIntent.retrieve')
-    def test_successful_payment(self, mock_retrieve):
+    def deliver(self, event_type, event_id='evt_test_1', secret=None):
         """
-        Test a successful payment scenario in the 'booking_confirmation'
-        view.
-
-        This test method simulates a successful payment scenario by
-        mocking the retrieval of a Stripe PaymentIntent with the status
-        'succeeded'. It then logs in the user, performs a GET request
-        to the 'booking_confirmation' view, and checks if the payment
-        and booking status are correctly updated to 'Paid' and
-        'Confirmed', respectively.
-
-        Attributes:
-            self: The test case instance.
-            mock_retrieve: A mock object for the
-            'stripe.PaymentIntent.retrieve' method.
-
-        Usage:
-        This test method ensures that when a payment is successful, the
-        'booking_confirmation' view responds with a status code of 200
-        (OK) and updates both the payment and booking status to 'Paid'
-        and 'Confirmed', respectively.
+        Post a signed 'payment_intent.*' event for the test booking to
+        the webhook and return the response.
+        """
+        payload = json.dumps({
+            'id': event_id,
+            'object': 'event',
+            'type': event_type,
+            'data': {'object': {
+                'id': 'pi_test',
+                'object': 'payment_intent',
+                'metadata': {'booking_id': str(self.booking.id)},
+            }},
+        })
+        return self.client.post(
+            reverse('stripe_webhook'), payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=sign_webhook(
+                payload, secret or 'whsec_test'))
+
+    def confirm(self):
+        """
+        Request the confirmation page as Stripe's redirect does and
+        check that it makes no Stripe calls.
+        """
+        with patch('autoR5.views.stripe', new_callable=FakeStripe) as fake:
+            response = self.client.get(reverse(
+                'booking_confirmation', args=[self.booking.id]), {
+                'payment_intent': 'pi_test',
+                'payment_intent_client_secret': 'pi_test_secret_abc',
+            })
+        self.assertEqual(fake.call_count(), 0)
+        self.assertEqual(response.status_code, 200)
+        return response
 
-        Note:
-        This is part of the unit tests for the 'BookingConfirmationView'
-        in the 'autoR5' Django application.
+    def test_successful_payment(self):
         """
-        self.payment_intent_id = "test_payment_intent"
-        self.intent_client_secret = "test_client_secret"
-        mock_retrieve.return_value = Mock(status='succeeded')
-        self.client.force_login(self.user)
+        Test that a 'payment_intent.succeeded' event confirms the
+        booking and stores the intent id on the payment.
+        """
+        self.assertEqual(self.deliver('payment_intent.succeeded').json(),
+                         {'received': True, 'applied': True})
 
-        response = self.client.get(reverse(
-            'booking_confirmation', args=[self.booking.id]), {
-            'payment_intent': self.payment_intent_id,
-            'payment_intent_client_secret': self.intent_client_secret,
-        })
+        response = self.confirm()
 
         booking = Booking.objects.get(id=self.booking.id)
         payment = Payment.objects.get(id=self.payment.id)
-        self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context['payment_status'], 'Paid')
         self.assertEqual(booking.status, 'Confirmed')
         self.assertEqual(payment.payment_status, 'Paid')
+        self.assertEqual(payment.payment_intent, 'pi_test')
 
-    @patch('stripe.PaymentIntent.retrieve')
-    def test_pending_payment(self, mock_retrieve):
+    def test_pending_payment(self):
         """
-        Test a pending payment scenario in the 'booking_confirmation'
-        view.
-
-        This test method simulates a pending payment scenario by
-        mockingthe retrieval of a Stripe PaymentIntent with the status
-        'processing'. It logs in the user, performs a GET request to
-        the 'booking_confirmation' view with a test client secret,
-        and checks if both the payment and booking status are correctly
-        updated to 'Pending'.
-
-        Attributes:
-            self: The test case instance.
-            mock_retrieve: A mock object for the
-            'stripe.PaymentIntent.retrieve' method.
-
-        Usage:
-        This test method ensures that when a payment is pending, the
-        'booking_confirmation' view responds with a status code of
-        200 (OK) and updates both the payment and booking status to
-        'Pending'.
-
-        Note:
-        It is part of the unit tests for the 'BookingConfirmationView'
-        in the 'autoR5' Django application.
+        Test that a 'payment_intent.processing' event keeps the booking
+        and payment pending, and that the page shows them as pending.
         """
+        self.deliver('payment_intent.processing')
 
-        self.intent_client_secret = "test_client_secret"
-        mock_retrieve.return_value = Mock(status='processing')
-        self.client.force_login(self.user)
-
-        response = self.client.get(reverse(
-            'booking_confirmation', args=[self.booking.id]), {
-            'payment_intent_client_secret': self.intent_client_secret,
-        })
+        response = self.confirm()
 
         booking = Booking.objects.get(id=self.booking.id)
         payment = Payment.objects.get(id=self.payment.id)
-        self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context['payment_status'], 'Pending')
         self.assertEqual(booking.status, 'Pending')
         self.assertEqual(payment.payment_status, 'Pending')
 
-    @patch('stripe.PaymentIntent.retrieve')
-    def test_failed_payment(self, mock_retrieve):
+    def test_failed_payment(self):
         """
-        Test a failed payment scenario in the 'booking_confirmation
-        view.
-
-        This test method simulates a failed payment scenario by
-        mocking the retrieval of a Stripe PaymentIntent with the
-        status 'requires_payment_method'. It logs in the user,
-        performs a GET request to the 'booking_confirmation' view
-        with a test client secret, and checks if both the payment
-        and booking status are correctly updated to 'Failed' and
-        'Canceled', respectively.
-
-        Attributes:
-            self: The test case instance.
-            mock_retrieve: A mock object for the
-            'stripe.PaymentIntent.retrieve' method.
-
-        Usage:
-        This test method ensures that when a payment fails, the
-        'booking_confirmation' view responds with a status code of
-        200 (OK) and updates both the payment and booking status to
-        Failed' and 'Canceled', respectively.
-
-        Note:
-        It is part of the unit tests for the 'BookingConfirmationView'
-        in the 'autoR5' Django application.
+        Test that a 'payment_intent.payment_failed' event fails the
+        payment and cancels the booking.
         """
-        self.intent_client_secret = "test_client_secret"
-        mock_retrieve.return_value = Mock(status='requires_payment_method')
-        self.client.force_login(self.user)
+        self.deliver('payment_intent.payment_failed')
 
-        response = self.client.get(reverse(
-            'booking_confirmation', args=[self.booking.id]), {
-            'payment_intent_client_secret': self.intent_client_secret,
-        })
+        response = self.confirm()
 
         booking = Booking.objects.get(id=self.booking.id)
         payment = Payment.objects.get(id=self.payment.id)
-        self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context['payment_status'], 'Failed')
         self.assertEqual(booking.status, 'Canceled')
         self.assertEqual(payment.payment_status, 'Failed')
 
+    def test_duplicate_event_is_applied_once(self):
+        """
+        Test that a redelivered event is acknowledged but not applied
+        again.
+        """
+        self.deliver('payment_intent.succeeded')
+        Booking.objects.filter(pk=self.booking.pk).update(status='Completed')
+
+        response = self.deliver('payment_intent.succeeded')
+
+        self.assertEqual(response.json(),
+                         {'received': True, 'applied': False})
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(Booking.objects.get(id=self.booking.id).status,
+                         'Completed')
+
+    def test_late_failure_keeps_successful_payment(self):
+        """
+        Test that a failure event delivered after the success event does
+        not undo the payment.
+        """
+        self.deliver('payment_intent.succeeded', event_id='evt_2')
+        self.deliver('payment_intent.payment_failed', event_id='evt_1')
+
+        self.assertEqual(
+            Payment.objects.get(id=self.payment.id).payment_status, 'Paid')
+        self.assertEqual(Booking.objects.get(id=self.booking.id).status,
+                         'Confirmed')
+
+    def test_invalid_signature_is_rejected(self):
+        """
+        Test that events not signed with the webhook secret are
+        rejected without touching the payment.
+        """
+        response = self.deliver('payment_intent.succeeded',
+                                secret='whsec_other')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+        self.assertEqual(
+            Payment.objects.get(id=self.payment.id).payment_status,
+            'Pending')
+
 
 @override_settings(
     STATICFILES_STORAGE=(
@@ -3031,12 +4381,11 @@ class DashboardViewTest(TestCase):
         response = self.client.get(self.url)
         self.assertContains(response, 'Book Again')
 
-    @patch('autoR5.signals.stripe.Refund.create',
-           return_value=Mock(status='succeeded'))
+    @patch('autoR5.refunds.stripe', new_callable=FakeStripe)
     @patch('autoR5.signals.process_cancellation_request',
            side_effect=process_cancellation_request)
     def test_cancellation_request_with_approved_request(
-            self, mock_process_cancellation_request, mock_refund_create):
+            self, mock_process_cancellation_request, fake_stripe):
         """
         Test the  dashboard view when a cancellation
         request is approved.
@@ -3053,14 +4402,14 @@ class DashboardViewTest(TestCase):
             self: The test case instance.
             mock_process_cancellation_request: A mocked function
             for processing a cancellation request.
-            mock_refund_create: A mocked function for creating
-            a Stripe refund.
+            fake_stripe: A 'FakeStripe' recording the refund.
 
         Usage:
         This test method simulates a user with a booking having
         an approved cancellation request. It creates a booking,
         payment object, and an approved cancellation request,
-        logs in the user, sends a GET request to the
+        runs the refund worker, logs in the user, sends a GET
+        request to the
         'dashboard' view, and checks if the response
         content meets the following criteria:
             - Booking details are displayed without revealing
@@ -3102,6 +4451,8 @@ class DashboardViewTest(TestCase):
             reason="Test reason",
             approved=True
         )
+        self.assertEqual(fake_stripe.calls, [])
+        refunds.process_refund_jobs()
 
         self.client.login(username="testuser", password="testpassword")
 
@@ -3117,8 +4468,10 @@ class DashboardViewTest(TestCase):
         self.assertNotContains(
             response, 'Cancellation request pending approval')
 
-        mock_refund_create.assert_called_with(
-            payment_intent=payment.payment_intent)
+        self.assertEqual(fake_stripe.calls, [(
+            'Refund', 'create',
+            {'payment_intent': payment.payment_intent,
+             'idempotency_key': f'refund-payment-{payment.id}'})])
 
     def test_cancellation_request_without_approved_request(self):
         """
@@ -3184,6 +4537,37 @@ class DashboardViewTest(TestCase):
 
         self.assertContains(response, 'Cancellation request pending approval')
 
+    def test_dashboard_query_count_is_constant(self):
+        """
+        Test that the dashboard runs a fixed number of queries however
+        many bookings and cancellation requests the user has.
+        """
+        now = timezone.now()
+        bookings = Booking.objects.bulk_create([
+            Booking(
+                user=self.user, car=self.car,
+                status='Confirmed' if i % 2 else 'Completed',
+                rental_date=now + timedelta(days=(i if i % 2 else -i) - 1),
+                return_date=now + timedelta(days=i if i % 2 else -i),
+                total_cost=Decimal('100.00'),
+            )
+            for i in range(1, 101)
+        ])
+        CancellationRequest.objects.bulk_create([
+            CancellationRequest(booking=booking, user=self.user,
+                                reason="Test reason")
+            for booking in bookings[::4]
+        ])
+        self.client.login(username='testuser', password='testpassword')
+
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(response.context['current_bookings']), 50)
+        self.assertEqual(len(response.context['past_bookings']), 50)
+        self.assertContains(response, 'Cancellation request pending approval',
+                            count=25)
+
 
 class LeaveReviewViewTest(TestCase):
     """
@@ -3724,12 +5108,11 @@ class ApproveRejectCancellationRequestViewTest(TestCase):
         self.cancellation_request = CancellationRequest.objects.create(
             booking=booking, user=self.normal_user, reason='Request reason')
 
-    @patch('autoR5.signals.stripe.Refund.create',
-           return_value=Mock(status='succeeded'))
+    @patch('autoR5.refunds.stripe', new_callable=FakeStripe)
     @patch('autoR5.signals.process_cancellation_request',
            side_effect=process_cancellation_request)
     def test_approve_cancel_request_as_staff(
-            self, mock_process_cancellation_request, mock_refund_create):
+            self, mock_process_cancellation_request, fake_stripe):
         """
         Test staff approval of a cancellation request.
 
@@ -3748,6 +5131,10 @@ class ApproveRejectCancellationRequestViewTest(TestCase):
         self.assertTrue(self.cancellation_request.approved)
         self.assertEqual(response.status_code, 302)  # Should redirect
         self.assertRedirects(response, reverse('dashboard'))
+        # The refund is queued for the worker, not issued in the request
+        self.assertEqual(fake_stripe.calls, [])
+        self.assertTrue(RefundJob.objects.filter(
+            cancellation_request=self.cancellation_request).exists())
 
     @patch('autoR5.signals.process_cancellation_request',
            side_effect=process_cancellation_request)
@@ -3805,34 +5192,223 @@ class ApproveRejectCancellationRequestViewTest(TestCase):
         request remains unmodified. It checks for the correct status
         code and confirms the request is unapproved.
         """
-        self.client.login(username='normaluser', password='normalpassword')
+        self.client.login(username='normaluser', password='normalpassword')
+
+        response = self.client.get(
+            reverse('approve_reject_cancellation_request',
+                    args=[self.cancellation_request.id, 'approve']))
+
+        self.assertEqual(response.status_code, 302)
+
+        self.cancellation_request.refresh_from_db()
+        self.assertFalse(self.cancellation_request.approved)
+
+        def test_reject_cancellation_request_as_normal_user(self):
+            """
+            Test normal user attempting to reject a cancellation request.
+
+            This test confirms that a normal user is not allowed to reject a
+            cancellation request, preventing any modifications to the request.
+            It also verifies the request's approval status.
+            """
+            self.client.login(username='normaluser', password='normalpassword')
+
+        response = self.client.get(
+            reverse('approve_reject_cancellation_request',
+                    args=[self.cancellation_request.id, 'reject']))
+
+        # Check that the cancellation request has not been modified
+        self.cancellation_request.refresh_from_db()
+        self.assertFalse(self.cancellation_request.approved)
+
+
+@patch('autoR5.refunds.stripe', new_callable=FakeStripe)
+class RefundPipelineTest(TestCase):
+    """
+    Unit tests for the asynchronous refund pipeline.
+
+    Usage:
+    'setUp' creates a paid booking. Each test patches the Stripe module
+    used by 'autoR5.refunds' with a 'FakeStripe', approves a
+    cancellation request and runs the worker, checking that refunds are
+    queued rather than issued in the request, retried with backoff and
+    never issued twice for the same payment.
+
+    Note:
+    This test class is part of the unit tests for the refund pipeline
+    in the 'autoR5' Django application.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='refunduser', password='testpassword')
+        self.car = Car.objects.create(
+            make="Toyota", model="Corolla", year=2022,
+            license_plate="RFD001", daily_rate=100.00, is_available=False)
+        self.booking = Booking.objects.create(
+            user=self.user, car=self.car, status='Confirmed',
+            rental_date=timezone.now() + timedelta(days=1),
+            return_date=timezone.now() + timedelta(days=3))
+        self.payment = Payment.objects.create(
+            user=self.user, booking=self.booking,
+            amount=Decimal('200.00'), payment_method='Stripe',
+            payment_status='Paid', payment_intent='pi_paid')
+
+    def approve(self):
+        return CancellationRequest.objects.create(
+            booking=self.booking, user=self.user, reason="Test reason",
+            approved=True)
+
+    def test_refund_is_queued_and_processed(self, fake_stripe):
+        """
+        Test that approval only queues a job and that the worker issues
+        the refund and cancels the booking.
+        """
+        self.approve()
+        self.approve()
+        self.assertEqual(RefundJob.objects.count(), 1)
+        self.assertEqual(fake_stripe.calls, [])
 
-        response = self.client.get(
-            reverse('approve_reject_cancellation_request',
-                    args=[self.cancellation_request.id, 'approve']))
+        results = refunds.process_refund_jobs()
 
-        self.assertEqual(response.status_code, 302)
+        self.assertEqual(results, {'succeeded': 1, 'failed': 0})
+        job = RefundJob.objects.get()
+        self.assertEqual(job.status, 'Succeeded')
+        self.assertEqual(job.refund_id, 're_fake_1')
+        self.payment.refresh_from_db()
+        self.booking.refresh_from_db()
+        self.car.refresh_from_db()
+        self.assertEqual(self.payment.payment_status, 'Refunded')
+        self.assertEqual(self.booking.status, 'Canceled')
+        self.assertTrue(self.car.is_available)
 
-        self.cancellation_request.refresh_from_db()
-        self.assertFalse(self.cancellation_request.approved)
+    def test_failed_refund_is_retried_with_same_key(self, fake_stripe):
+        """
+        Test that a failed attempt is rescheduled with backoff and that
+        the retry reuses the payment's idempotency key.
+        """
+        self.approve()
+        fake_stripe.fail_next()
+        now = timezone.now()
 
-        def test_reject_cancellation_request_as_normal_user(self):
-            """
-            Test normal user attempting to reject a cancellation request.
+        results = refunds.process_refund_jobs(now=now)
+        self.assertEqual(results, {'succeeded': 0, 'failed': 1})
+        job = RefundJob.objects.get()
+        self.assertEqual(job.status, 'Queued')
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(
+            job.next_attempt_at,
+            now + timedelta(seconds=refunds.REFUND_RETRY_DELAY))
+
+        # Not due yet
+        self.assertEqual(refunds.process_refund_jobs(now=now),
+                         {'succeeded': 0, 'failed': 0})
+
+        later = job.next_attempt_at
+        self.assertEqual(refunds.process_refund_jobs(now=later),
+                         {'succeeded': 1, 'failed': 0})
+        keys = {call[2]['idempotency_key'] for call in fake_stripe.calls}
+        self.assertEqual(keys, {f'refund-payment-{self.payment.id}'})
+
+    def test_refund_fails_after_max_attempts(self, fake_stripe):
+        """
+        Test that a job is marked as failed once it runs out of
+        attempts, leaving the booking untouched.
+        """
+        self.approve()
+        RefundJob.objects.update(attempts=refunds.REFUND_MAX_ATTEMPTS - 1)
+        fake_stripe.fail_next()
+
+        refunds.process_refund_jobs()
+
+        job = RefundJob.objects.get()
+        self.assertEqual(job.status, 'Failed')
+        self.assertIn('Network error', job.last_error)
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, 'Confirmed')
+
+    def test_unpaid_booking_is_canceled_without_refund(self, fake_stripe):
+        """
+        Test that approving the cancellation of an unpaid booking
+        cancels it at once without queueing a refund.
+        """
+        Payment.objects.update(payment_status='Pending')
+        self.approve()
+
+        self.assertFalse(RefundJob.objects.exists())
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, 'Canceled')
+
+    def test_process_refunds_command(self, fake_stripe):
+        """
+        Test that the worker command processes the queued refunds.
+        """
+        self.approve()
+        out = StringIO()
+        call_command('process_refunds', '--rate', '0', stdout=out)
+        self.assertIn('1 succeeded', out.getvalue())
+        self.assertEqual(fake_stripe.call_count('Refund', 'create'), 1)
+
+    def test_bulk_approval(self, fake_stripe):
+        """
+        Test that many requests are approved with a fixed number of
+        queries, with per-request outcomes and one batch of refund jobs.
+        """
+        requests = [CancellationRequest.objects.create(
+            booking=self.booking, user=self.user, reason="Test reason")]
+        for i in range(20):
+            booking = Booking.objects.create(
+                user=self.user, car=self.car, status='Confirmed',
+                rental_date=timezone.now() + timedelta(days=10 + 3 * i),
+                return_date=timezone.now() + timedelta(days=11 + 3 * i))
+            Payment.objects.create(
+                user=self.user, booking=booking, amount=Decimal('100.00'),
+                payment_method='Stripe',
+                payment_status='Paid' if i % 2 else 'Pending',
+                payment_intent=f'pi_{i}')
+            requests.append(CancellationRequest.objects.create(
+                booking=booking, user=self.user, reason="Test reason"))
+        ids = [cr.id for cr in requests] + [999999]
+
+        with self.assertNumQueries(11):
+            results = refunds.approve_cancellation_requests(ids)
+
+        outcomes = list(results.values())
+        self.assertEqual(outcomes.count('refund_queued'), 11)
+        self.assertEqual(outcomes.count('canceled'), 10)
+        self.assertEqual(results[999999], 'not_found')
+        self.assertEqual(RefundJob.objects.count(), 11)
+        self.assertEqual(
+            CancellationRequest.objects.filter(approved=True).count(), 21)
+        self.assertEqual(
+            Booking.objects.filter(status='Canceled').count(), 10)
+        self.assertEqual(fake_stripe.calls, [])
 
-            This test confirms that a normal user is not allowed to reject a
-            cancellation request, preventing any modifications to the request.
-            It also verifies the request's approval status.
-            """
-            self.client.login(username='normaluser', password='normalpassword')
+        again = refunds.approve_cancellation_requests(ids[:1])
+        self.assertEqual(again, {ids[0]: 'already_approved'})
 
-        response = self.client.get(
-            reverse('approve_reject_cancellation_request',
-                    args=[self.cancellation_request.id, 'reject']))
+    def test_bulk_approval_endpoint(self, fake_stripe):
+        """
+        Test that the bulk endpoint is limited to staff and reports the
+        outcome of every request.
+        """
+        cancellation_request = CancellationRequest.objects.create(
+            booking=self.booking, user=self.user, reason="Test reason")
+        url = reverse('bulk_approve_cancellation_requests')
 
-        # Check that the cancellation request has not been modified
-        self.cancellation_request.refresh_from_db()
-        self.assertFalse(self.cancellation_request.approved)
+        self.client.login(username='refunduser', password='testpassword')
+        response = self.client.post(url, {'ids': [cancellation_request.id]})
+        self.assertEqual(response.status_code, 302)
+
+        User.objects.create_user(
+            username='refundstaff', password='testpassword', is_staff=True)
+        self.client.login(username='refundstaff', password='testpassword')
+        response = self.client.post(
+            url, {'ids': [cancellation_request.id, 999999]})
+        self.assertEqual(response.json(), {'results': {
+            str(cancellation_request.id): 'refund_queued',
+            '999999': 'not_found',
+        }})
 
 
 class ContactViewTest(TestCase):
@@ -4967,6 +6543,8 @@ class CsvImportExportFormTest(TestCase):
             car_type='Saloon',
             fuel_type='Petrol'
         )
+        self.client.force_login(User.objects.create_superuser(
+            'exporter', 'exporter@example.com', 'adminpassword'))
 
         response = self.client.get(reverse('admin:export_csv'))
 
@@ -4984,7 +6562,635 @@ class CsvImportExportFormTest(TestCase):
         ).strip()
 
         self.assertMultiLineEqual(
-            response.content.decode().strip(), expected_csv_data)
+            b''.join(response.streaming_content).decode().strip(),
+            expected_csv_data)
+
+
+class CarCsvImportTest(TestCase):
+    """
+    Test the streaming fleet import in 'autoR5.car_import' and the
+    'import_csv' admin view using it.
+    """
+    HEADER = ('Make,Model,Year,License Plate,Daily Rate,Available,'
+              'Latitude,Longitude,Location City,Location Address,Image,'
+              'Features,Car Type,Fuel Type\n')
+
+    def upload(self, *rows):
+        """
+        Return an uploaded CSV file with the header and 'rows'.
+        """
+        return SimpleUploadedFile(
+            'cars.csv', (self.HEADER + ''.join(rows)).encode('utf-8'))
+
+    def row(self, plate, year='2023', rate='50.00'):
+        """
+        Return a valid CSV line for a car with license plate 'plate'.
+        """
+        return (f'Toyota,Camry,{year},{plate},{rate},TRUE,53.35,-6.26,'
+                f'Dublin,"1 Main Street, Dublin",,'
+                f'"GPS, Bluetooth",Saloon,Petrol\n')
+
+    def test_admin_import_handles_quoted_commas(self):
+        """
+        Test that the admin view imports quoted fields containing
+        commas and reports the outcome.
+        """
+        User.objects.create_superuser(
+            'importer', 'importer@example.com', 'adminpassword')
+        self.client.login(username='importer', password='adminpassword')
+
+        response = self.client.post(
+            reverse('admin:import_csv'),
+            {'csv_import': self.upload(self.row('CSV1'))}, follow=True)
+
+        car = Car.objects.get(license_plate='CSV1')
+        self.assertEqual(car.location_address, '1 Main Street, Dublin')
+        self.assertEqual(car.features, 'GPS, Bluetooth')
+        self.assertEqual(car.fuel_type, 'Petrol')
+        self.assertTrue(car.is_available)
+        self.assertIsNone(car.image)
+        self.assertContains(response, '1 row(s), 1 created, 0 updated')
+
+    def test_existing_cars_are_updated_and_bad_rows_reported(self):
+        """
+        Test that rows matching a license plate update the car, and
+        that invalid rows are skipped with their line number.
+        """
+        car = Car.objects.create(
+            make='Ford', model='Focus', year=2019, license_plate='CSV1',
+            daily_rate=30, is_available=False)
+
+        results = car_import.import_cars(self.upload(
+            self.row('CSV1', rate='75.50'),
+            self.row('CSV2'),
+            self.row('CSV3', year='new'),
+            'Toyota,Camry\n',
+            '\n',
+        ))
+
+        self.assertEqual(results['rows'], 4)
+        self.assertEqual(results['created'], 1)
+        self.assertEqual(results['updated'], 1)
+        self.assertEqual(results['failed'], 2)
+        self.assertEqual([line_num for line_num, _, _ in
+                          results['failures']], [4, 5])
+        car.refresh_from_db()
+        self.assertEqual(car.make, 'Toyota')
+        self.assertEqual(car.daily_rate, Decimal('75.50'))
+        self.assertTrue(car.is_available)
+        self.assertFalse(Car.objects.filter(license_plate='CSV3').exists())
+
+    def test_queries_do_not_grow_with_rows(self):
+        """
+        Test that each batch is written with a fixed number of queries,
+        and that a license plate repeated in a later batch updates the
+        car created by an earlier one.
+        """
+        Car.objects.create(
+            make='Ford', model='Focus', year=2019, license_plate='CSV0',
+            daily_rate=30)
+        rows = [self.row(f'CSV{i}') for i in range(120)]
+
+        with CaptureQueriesContext(connection) as queries:
+            results = car_import.import_cars(
+                self.upload(*rows, self.row('CSV5', rate='99.00')),
+                batch_size=50)
+
+        self.assertEqual(results['batches'], 3)
+        self.assertEqual(results['created'], 119)
+        self.assertEqual(results['updated'], 2)
+        self.assertEqual(Car.objects.count(), 120)
+        self.assertEqual(Car.objects.get(license_plate='CSV5').daily_rate,
+                         Decimal('99.00'))
+        # The plate lookup plus at most an insert, an id lookup and an
+        # update per batch.
+        statements = [query for query in queries.captured_queries
+                      if 'SAVEPOINT' not in query['sql']]
+        self.assertLessEqual(len(statements), 1 + 3 * 3)
+
+    def test_images_are_resolved_outside_a_transaction(self):
+        """
+        Test that by default every batch is committed on its own and
+        that the Cloudinary lookups run before its transaction starts.
+        """
+        depth = len(connection.atomic_blocks)
+        depths = []
+
+        def resolve(references):
+            depths.append(len(connection.atomic_blocks))
+            return {}, {}
+
+        with patch('autoR5.car_import.resolve_images', side_effect=resolve):
+            results = car_import.import_cars(self.upload(
+                self.row('CSV1'), self.row('CSV2'), self.row('CSV3')),
+                batch_size=2)
+
+        self.assertEqual(results['batches'], 2)
+        self.assertEqual(depths, [depth, depth])
+
+
+class ImageResolutionTest(TestCase):
+    """
+    Test the concurrent, cached Cloudinary lookups in 'autoR5.images'
+    and their use by the fleet import, against 'FakeCloudinary'.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.cloudinary = FakeCloudinary(public_ids=['car_images/known'])
+        patcher = patch('autoR5.images.cloudinary', self.cloudinary)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_references_are_deduplicated_and_cached(self):
+        """
+        Test that each distinct reference is resolved once, that new
+        images are uploaded, and that a second lookup is served from
+        the cache.
+        """
+        resolved, errors = images.resolve_images([
+            'car_images/known', 'car_images/known',
+            'https://example.com/car.jpg'])
+
+        self.assertEqual(errors, {})
+        self.assertEqual(resolved['car_images/known'], 'car_images/known')
+        uploaded = resolved['https://example.com/car.jpg']
+        self.assertEqual(self.cloudinary.call_count('search'), 2)
+        self.assertEqual(self.cloudinary.call_count('upload'), 1)
+
+        resolved, errors = images.resolve_images([
+            'car_images/known', 'https://example.com/car.jpg', uploaded])
+
+        self.assertEqual(resolved[uploaded], uploaded)
+        self.assertEqual(self.cloudinary.call_count(), 3)
+
+    def test_references_are_resolved_concurrently(self):
+        """
+        Test that slow lookups overlap instead of running one after
+        the other.
+        """
+        self.cloudinary.latency = 0.1
+        references = [f'car_images/car_{i}' for i in range(10)]
+        self.cloudinary.public_ids.update(references)
+
+        started = time.monotonic()
+        resolved, _ = images.resolve_images(references, workers=10)
+
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(resolved, {reference: reference
+                                    for reference in references})
+
+    def test_import_reports_rows_with_unresolvable_images(self):
+        """
+        Test that the import looks up a repeated image once and skips
+        the rows whose image cannot be resolved.
+        """
+        header = ('Make,Model,Year,License Plate,Daily Rate,Available,'
+                  'Latitude,Longitude,Location City,Location Address,'
+                  'Image,Features,Car Type,Fuel Type\n')
+        rows = ''.join(
+            f'Toyota,Camry,2023,{plate},50,TRUE,53.35,-6.26,Dublin,'
+            f'Main Street,{image},GPS,Saloon,Petrol\n'
+            for plate, image in [('IMG1', 'car_images/known'),
+                                 ('IMG2', 'car_images/known'),
+                                 ('IMG3', 'a_missing.jpg')])
+        self.cloudinary.fail_next()
+        # One worker looks the references up in sorted order, so the
+        # failure hits 'a_missing.jpg'.
+        with patch('autoR5.images.IMAGE_RESOLVE_WORKERS', 1):
+            results = car_import.import_cars(SimpleUploadedFile(
+                'cars.csv', (header + rows).encode('utf-8')))
+
+        self.assertEqual(self.cloudinary.calls, [
+            ('search', 'a_missing.jpg'), ('search', 'car_images/known')])
+        self.assertEqual(results['created'], 2)
+        self.assertEqual([line_num for line_num, _, _ in
+                          results['failures']], [4])
+        self.assertIn("'a_missing.jpg'", results['failures'][0][2])
+        self.assertEqual(
+            Car.objects.get(license_plate='IMG2').image.public_id,
+            'car_images/known')
+        self.assertFalse(Car.objects.filter(license_plate='IMG3').exists())
+
+    def test_non_cloudinary_errors_fail_only_their_reference(self):
+        """
+        Test that an unreadable file or a network error of the HTTP
+        client is reported for its reference instead of escaping the
+        worker thread.
+        """
+        self.cloudinary.fail_next(
+            FileNotFoundError("No such file: 'a_missing.jpg'"))
+        self.cloudinary.fail_next(ConnectionError('Connection reset'))
+
+        with patch('autoR5.images.IMAGE_RESOLVE_WORKERS', 1):
+            resolved, errors = images.resolve_images([
+                'a_missing.jpg', 'b_offline.jpg', 'car_images/known'])
+
+        self.assertEqual(resolved, {'car_images/known': 'car_images/known'})
+        self.assertIn('No such file', errors['a_missing.jpg'])
+        self.assertIn('Connection reset', errors['b_offline.jpg'])
+        self.assertFalse(cache.get(images.IMAGE_CACHE_KEY.format(
+            'a_missing.jpg')))
+
+
+class ImportJobTest(TestCase):
+    """
+    Test the background fleet imports in 'autoR5.import_jobs', the
+    'process_imports' worker and the 'ImportJob' admin pages.
+    """
+    HEADER = ('Make,Model,Year,License Plate,Daily Rate,Available,'
+              'Latitude,Longitude,Location City,Location Address,Image,'
+              'Features,Car Type,Fuel Type\n')
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            'importer', 'importer@example.com', 'adminpassword')
+        self.client.login(username='importer', password='adminpassword')
+
+    def upload(self, *plates):
+        """
+        Return an uploaded CSV file with a valid row per license plate,
+        followed by one row with an invalid year.
+        """
+        rows = ''.join(
+            f'Toyota,Camry,2023,{plate},50,TRUE,53.35,-6.26,Dublin,'
+            f'Main Street,,GPS,Saloon,Petrol\n' for plate in plates)
+        rows += 'Toyota,Camry,soon,BAD1,50,TRUE,53.35,-6.26,,,,,,\n'
+        return SimpleUploadedFile(
+            'fleet.csv', (self.HEADER + rows).encode('utf-8'))
+
+    def test_queued_import_is_run_by_the_worker(self):
+        """
+        Test that a background upload is stored and queued, that the
+        worker imports it with its progress, and that the failed rows
+        can be downloaded.
+        """
+        response = self.client.post(reverse('admin:import_csv'), {
+            'csv_import': self.upload('JOB1', 'JOB2', 'JOB3'),
+            'background': 'on',
+        })
+
+        job = ImportJob.objects.get()
+        self.assertRedirects(
+            response, reverse('admin:autoR5_importjob_change',
+                              args=[job.pk]))
+        self.assertEqual(job.status, 'Queued')
+        self.assertEqual(job.user, self.admin)
+        self.assertEqual(ImportFile.objects.get().name, job.file.name)
+        self.assertEqual(job.file.size, len(job.file.read()))
+        self.assertFalse(Car.objects.exists())
+        progress = self.client.get(
+            reverse('admin:autoR5_importjob_progress', args=[job.pk]))
+        self.assertFalse(progress.json()['done'])
+
+        call_command('process_imports', '--batch-size', '2',
+                     stdout=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'Succeeded')
+        self.assertEqual((job.rows, job.created, job.updated, job.failed),
+                         (4, 3, 0, 1))
+        self.assertEqual(Car.objects.count(), 3)
+        self.assertEqual(
+            self.client.get(reverse('admin:autoR5_importjob_progress',
+                                    args=[job.pk])).json(),
+            {'status': 'Succeeded', 'rows': 4, 'created': 3, 'updated': 0,
+             'failed': 1, 'error': '', 'done': True})
+        change_page = self.client.get(
+            reverse('admin:autoR5_importjob_change', args=[job.pk]))
+        self.assertContains(change_page, 'Download the failed rows')
+        self.assertContains(change_page, 'fleet')
+        failures = self.client.get(
+            reverse('admin:autoR5_importjob_failures', args=[job.pk]))
+        rows = list(csv.reader(StringIO(
+            b''.join(failures.streaming_content).decode())))
+        self.assertEqual(rows[0][:3], ['Line', 'Error', 'make'])
+        self.assertEqual(rows[1][0], '5')
+        self.assertEqual(rows[1][5], 'BAD1')
+
+    def test_progress_is_reported_after_every_batch(self):
+        """
+        Test that the worker commits every batch on its own and writes
+        the job's counts after each one, so the admin page sees them
+        while the import runs.
+        """
+        job = import_jobs.queue_import(self.upload('JOB1', 'JOB2', 'JOB3'))
+        seen = []
+
+        def spy(csv_file, batch_size, atomic, progress):
+            self.assertFalse(atomic)
+
+            def report(results):
+                progress(results)
+                seen.append(ImportJob.objects.values_list(
+                    'rows', 'created', 'failed').get(pk=job.pk))
+
+            return car_import.import_cars(
+                csv_file, batch_size, atomic=atomic, progress=report)
+
+        with patch('autoR5.import_jobs.import_cars', spy):
+            import_jobs.run_import_job(
+                import_jobs.claim_import_job(), batch_size=2)
+
+        self.assertEqual(seen, [(2, 2, 0), (4, 3, 1)])
+
+    def test_large_uploads_are_queued(self):
+        """
+        Test that files over 'IMPORT_INLINE_MAX_BYTES' are queued even
+        when a background import was not requested.
+        """
+        with patch('autoR5.admin.IMPORT_INLINE_MAX_BYTES', 10):
+            self.client.post(reverse('admin:import_csv'),
+                             {'csv_import': self.upload('JOB1')})
+
+        self.assertEqual(ImportJob.objects.get().status, 'Queued')
+        self.assertFalse(Car.objects.exists())
+
+    def test_stalled_jobs_are_claimed_again(self):
+        """
+        Test that a running job is only taken over once it stopped
+        reporting progress for 'IMPORT_CLAIM_TIMEOUT' seconds.
+        """
+        job = import_jobs.queue_import(self.upload('JOB1'))
+        now = timezone.now()
+        self.assertEqual(import_jobs.claim_import_job(now), job)
+        self.assertIsNone(import_jobs.claim_import_job(now))
+
+        later = now + timedelta(seconds=import_jobs.IMPORT_CLAIM_TIMEOUT + 1)
+        self.assertEqual(import_jobs.claim_import_job(later), job)
+
+    def test_unreadable_file_fails_the_job(self):
+        """
+        Test that a file that cannot be decoded marks the job failed
+        with the error.
+        """
+        job = import_jobs.queue_import(SimpleUploadedFile(
+            'fleet.csv', self.HEADER.encode('utf-8') + b'\xff\xfe\n'))
+
+        import_jobs.process_import_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'Failed')
+        self.assertIn('utf-8', job.error)
+        self.assertIsNotNone(job.finished_at)
+
+    @patch('autoR5.models.IMPORT_FILE_CHUNK_SIZE', 64)
+    def test_files_are_stored_and_read_in_chunks(self):
+        """
+        Test that an import file is split into fixed-size chunk rows
+        and read back one chunk at a time, and that the worker imports
+        it from that stream.
+        """
+        job = import_jobs.queue_import(self.upload(
+            *[f'CHUNK{i}' for i in range(5)]))
+        content = (self.HEADER + ''.join(
+            f'Toyota,Camry,2023,CHUNK{i},50,TRUE,53.35,-6.26,Dublin,'
+            f'Main Street,,GPS,Saloon,Petrol\n' for i in range(5)) +
+            'Toyota,Camry,soon,BAD1,50,TRUE,53.35,-6.26,,,,,,\n'
+        ).encode('utf-8')
+
+        chunks = list(ImportFileChunk.objects.order_by('index')
+                      .values_list('index', 'data'))
+        self.assertEqual([index for index, _ in chunks],
+                         list(range(len(chunks))))
+        self.assertTrue(all(len(data) == 64 for _, data in chunks[:-1]))
+        self.assertEqual(job.file.size, len(content))
+        with job.file.open('rb') as stored:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(stored.read(10), content[:10])
+            self.assertEqual(len(queries), 1)
+            stored.seek(100)
+            self.assertEqual(stored.read(), content[100:])
+
+        import_jobs.process_import_jobs()
+
+        self.assertEqual(Car.objects.filter(
+            license_plate__startswith='CHUNK').count(), 5)
+
+
+class StreamingExportTest(TestCase):
+    """
+    Test the streamed CSV exports in 'autoR5.exports' and the export
+    pages of the car, booking and payment admins.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'finance', 'finance@example.com', 'adminpassword')
+        self.cars = [
+            Car.objects.create(
+                make='Toyota', model='Camry', year=2023,
+                license_plate=f'EXP{i}', daily_rate=50,
+                location_address='1 Main Street, Dublin')
+            for i in range(5)
+        ]
+        now = timezone.now()
+        self.booking = Booking.objects.create(
+            user=self.user, car=self.cars[0], rental_date=now,
+            return_date=now + timedelta(days=2), status='Confirmed')
+        Payment.objects.create(
+            user=self.user, booking=self.booking, amount=100,
+            payment_method='Stripe', payment_status='Paid',
+            payment_intent='pi_123_secret_abc')
+        self.client.login(username='finance', password='adminpassword')
+
+    def read(self, response):
+        """
+        Return the rows of a streamed CSV response.
+        """
+        content = b''.join(response.streaming_content)
+        if response['Content-Type'] == 'application/gzip':
+            content = gzip.decompress(content)
+        return list(csv.reader(StringIO(content.decode())))
+
+    def test_car_export_is_streamed_in_chunks(self):
+        """
+        Test that cars are fetched and written 'EXPORT_CHUNK_SIZE' rows
+        at a time, and that the gzip export holds the same file.
+        """
+        with patch('autoR5.exports.EXPORT_CHUNK_SIZE', 2):
+            response = self.client.get(reverse('admin:export_csv'))
+            chunks = list(response.streaming_content)
+
+        self.assertEqual(len(chunks), 1 + 3)
+        rows = list(csv.reader(StringIO(b''.join(chunks).decode())))
+        self.assertEqual(rows[0], exports.CAR_EXPORT.header)
+        self.assertEqual([row[3] for row in rows[1:]],
+                         [car.license_plate for car in self.cars])
+        self.assertEqual(rows[1][9], '1 Main Street, Dublin')
+
+        compressed = self.client.get(reverse('admin:export_csv'),
+                                     {'gzip': '1'})
+        self.assertEqual(compressed['Content-Type'], 'application/gzip')
+        self.assertIn('car_data.csv.gz', compressed['Content-Disposition'])
+        self.assertEqual(self.read(compressed), rows)
+
+    def test_car_export_can_be_imported_back(self):
+        """
+        Test that the exported file is read by the fleet import without
+        changes.
+        """
+        content = b''.join(
+            self.client.get(reverse('admin:export_csv')).streaming_content)
+
+        results = car_import.import_cars(
+            SimpleUploadedFile('cars.csv', content))
+
+        self.assertEqual((results['updated'], results['failed']), (5, 0))
+
+    def test_finance_exports(self):
+        """
+        Test that bookings and payments are exported to staff, without
+        the client secret of the payment intents.
+        """
+        booking_url = reverse('admin:autoR5_booking_export_csv')
+        payment_url = reverse('admin:autoR5_payment_export_csv')
+
+        bookings = self.read(self.client.get(booking_url))
+        payments = self.read(self.client.get(payment_url, {'gzip': '1'}))
+
+        self.assertEqual(bookings[0], exports.BOOKING_EXPORT.header)
+        self.assertEqual(bookings[1][:4], [
+            str(self.booking.pk), 'finance', str(self.cars[0].pk), 'EXP0'])
+        self.assertEqual(bookings[1][7], 'Confirmed')
+        self.assertEqual(payments[1][2:4], ['finance', '100.00'])
+        self.assertEqual(payments[1][-1], 'pi_123')
+        self.assertContains(
+            self.client.get(reverse('admin:autoR5_payment_changelist')),
+            payment_url + '?gzip=1')
+
+    def test_exports_require_view_permission(self):
+        """
+        Test that anonymous users are sent to the admin login and that
+        staff without the view permission of a model cannot export it.
+        """
+        urls = [reverse('admin:export_csv'),
+                reverse('admin:autoR5_booking_export_csv'),
+                reverse('admin:autoR5_payment_export_csv')]
+        self.client.logout()
+        for url in urls:
+            self.assertRedirects(
+                self.client.get(url),
+                f"{reverse('admin:login')}?next={url}",
+                fetch_redirect_response=False)
+
+        self.client.force_login(User.objects.create_user(
+            'clerk', password='testpassword', is_staff=True))
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class GeocodingTest(TestCase):
+    """
+    Test the batched, cached reverse geocoding in 'autoR5.geocoding'
+    against 'FakeGeocoder'.
+    """
+
+    def setUp(self):
+        self.geocoder = FakeGeocoder({
+            (53.349805, -6.26031): ({'city': 'Dublin'}, 'Dublin 1, Ireland'),
+            (53.2707, -9.0568): ({'town': 'Galway'}, 'Eyre Square, Galway'),
+        })
+
+    def car(self, plate, latitude, longitude):
+        """
+        Create a car at the given coordinates without a location.
+        """
+        return Car.objects.create(
+            make='Toyota', model='Camry', year=2023, license_plate=plate,
+            daily_rate=50, latitude=latitude, longitude=longitude)
+
+    def test_identical_points_are_looked_up_once(self):
+        """
+        Test that cars at the same rounded point share one lookup, that
+        every batch is written with 'bulk_update', and that a second
+        run is served from the cache.
+        """
+        cars = [self.car(f'GEO{i}', '53.349805', '-6.260310')
+                for i in range(4)]
+        cars.append(self.car('GEO4', '53.349811', '-6.260302'))
+        cars.append(self.car('GEO5', '53.270700', '-9.056800'))
+
+        with CaptureQueriesContext(connection) as queries:
+            results = geocoding.geocode_cars(
+                Car.objects.all(), self.geocoder, rate=0, batch_size=3)
+
+        self.assertEqual(results, {'processed': 6, 'updated': 6,
+                                   'failed': 0, 'lookups': 2})
+        self.assertEqual(len(self.geocoder.calls), 2)
+        self.assertEqual(GeocodedLocation.objects.count(), 2)
+        # Per batch: the cars, the cache, the new points and the update.
+        statements = [query for query in queries.captured_queries
+                      if 'SAVEPOINT' not in query['sql']]
+        self.assertLessEqual(len(statements), 2 * 4 + 1)
+        self.assertEqual(
+            sorted(Car.objects.values_list('location_city', flat=True)),
+            ['Dublin'] * 5 + ['Galway'])
+        self.assertEqual(Car.objects.get(license_plate='GEO5')
+                         .location_address, 'Eyre Square, Galway')
+
+        geocoding.geocode_cars(Car.objects.all(), self.geocoder, rate=0)
+        self.assertEqual(len(self.geocoder.calls), 2)
+
+    def test_failed_and_unknown_points_are_reported(self):
+        """
+        Test that a failed lookup leaves the car unchanged and is
+        retried later, and that a point without an address is cached.
+        """
+        dublin = self.car('GEO1', '53.349805', '-6.260310')
+        self.car('GEO2', '60.000000', '10.000000')
+        # Points are looked up in key order, so the failure hits Dublin.
+        self.geocoder.fail_next()
+
+        results = geocoding.geocode_cars(
+            Car.objects.order_by('id'), self.geocoder, rate=0)
+
+        self.assertEqual((results['updated'], results['failed']), (0, 2))
+        dublin.refresh_from_db()
+        self.assertIsNone(dublin.location_city)
+        self.assertEqual(list(GeocodedLocation.objects.values_list(
+            'key', 'address')), [('60.0000,10.0000', None)])
+
+        results = geocoding.geocode_cars(
+            Car.objects.order_by('id'), self.geocoder, rate=0)
+
+        self.assertEqual((results['updated'], results['lookups']), (1, 1))
+        dublin.refresh_from_db()
+        self.assertEqual(dublin.location_city, 'Dublin')
+
+    def test_lookups_are_rate_limited(self):
+        """
+        Test that lookups are spaced according to the rate.
+        """
+        for i in range(3):
+            self.car(f'GEO{i}', f'5{i}.000000', '-6.000000')
+
+        started = time.monotonic()
+        results = geocoding.geocode_cars(
+            Car.objects.all(), self.geocoder, rate=20)
+
+        self.assertEqual(results['lookups'], 3)
+        self.assertGreaterEqual(time.monotonic() - started, 2 / 20)
+
+    def test_jobs_record_progress(self):
+        """
+        Test that a queued job is claimed once and records the outcome
+        of its cars.
+        """
+        cars = [self.car(f'GEO{i}', '53.349805', '-6.260310')
+                for i in range(3)]
+        job = geocoding.queue_geocoding([car.pk for car in cars[:2]])
+
+        self.assertEqual(
+            geocoding.process_geocode_jobs(self.geocoder, rate=0), job)
+        self.assertIsNone(
+            geocoding.process_geocode_jobs(self.geocoder, rate=0))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'Succeeded')
+        self.assertEqual((job.processed, job.updated, job.failed),
+                         (2, 2, 0))
+        self.assertIsNone(Car.objects.get(pk=cars[2].pk).location_city)
 
 
 class UpdateLocationTest(TestCase):
@@ -5045,8 +7251,7 @@ class UpdateLocationTest(TestCase):
             location_address='',
         )
 
-    @patch('geopy.geocoders.Nominatim')
-    def test_update_location(self, mock_geocoder):
+    def test_update_location(self):
         """
         Test the 'update_location' admin action for a 'Car'
         object.
@@ -5057,16 +7262,15 @@ class UpdateLocationTest(TestCase):
         specific 'Car' object. The primary objective is to
         validate that the action correctly retrieves and
         stores location information based on the car's
-        latitude and longitude coordinates by simulating
-        a call to a geocoding service (Nominatim). The
+        latitude and longitude coordinates by running the
+        'process_geocoding' worker against a stub geocoder. The
         method checks whether the location fields, including
         'location_city' and 'location_address', are populated
         as expected with the geocoded data.
 
         Usage:
-        1. Mock the Nominatim geocoder using the @patch
-        decorator and provide a mock geocoding response containing
-        address details such as 'city' and 'address.'
+        1. Create a 'FakeGeocoder' answering the car's coordinates
+        with address details such as 'city' and 'address.'
 
         2. Confirm that the car's 'location_city' and
         'location_address' fields are initially empty.
@@ -5075,8 +7279,9 @@ class UpdateLocationTest(TestCase):
         by creating an HTTP POST request to the corresponding
         admin interface.
 
-        4. After executing the admin action, refresh the 'Car'
-        instance from the database.
+        4. After executing the admin action, run the
+        'process_geocoding' worker with the stub geocoder and
+        refresh the 'Car' instance from the database.
 
         5. Validate that the 'location_city' field is updated to
         'San Jose' and that 'location_address' contains relevant
@@ -5091,18 +7296,13 @@ class UpdateLocationTest(TestCase):
         it in the corresponding fields. It also confirms that the
         geocoding service's response is processed as expected.
         """
-        mock_nominatim = mock_geocoder.return_value
-        mock_location = {
-            'raw': {
-                'address': {
-                    'city': 'San Jose',
-                },
-            },
-            'address': '24, North 5th Street, San Jose, CA 95112 San Jose,'
-            'Horrace Mann, '
-            'Downtown San Jose San Jose California United States',
-        }
-        mock_nominatim.reverse.return_value = mock_location
+        geocoder = FakeGeocoder({
+            (37.338207, -121.886330): (
+                {'city': 'San Jose'},
+                '24, North 5th Street, San Jose, CA 95112 San Jose,'
+                'Horrace Mann, '
+                'Downtown San Jose San Jose California United States'),
+        })
 
         self.assertEqual(self.car.location_city, '')
         self.assertEqual(self.car.location_address, '')
@@ -5117,6 +7317,12 @@ class UpdateLocationTest(TestCase):
             }
         )
 
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(GeocodeJob.objects.get().status, 'Queued')
+        with patch('autoR5.geocoding.make_geocoder', return_value=geocoder):
+            call_command('process_geocoding', '--rate', '0',
+                         stdout=StringIO())
+
         self.car.refresh_from_db()
         self.assertEqual(self.car.location_city, 'San Jose')
         self.assertIn('24, North 5th Street', self.car.location_address)
@@ -5349,132 +7555,6 @@ class TestUrls(TestCase):
         self.assertEqual(resolve(url).func,
                          views.edit_profile)
 
-    def test_get_car_makes_url(self):
-        """
-        Verify the URL pattern for the 'get_car_makes' view.
-
-        Purpose:
-        Ensures that the 'get_car_makes' URL correctly maps
-        to the 'get_car_makes' view function.
-
-        Usage:
-        Validates the URL pattern for the 'get_car_makes'
-        view by comparing the resolved view function to the expected
-        'get_car_makes' view function.
-
-        Note:
-        Essential to confirm that the 'get_car_makes' URL leads
-        to car makes retrieval.
-        """
-        url = reverse('get_car_makes')
-        self.assertEqual(resolve(url).func,
-                         views.get_car_makes)
-
-    def test_get_car_models_url(self):
-        """
-        Verify the URL pattern for the 'get_car_models' view.
-
-        Purpose:
-        Ensures that the 'get_car_models' URL correctly maps to
-        the 'get_car_models' view function.
-
-        Usage:
-        Validates the URL pattern for the 'get_car_models'
-        view by comparing the resolved view function to the
-        expected 'get_car_models' view function.
-
-        Note:
-        Essential to confirm that the 'get_car_models'
-        URL leads to car models retrieval.
-        """
-        url = reverse('get_car_models')
-        self.assertEqual(resolve(url).func,
-                         views.get_car_models)
-
-    def test_get_car_years_url(self):
-        """
-        Verify the URL pattern for the 'get_car_years' view.
-
-        Purpose:
-        Ensures that the 'get_car_years' URL correctly maps to the
-        'get_car_years' view function.
-
-        Usage:
-        Validates the URL pattern for the 'get_car_years' view by
-        comparing the resolved view function to the expected
-        'get_car_years' view function.
-
-        Note:
-        Essential to confirm that the 'get_car_years' URL
-        leads to car years retrieval.
-        """
-        url = reverse('get_car_years')
-        self.assertEqual(resolve(url).func,
-                         views.get_car_years)
-
-    def test_get_car_locations_url(self):
-        """
-        Verify the URL pattern for the 'get_car_locations' view.
-
-        Purpose:
-        Ensures that the 'get_car_locations' URL correctly maps
-        to the 'get_car_locations' view function.
-
-        Usage:
-        Validates the URL pattern for the 'get_car_locations'
-        view by comparing the resolved view function to the
-        expected 'get_car_locations' view function.
-
-        Note:
-        Essential to confirm that the 'get_car_locations'
-        URL leads to car locations retrieval.
-        """
-        url = reverse('get_car_locations')
-        self.assertEqual(resolve(url).func,
-                         views.get_car_locations)
-
-    def test_get_car_types_url(self):
-        """
-        Verify the URL pattern for the 'get_car_types' view.
-
-        Purpose:
-        Ensures that the 'get_car_types' URL correctly maps to
-        the 'get_car_types' view function.
-
-        Usage:
-        Validates the URL pattern for the 'get_car_types'
-        view by comparing the resolved view function to the expected
-        'get_car_types' view function.
-
-        Note:
-        Essential to confirm that the 'get_car_types' URL
-        leads to car types retrieval.
-        """
-        url = reverse('get_car_types')
-        self.assertEqual(resolve(url).func,
-                         views.get_car_types)
-
-    def test_get_fuel_types_url(self):
-        """
-        Verify the URL pattern for the 'get_fuel_types' view.
-
-        Purpose:
-        Ensures that the 'get_fuel_types' URL correctly maps
-        to the 'get_fuel_types' view function.
-
-        Usage:
-        Validates the URL pattern for the 'get_fuel_types'
-        view by comparing the resolved view function to the expected
-        'get_fuel_types' view function.
-
-        Note:
-        Essential to confirm that the 'get_fuel_types' URL leads to
-        fuel types retrieval.
-        """
-        url = reverse('get_fuel_types')
-        self.assertEqual(resolve(url).func,
-                         views.get_fuel_types)
-
     def test_checkout_url(self):
         """
         Verify the URL pattern for the 'checkout' view.
@@ -5807,7 +7887,7 @@ class AJAXFilterTests(LiveServerTestCase):
         time.sleep(2)
 
         filter_button = self.selenium.find_element(
-            By.XPATH, '//*[@id="filter-form"]/div/div[7]/button[1]')
+            By.XPATH, '//*[@id="filter-form"]//button[@type="submit"]')
         filter_button.click()
 
         time.sleep(3)
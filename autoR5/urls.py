@@ -22,26 +22,30 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('car/<int:car_id>/', views.car_detail, name='car_detail'),
     path('car/<int:car_id>/book/', views.book_car, name='book_car'),
+    path('car/<int:car_id>/booked_dates/', views.booked_dates,
+         name='booked_dates'),
     path('booking/<int:booking_id>/confirmation/',
          views.booking_confirmation, name='booking_confirmation'),
     path('car/<int:car_id>/review/', views.leave_review, name='leave_review'),
+    path('car/<int:car_id>/reviews/', views.car_reviews, name='car_reviews'),
     path('cars_list/', views.cars_list, name='cars_list'),
+    path('cars_list/json/', views.cars_list_json, name='cars_list_json'),
     path('contact/', views.contact, name='contact'),
     path('dashboard/', views.dashboard,
          name='dashboard'),
     path('edit_profile/', views.edit_profile, name='edit_profile'),
-    path('get_car_makes/', views.get_car_makes, name='get_car_makes'),
-    path('get_car_models/', views.get_car_models, name='get_car_models'),
-    path('get_car_years/', views.get_car_years, name='get_car_years'),
-    path('get_car_locations/', views.get_car_locations,
-         name='get_car_locations'),
-    path('get_car_types/', views.get_car_types, name='get_car_types'),
-    path('get_fuel_types/', views.get_fuel_types, name='get_fuel_types'),
+    path('api/cars/', views.cars_api, name='cars_api'),
+    path('api/facets/', views.car_facets, name='car_facets'),
+    path('api/quote/', views.car_quote, name='car_quote'),
     path('car/<int:car_id>/book/<int:booking_id>/checkout/',
          views.checkout, name='checkout'),
+    path('stripe/webhook/', views.stripe_webhook, name='stripe_webhook'),
     path('delete_booking/<int:booking_id>/',
          views.delete_booking, name='delete_booking'),
     path('approve_reject_cancellation_request/<int:request_id>/<str:action>/',
          views.approve_reject_cancellation_request,
          name='approve_reject_cancellation_request'),
+    path('cancellation_requests/approve/',
+         views.bulk_approve_cancellation_requests,
+         name='bulk_approve_cancellation_requests'),
 ]
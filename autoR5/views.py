@@ -3,8 +3,7 @@ Imports necessary modules, libraries, functions, and
 classes for the 'autoR5' Django web application.
 
 - 'stripe' for payment processing functionality.
-- 'date' and 'timedelta' from 'datetime' for handling
-    date and time operations.
+- 'date' from 'datetime' for handling date operations.
 - 'render', 'redirect', 'get_object_or_404', 'reverse' from
     'django.shortcuts' for rendering templates, redirection,
     and handling 404 errors.
@@ -13,14 +12,23 @@ for requiring authentication to access views.
 - 'messages' from 'django.contrib' for displaying
 messages to users.
 - 'timezone' from 'django.utils' for handling time zones.
-- 'Q' from 'django.db.models' for complex database queries.
+- 'csrf_exempt' from 'django.views.decorators.csrf' for the Stripe
+webhook, which is authenticated by its signature instead.
+- 'require_POST' from 'django.views.decorators.http' for restricting
+views to POST requests.
+- 'Q', 'Exists', 'OuterRef' and 'Subquery' from 'django.db.models' for
+complex database queries.
 - 'HttpResponseRedirect', 'HttpResponse' from 'django.http'
 for HTTP responses.
 - 'Paginator', 'EmptyPage', 'PageNotAnInteger' from
 'django.core.paginator' for paginating querysets.
 - 'gettext as _' from 'django.utils.translation' for
 translation purposes.
-- 'JsonResponse' from 'django.http' for handling JSON responses.
+- 'json' for encoding the streamed fleet API lines.
+- 'JsonResponse' and 'StreamingHttpResponse' from 'django.http' for
+handling JSON and streamed responses.
+- 'DjangoJSONEncoder' from 'django.core.serializers.json' for
+encoding decimals in JSON.
 - 'settings' from 'django.conf' for accessing project settings.
 - 'Car', 'Booking', 'Review', 'CancellationRequest', 'Payment',
 'ContactFormSubmission' from '.models' for accessing model classes.
@@ -28,9 +36,27 @@ translation purposes.
 'UserProfileForm' from '.forms' for accessing form classes.
 - 'RefundProcessingError' from '.signals' for handling
 refund processing errors.
+- 'booking_payment', 'payment_intent_for' and 'handle_stripe_event'
+from '.payments' for reusing the PaymentIntent of a booking at checkout
+and applying Stripe webhook events.
+- 'approve_cancellation_requests' from '.refunds' for approving
+cancellation requests in bulk.
+- 'available_cars', 'booked_ranges' and 'parse_date_range' from
+'.availability' for searching and displaying availability with the
+availability engine.
+- 'cached_facet_rows', 'facet_counts' and 'facet_values' from
+'.facets' for the cached, faceted filter options.
+- 'quote' from '.quotes' for side-effect-free price previews.
+- 'BookingConflict', 'renew_hold' and 'reserve_booking' from
+'.reservations' for saving bookings without double-booking a car and
+holding the dates during checkout.
+- 'CAR_SORTS', 'REVIEW_ORDERING', 'car_ordering' and 'keyset_page' from
+'.pagination' for the sort options and cursor-based pagination of the
+fleet listing and the car reviews.
 """
+import json
 import stripe
-from datetime import date, timedelta
+from datetime import date
 from django.shortcuts import (render, redirect,
                               get_object_or_404)
 from django.urls import reverse
@@ -38,12 +64,16 @@ from django.contrib.auth.decorators import (login_required,
                                             user_passes_test)
 from django.contrib import messages
 from django.utils import timezone
-from django.db.models import Q
+from django.views.decorators.http import require_POST
+from django.views.decorators.csrf import csrf_exempt
+from django.db.models import Exists, OuterRef, Q, Subquery
 from django.http import HttpResponseRedirect, HttpResponse
 from django.core.paginator import (Paginator, EmptyPage,
                                    PageNotAnInteger)
 from django.utils.translation import gettext as _
-from django.http import JsonResponse, HttpResponseForbidden
+from django.http import (JsonResponse, HttpResponseForbidden,
+                         StreamingHttpResponse)
+from django.core.serializers.json import DjangoJSONEncoder
 from django.conf import settings
 from .models import (Car, Booking, Review,
                      CancellationRequest, Payment,
@@ -51,6 +81,16 @@ from .models import (Car, Booking, Review,
 from .forms import (BookingForm, ReviewForm, ContactForm,
                     CancellationRequestForm, UserProfileForm)
 from .signals import RefundProcessingError
+from .refunds import approve_cancellation_requests
+from .payments import (booking_payment, handle_stripe_event,
+                       payment_intent_for)
+from .availability import (available_cars, booked_ranges,
+                           parse_date_range)
+from .facets import cached_facet_rows, facet_counts, facet_values
+from .quotes import quote
+from .reservations import BookingConflict, renew_hold, reserve_booking
+from .pagination import (CAR_SORTS, REVIEW_ORDERING, car_ordering,
+                         keyset_page)
 
 
 def index(request):
@@ -60,8 +100,9 @@ def index(request):
     Purpose:
     This view is responsible for rendering the home page of the
     application. It retrieves unique car types and fuel types
-    from the database and passes them to the 'index.html'
-    template for display.
+    from the cached facet lists and passes them to the 'index.html'
+    template for display, so a page view does not touch the
+    database unless the fleet has changed.
 
     Args:
     - 'request': The HTTP request object sent by the user's
@@ -76,15 +117,54 @@ def index(request):
     the home page and is called when a user accesses the
     application's main landing page.
     """
-    car_types = Car.objects.values_list(
-        'car_type', flat=True).distinct().exclude(car_type=None)
-    fuel_types = Car.objects.values_list(
-        'fuel_type', flat=True).distinct().exclude(fuel_type=None)
+    rows = cached_facet_rows()
+    car_types = facet_values('car_type', rows)
+    fuel_types = facet_values('fuel_type', rows)
     return render(request, 'index.html',
                   {'car_types': car_types,
                    'fuel_types': fuel_types})
 
 
+def filtered_cars(params):
+    """
+    Build the fleet listing queryset for a set of filter parameters.
+
+    Purpose:
+    Shared by 'cars_list' and 'cars_list_json' so the HTML page and the
+    JSON listing always agree. Without any filter only cars flagged as
+    available are listed; otherwise the given filters are applied. When
+    both 'start' and 'end' form a valid date range, cars booked in that
+    window are left out.
+
+    Args:
+    - 'params': A 'QueryDict' (usually 'request.GET') with any of
+    'make', 'model', 'year', 'location', 'car_type', 'fuel_type',
+    'start', 'end' and 'sort'.
+
+    Returns:
+    A tuple of the 'Car' queryset, ordered by the requested sort (see
+    'CAR_SORTS') so pages are deterministic, and the parsed date range
+    (or None).
+    """
+    filters = {}
+    for param, field in [('make', 'make'), ('model', 'model'),
+                         ('year', 'year'), ('location', 'location_city'),
+                         ('car_type', 'car_type'),
+                         ('fuel_type', 'fuel_type')]:
+        if params.get(param):
+            filters[field] = params.get(param)
+
+    if filters:
+        all_cars = Car.objects.filter(**filters)
+    else:
+        all_cars = Car.objects.filter(is_available=True)
+
+    date_range = parse_date_range(params.get('start'), params.get('end'))
+    if date_range:
+        all_cars = available_cars(*date_range, queryset=all_cars)
+    return all_cars.order_by(*car_ordering(params.get('sort'))), date_range
+
+
 def cars_list(request):
     """
     View to display a list of cars in the 'autoR5' Django web application.
@@ -95,6 +175,21 @@ def cars_list(request):
     request. It allows users to filter cars by make, model, year,
     location, car type, and fuel type, and displays paginated results.
 
+    When both 'start' and 'end' dates ('YYYY-MM-DD') are given, only
+    cars without a Pending or Confirmed booking overlapping that window
+    are listed. The check runs as a 'NOT EXISTS' subquery inside the
+    paginated query, so its cost does not grow with the fleet size.
+
+    The dropdown options are read from the cached facet lists, which
+    are invalidated whenever a car is saved or deleted.
+
+    Cars are ordered by daily rate and id, or with 'sort=rating' by
+    the precomputed average rating (an indexed column, so no aggregate
+    over the reviews is needed). Passing 'after' (even empty)
+    switches to keyset pagination: pages are fetched after an opaque
+    cursor without the 'COUNT(*)' and 'OFFSET' queries of numbered
+    pages, and only a 'Next' link is offered.
+
     Args:
     - 'request': The HTTP request object sent by the user's browser,
     including any filter parameters in the query string.
@@ -109,54 +204,51 @@ def cars_list(request):
     cars, and the results are displayed with pagination for a better user
     experience.
     """
-    cars = Car.objects.filter(is_available=True)
-
     make = request.GET.get('make')
     model = request.GET.get('model')
     year = request.GET.get('year')
     location = request.GET.get('location')
     car_type = request.GET.get('car_type')
     fuel_type = request.GET.get('fuel_type')
+    start = request.GET.get('start')
+    end = request.GET.get('end')
+    sort = request.GET.get('sort')
 
-    filters = {}
-    if make:
-        filters['make'] = make
-    if model:
-        filters['model'] = model
-    if year:
-        filters['year'] = year
-    if location:
-        filters['location_city'] = location
-    if car_type:
-        filters['car_type'] = car_type
-    if fuel_type:
-        filters['fuel_type'] = fuel_type
-
-    filtered_cars = Car.objects.filter(**filters)
-
-    all_cars = filtered_cars if any([
-        make, model, year, location,
-        car_type, fuel_type])else cars
-
-    makes = Car.objects.values('make').distinct()
-    models = Car.objects.values('model').distinct()
-    years = Car.objects.values('year').distinct()
-    locations = Car.objects.values('location_city').distinct()
+    all_cars, date_range = filtered_cars(request.GET)
+
+    rows = cached_facet_rows()
+    makes = facet_values('make', rows)
+    models = facet_values('model', rows)
+    years = facet_values('year', rows)
+    locations = facet_values('location_city', rows)
     car_types = Car.CAR_TYPES
     fuel_types = Car.FUEL_TYPES
 
-    page_number = request.GET.get('page')
-    paginator = Paginator(all_cars, 8)
+    cursor_mode = 'after' in request.GET
+    if cursor_mode:
+        page = keyset_page(all_cars, request.GET.get('after'),
+                           ordering=car_ordering(sort))
+    else:
+        page_number = request.GET.get('page')
+        paginator = Paginator(all_cars, 8)
 
-    try:
-        page = paginator.page(page_number)
-    except PageNotAnInteger:
-        page = paginator.page(1)
-    except EmptyPage:
-        page = paginator.page(paginator.num_pages)
+        try:
+            page = paginator.page(page_number)
+        except PageNotAnInteger:
+            page = paginator.page(1)
+        except EmptyPage:
+            page = paginator.page(paginator.num_pages)
+
+    # Keep the active filters on the pagination links.
+    query = request.GET.copy()
+    query.pop('page', None)
+    query.pop('after', None)
+    filter_query = query.urlencode() + '&' if query else ''
 
     return render(request, 'cars_list.html', {
         'cars': page,
+        'cursor_mode': cursor_mode,
+        'filter_query': filter_query,
         'makes': makes,
         'models': models,
         'years': years,
@@ -168,232 +260,191 @@ def cars_list(request):
         'year': year,
         'location': location,
         'car_type': car_type,
-        'fuel_type': fuel_type
+        'fuel_type': fuel_type,
+        'sort': sort if sort in CAR_SORTS else 'price',
+        'start': start if date_range else '',
+        'end': end if date_range else '',
     })
 
 
-def get_car_makes(request):
+def cars_list_json(request):
     """
-    View to retrieve a list of unique car makes for filtering.
+    View to return the fleet listing as JSON using keyset pagination.
 
     Purpose:
-    This view is used to fetch a list of distinct car makes from
-    the database and convert them into JSON format. It is typically
-    accessed through an AJAX request and is used to populate the
-    available options for car makes in filter dropdowns.
+    This view is the JSON variant of 'cars_list'. It accepts the same
+    filter parameters and pages through the results with an opaque
+    'after' cursor ordered by daily rate and id (or by rating with
+    'sort=rating'), so no 'COUNT(*)' or 'OFFSET' query is issued
+    however deep the client pages.
 
     Args:
-    - 'request': The HTTP request object, typically sent via an
-    AJAX request.
+    - 'request': The HTTP request object with optional filter
+    parameters and an 'after' cursor in the query string.
 
     Returns:
-    A JSON response containing a list of car makes in the form of
-    key-value pairs.
+    A JSON response with 'cars', the cars of the requested page, and
+    'next', the cursor of the following page (or null on the last
+    page).
 
     Usage:
-    This view is called asynchronously when the user interacts with
-    filter dropdowns on the front end. It provides the available
-    options for car makes, which can be dynamically updated as
-    users select different filter criteria.
+    Request '/cars_list/json/' for the first page, then repeat the
+    request with 'after' set to the returned 'next' value.
     """
-    car_makes = Car.objects.values('make').distinct().order_by('make')
-    make_options = [{'value': make['make'], 'text': make['make']}
-                    for make in car_makes]
-    return JsonResponse(make_options, safe=False)
-
-
-def get_car_models(request):
-    """
-    View to retrieve a list of unique car models for a selected
-    car make.
-
-    Purpose:
-    This view is designed to fetch a list of distinct car models
-    associated with a specific car make from the database and
-    return them in JSON format. It is intended for use in response
-    to an AJAX request and serves to populate the available options
-    for car models in filter dropdowns based on the selected car make.
-
-    Args:
-    - 'request': The HTTP request object, typically sent via an
-    AJAX request.
+    all_cars = filtered_cars(request.GET)[0]
+    page = keyset_page(all_cars, request.GET.get('after'),
+                       ordering=car_ordering(request.GET.get('sort')))
+    return JsonResponse({
+        'cars': [{
+            'id': car.id,
+            'make': car.make,
+            'model': car.model,
+            'year': car.year,
+            'daily_rate': str(car.daily_rate),
+            'car_type': car.car_type,
+            'fuel_type': car.fuel_type,
+            'location_city': car.location_city,
+            'rating_average': str(car.rating_average),
+            'rating_count': car.rating_count,
+            'url': car.get_absolute_url(),
+        } for car in page],
+        'next': page.next_cursor,
+    })
 
-    Returns:
-    A JSON response containing a list of car models in the form
-    of key-value pairs.
 
-    Usage:
-    This view is utilized asynchronously in response to user interactions
-    with filter dropdowns on the front end. It provides dynamic updates
-    to the available car model options, ensuring that the options are
-    relevant to the selected car make.
-    """
-    selected_make = request.GET.get('make')
-    car_models = Car.objects.filter(make=selected_make).values(
-        'model').distinct().order_by('model')
-    model_options = [{'value': model['model'], 'text': model['model']}
-                     for model in car_models]
-    return JsonResponse(model_options, safe=False)
+# Car fields that may be requested from the fleet API.
+API_CAR_FIELDS = (
+    'id', 'make', 'model', 'year', 'daily_rate', 'is_available',
+    'car_type', 'fuel_type', 'location_city', 'location_address',
+    'latitude', 'longitude', 'features', 'rating_average', 'rating_count',
+)
+API_DEFAULT_FIELDS = (
+    'id', 'make', 'model', 'year', 'daily_rate', 'car_type',
+    'fuel_type', 'location_city',
+)
+API_CHUNK_SIZE = 500
 
 
-def get_car_years(request):
+def cars_api(request):
     """
-    View to retrieve a list of unique car years for a selected car model.
+    View to stream the fleet as newline-delimited JSON (ndjson).
 
     Purpose:
-    This view is designed to retrieve a list of distinct car years
-    associated with a specific car model from the database and return
-    them in JSON format. It is intended for use in response to an AJAX
-    request and serves to populate the available options for car years
-    in filter dropdowns based on the selected car model.
+    This read-only endpoint is meant for partners and mobile clients.
+    It applies the same filters as 'cars_list' and streams one JSON
+    object per line. Rows are read with a server-side cursor in chunks
+    of 'API_CHUNK_SIZE' and encoded as they are sent, so a full-fleet
+    export never holds the whole result in memory.
 
     Args:
-    - 'request': The HTTP request object, typically sent via an AJAX
-    request.
+    - 'request': The HTTP request object with optional 'cars_list'
+    filter parameters and a comma separated 'fields' list chosen from
+    'API_CAR_FIELDS'.
 
     Returns:
-    A JSON response containing a list of car years in the form of
-    key-value pairs.
+    A streaming 'application/x-ndjson' response, or a JSON error with
+    status 400 when an unknown field is requested.
 
     Usage:
-    This view is employed asynchronously in response to user interactions
-    with filter dropdowns on the front end. It provides dynamic updates
-    to the available car year options, ensuring that the options are
-    relevant to the selected car model.
+    '/api/cars/?make=Toyota&fields=make,model,daily_rate' streams the
+    make, model and daily rate of every Toyota. Only the requested
+    columns are selected from the database.
     """
-    selected_model = request.GET.get('model')
-    car_years = Car.objects.filter(model=selected_model).values(
-        'year').distinct().order_by('year')
-    year_options = [{'value': year['year'], 'text': year['year']}
-                    for year in car_years]
-    return JsonResponse(year_options, safe=False)
-
-
-def get_car_types(request):
+    fields = [field.strip() for field in
+              request.GET.get('fields', '').split(',') if field.strip()]
+    fields = fields or list(API_DEFAULT_FIELDS)
+    unknown = [field for field in fields if field not in API_CAR_FIELDS]
+    if unknown:
+        return JsonResponse(
+            {'error': f"Unknown fields: {', '.join(unknown)}"}, status=400)
+
+    all_cars = filtered_cars(request.GET)[0]
+    rows = all_cars.values(*fields).iterator(chunk_size=API_CHUNK_SIZE)
+    lines = (json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows)
+    return StreamingHttpResponse(
+        lines, content_type='application/x-ndjson')
+
+
+def car_quote(request):
     """
-    View to retrieve a list of unique car types through AJAX.
+    View to preview the price and availability of a rental.
 
     Purpose:
-    This view fetches a list of distinct car types from the database
-    for a selected year and returns them in JSON format. It serves
-    as an AJAX response to populate the available options for car
-    types in filter dropdowns, allowing users to filter cars based
-    on their type.
+    Lets customers see what a rental costs before committing to it.
+    Nothing is written: no 'Booking' or 'Payment' is created until the
+    booking form is submitted. Rates come from the cached rate table
+    and availability from one indexed query (see 'autoR5.quotes').
 
     Args:
-    - 'request': The HTTP request object sent via an AJAX request.
+    - 'request': The HTTP request object with 'car', 'start' and 'end'
+    ('YYYY-MM-DD') in the query string.
 
     Returns:
-    A JSON response containing a list of car types for the selected year.
+    A JSON response with the 'car', 'start', 'end', charged 'days',
+    'daily_rate', 'total', 'currency' and 'available', a JSON error
+    with status 400 for a missing car or an invalid date range, or
+    status 404 for an unknown car.
 
     Usage:
-    This view is used to update the car type options dynamically based on
-    the year selected by the user in filter dropdowns on the front end. It
-    ensures that users can filter cars by type effectively.
+    '/api/quote/?car=3&start=2024-06-01&end=2024-06-04' prices a three
+    day rental of car 3. The booking page calls it whenever the dates
+    change.
     """
-    selected_year = request.GET.get('year')
-    car_types = Car.objects.filter(
-        year=selected_year).values('car_type').distinct()
-    car_type_options = [{'value': car_type['car_type'],
-                         'text': get_display_value(
-                             Car.CAR_TYPES, car_type[
-                                 'car_type'])}for car_type in car_types]
-    return JsonResponse(car_type_options, safe=False)
-
-
-def get_fuel_types(request):
+    try:
+        car_id = int(request.GET.get('car', ''))
+    except ValueError:
+        return JsonResponse({'error': 'A car id is required.'}, status=400)
+    window = parse_date_range(request.GET.get('start'),
+                              request.GET.get('end'))
+    if window is None:
+        return JsonResponse(
+            {'error': 'Invalid date range.'}, status=400)
+
+    result = quote(car_id, *window)
+    if result is None:
+        return JsonResponse({'error': 'Car not found.'}, status=404)
+    return JsonResponse(result)
+
+
+def car_facets(request):
     """
-    View to retrieve a list of unique fuel types through AJAX.
+    View to retrieve every filter option with cross-filtered counts.
 
     Purpose:
-    This view retrieves a list of distinct fuel types from the
-    database for a selected car type and returns them in JSON format.
-    It serves as an AJAX response to populate the available options for
-    fuel types in filter dropdowns, enabling users to filter cars based
-    on their fuel type.
+    This view replaces the chain of 'get_car_*' AJAX calls with a single
+    request. It takes the current partial selection of the filter
+    sidebar and returns the options and car counts for all six filters
+    at once, computed from one grouped aggregate over 'Car'.
 
     Args:
-    - 'request': The HTTP request object sent via an AJAX request.
+    - 'request': The HTTP request object, typically sent via an AJAX
+    request, with any of 'make', 'model', 'year', 'car_type',
+    'fuel_type' and 'location' in the query string.
 
     Returns:
-    A JSON response containing a list of fuel types for the selected car type.
+    A JSON response with 'total', the number of cars matching the
+    selection, and 'facets', mapping each filter to a list of
+    '{"value", "text", "count"}' options.
 
     Usage:
-    This view is used to update the fuel type options dynamically based on
-    the car type selected by the user in filter dropdowns on the front end.
-    It ensures that users can filter cars by fuel type effectively.
+    The filter sidebar calls this view when the page loads and whenever
+    one of the dropdowns changes, then refreshes every dropdown from
+    the single response.
     """
-    selected_car_type = request.GET.get('car_type')
-    fuel_types = Car.objects.filter(
-        car_type=selected_car_type).values('fuel_type').distinct()
-    fuel_type_options = [{'value': fuel_type['fuel_type'],
-                          'text': get_display_value(
-                              Car.FUEL_TYPES, fuel_type[
-                                  'fuel_type'])} for fuel_type in fuel_types]
-    return JsonResponse(fuel_type_options, safe=False)
+    return JsonResponse(facet_counts(request.GET))
 
 
-def get_display_value(choices, choice_key):
-    """
-    Utility function to retrieve the display value for a given choice key.
+# Number of reviews rendered with the car detail page and returned per
+# request by the 'car_reviews' endpoint.
+REVIEWS_PER_PAGE = 6
 
-    Purpose:
-    This function is used to obtain the display value associated with a
-    specific choice key from a list of choices. It is commonly used for
-    converting choice keys into human-readable labels.
 
-    Args:
-    - 'choices': A list of choices, typically a tuple of
-    (choice_key,display_value) pairs.
-
-    - 'choice_key': The key for which the corresponding
-    display value is required.
-
-    Returns:
-    The display value associated with the provided choice_key, or the
-    choice_key itself if a matching choice is not found.
-
-    Usage:
-    This utility function is employed to translate choice keys into their
-    respective display values, enhancing the readability of data in
-    various parts of the application.
+def approved_reviews(car_id):
     """
-    for choice in choices:
-        if choice[0] == choice_key:
-            return choice[1]
-    return choice_key
-
-
-def get_car_locations(request):
+    Return the approved reviews of a car with their authors joined in.
     """
-    View to retrieve a list of unique car locations through AJAX.
-
-    Purpose:
-    This view is designed to fetch a list of distinct car locations
-    (cities) from the database and return them in JSON format. It
-    serves as an AJAX response to populate the available options for
-    car locations in filter dropdowns, enabling users to filter cars
-    based on their location.
-
-    Args:
-    - 'request': The HTTP request object sent via an AJAX request.
-
-    Returns:
-    A JSON response containing a list of car locations (cities) in
-    the form of key-value pairs.
-
-    Usage:
-    This view is utilized in response to user interactions with filter
-    dropdowns on the front end, ensuring that the options are
-    dynamically updated based on the available car locations in the
-    database.
-    """
-    car_locations = Car.objects.values(
-        'location_city').distinct().order_by('location_city')
-    location_options = [{'value': location['location_city'],
-                         'text': location[
-                             'location_city']} for location in car_locations]
-    return JsonResponse(location_options, safe=False)
+    return Review.objects.filter(
+        car_id=car_id, approved=True).select_related('user')
 
 
 def car_detail(request, car_id):
@@ -405,13 +456,19 @@ def car_detail(request, car_id):
     car, including its specifications and reviews. It is used to present a
     dedicated page for a single car's details.
 
+    Only the newest 'REVIEWS_PER_PAGE' reviews are rendered, with their
+    authors fetched in the same query. Older reviews are loaded on
+    scroll from the 'car_reviews' endpoint, so the page weight and the
+    number of queries do not grow with the number of reviews.
+
     Args:
     - 'request': The HTTP request object sent by the client.
     - 'car_id': The unique identifier (primary key) of the car to be displayed.
 
     Returns:
     Renders the 'car_detail.html' template, providing the 'car' and 'reviews'
-    context variables.
+    context variables. 'reviews' is a 'KeysetPage' whose 'next_cursor'
+    fetches the following reviews.
 
     Usage:
     This view is accessed when a user clicks on a car from the list of
@@ -420,10 +477,47 @@ def car_detail(request, car_id):
     details and associated reviews.
     """
     car = get_object_or_404(Car, pk=car_id)
-    reviews = Review.objects.filter(car=car, approved=True)
+    reviews = keyset_page(approved_reviews(car.id),
+                          per_page=REVIEWS_PER_PAGE,
+                          ordering=REVIEW_ORDERING)
     return render(request, 'car_detail.html', {'car': car, 'reviews': reviews})
 
 
+def car_reviews(request, car_id):
+    """
+    View to return a page of a car's approved reviews as JSON.
+
+    Purpose:
+    This view serves the reviews following the ones rendered by
+    'car_detail', newest first, using keyset pagination on the review
+    id. Each request costs one query however many reviews the car has.
+
+    Args:
+    - 'request': The HTTP request object with an 'after' cursor in the
+    query string.
+    - 'car_id': The unique identifier (primary key) of the car.
+
+    Returns:
+    A JSON response with 'reviews', each holding the author's username,
+    the rating and the comment, and 'next', the cursor of the following
+    page (or null on the last page).
+
+    Usage:
+    The car detail page requests '/car/<car_id>/reviews/?after=<cursor>'
+    when the end of the review list scrolls into view.
+    """
+    page = keyset_page(approved_reviews(car_id), request.GET.get('after'),
+                       per_page=REVIEWS_PER_PAGE, ordering=REVIEW_ORDERING)
+    return JsonResponse({
+        'reviews': [{
+            'user': review.user.username,
+            'rating': review.rating,
+            'comment': review.comment,
+        } for review in page],
+        'next': page.next_cursor,
+    })
+
+
 @login_required
 def book_car(request, car_id):
     """
@@ -441,7 +535,9 @@ def book_car(request, car_id):
 
     Returns:
     Renders the 'book_car.html' template, providing the 'car', 'form',
-    'total_cost', and 'bookedDates' context variables.
+    'total_cost', 'booked_ranges' and 'booked_ranges_data' context
+    variables. The booked ranges are merged, non-overlapping
+    '[first_day, last_day]' pairs from today onwards.
 
     Usage:
     1. A user accesses this view to book a car.
@@ -449,7 +545,9 @@ def book_car(request, car_id):
     2. The view checks the availability of the car, validates the booking
     form, and calculates the total cost.
 
-    3. It also checks for any conflicting bookings or past booking dates.
+    3. It also checks for past booking dates, then reserves the car with
+    'reserve_booking', which locks the car so that concurrent submissions
+    for overlapping dates cannot both succeed.
 
     4. If the booking is successful, it proceeds to the checkout process
     for payment.
@@ -460,19 +558,7 @@ def book_car(request, car_id):
     car = get_object_or_404(Car, pk=car_id)
     total_cost = None
 
-    confirmed_bookings = Booking.objects.filter(car=car, status='Confirmed')
-
-    bookedDates = {}
-    for booking in confirmed_bookings:
-        current_date = booking.rental_date
-        end_date = booking.return_date
-        date_range = []
-        while current_date <= end_date:
-            date_str = current_date.strftime('%d-%m-%Y')
-            date_range.append(date_str)
-            current_date += timedelta(days=1)
-        date_range_str = ' to '.join(date_range)
-        bookedDates[booking.id] = date_range_str
+    booked = booked_ranges(car)
 
     if request.method == 'POST':
         form = BookingForm(request.POST)
@@ -480,74 +566,75 @@ def book_car(request, car_id):
             booking = form.save(commit=False)
             booking.user = request.user
             booking.car = car
-            booking.location = car.location_city
 
             if not car.is_available:
                 messages.error(
                     request, 'This car is not available for booking.')
                 return redirect('car_detail', car_id=car_id)
 
-            if request.method == 'POST':
-                form = BookingForm(request.POST)
-                if form.is_valid():
-                    booking = form.save(commit=False)
-                    booking.user = request.user
-                    booking.car = car
-                    booking.location = car.location_city
-
-                    today = date.today()
-                    rental_date = booking.rental_date.date()
-
-                    if rental_date < today:
-                        messages.error(
-                            request, 'You cannot book for a past date.')
-                        return redirect('book_car', car_id=car_id)
-
-                    conflicting_bookings = Booking.objects.filter(
-                        Q(car=car) &
-                        (
-                            Q(rental_date__range=(booking.rental_date,
-                                                  booking.return_date)) |
-                            Q(return_date__range=(
-                                booking.rental_date, booking.return_date))
-                        )
-                    )
-
-                    future_conflicting_bookings = conflicting_bookings.filter(
-                        return_date__gt=timezone.now())
-
-                    if future_conflicting_bookings.exists():
-                        if future_conflicting_bookings.filter(
-                                return_date__lt=booking.rental_date).exists():
-                            pass
-                        else:
-                            messages.error(
-                                request,
-                                'This car is already booked for'
-                                ' the selected dates.')
-                            return redirect('book_car', car_id=car_id)
-
-            booking.calculate_total_cost()
-            booking.status = 'Pending'
-            booking.save()
-            total_cost = booking.total_cost
-
-            payment = Payment(
-                user=request.user,
-                booking=booking,
-                amount=booking.total_cost,
-                payment_method='Stripe',
-                payment_status='Pending',
-            )
-            payment.save()
+            if booking.rental_date.date() < date.today():
+                messages.error(
+                    request, 'You cannot book for a past date.')
+                return redirect('book_car', car_id=car_id)
+
+            try:
+                reserve_booking(booking)
+            except BookingConflict:
+                messages.error(
+                    request,
+                    'This car is already booked for'
+                    ' the selected dates.')
+                return redirect('book_car', car_id=car_id)
+
             return redirect('checkout', car_id=car_id, booking_id=booking.id)
     else:
         form = BookingForm()
 
-    return render(request, 'book_car.html', {'car': car,
-                                             'form': form,
-                                             'total_cost': total_cost,
-                                             'bookedDates': bookedDates})
+    return render(request, 'book_car.html', {
+        'car': car,
+        'form': form,
+        'total_cost': total_cost,
+        'booked_ranges': booked,
+        'booked_ranges_data': serialize_ranges(booked),
+    })
+
+
+def serialize_ranges(ranges):
+    """
+    Utility function converting booked date ranges into JSON-ready data.
+
+    Args:
+    - 'ranges': A list of '(first_day, last_day)' date tuples as
+    returned by 'booked_ranges'.
+
+    Returns:
+    A list of dictionaries with ISO formatted 'start' and 'end' keys.
+    """
+    return [{'start': first_day.isoformat(), 'end': last_day.isoformat()}
+            for first_day, last_day in ranges]
+
+
+def booked_dates(request, car_id):
+    """
+    View to retrieve the booked date ranges of a car in JSON format.
+
+    Purpose:
+    This view returns the days from today onwards on which the car is
+    held by a Pending or Confirmed booking, merged into non-overlapping
+    inclusive ranges. The booking date picker uses it to disable those
+    days without the server expanding bookings day by day.
+
+    Args:
+    - 'request': The HTTP request object, typically sent via an
+    AJAX request.
+    - 'car_id': The unique identifier (primary key) of the car.
+
+    Returns:
+    A JSON response of the form
+    '{"ranges": [{"start": "YYYY-MM-DD", "end": "YYYY-MM-DD"}]}'.
+    """
+    car = get_object_or_404(Car, pk=car_id)
+    return JsonResponse({'ranges': serialize_ranges(booked_ranges(car))})
 
 
 @login_required
@@ -558,8 +645,9 @@ def checkout(request, car_id, booking_id):
     Purpose:
     This view handles the payment processing and checkout for a specific
     booking. It uses the Stripe API to create a PaymentIntent, which allows
-    users to make payments. If the payment is successful, the view displays
-    the checkout page with payment details.
+    users to make payments. The intent is created once per booking and
+    reused on every later visit until the booking's total changes, so
+    reloading the page makes no Stripe calls.
 
     Args:
     - 'request': The HTTP request object sent by the client.
@@ -577,40 +665,55 @@ def checkout(request, car_id, booking_id):
     Usage:
     1. A user initiates the checkout process after booking a car.
 
-    2. The view uses the Stripe API to create a PaymentIntent, allowing the
-    user to make a payment.
+    2. The view reuses the booking's PaymentIntent, or creates one with an
+    idempotency key through 'payment_intent_for', allowing the user to make
+    a payment.
 
-    3. If the payment is successful, the checkout page is displayed with
-    relevant payment details.
+    3. Bookings that are already paid are sent to their confirmation page,
+    and canceled ones (for example abandoned bookings canceled by the
+    'reap_pending_bookings' command) back to the booking form. Otherwise
+    the booking's hold on the car is renewed with 'renew_hold', or the
+    customer is sent back to the form when the dates were taken after the
+    hold lapsed.
 
     4. In case of a Stripe error or payment processing issue, an error message
-    is shown, and the user is redirected back to the checkout page.
+    is shown, and the user is redirected to the car's page instead of back
+    to the checkout page, which would retry in a loop.
 
     Note:
     Only authenticated users can make payments for cars.
     """
     booking = get_object_or_404(Booking, pk=booking_id)
-    stripe.api_key = settings.STRIPE_SECRET_KEY
     stripe_publishable_key = settings.STRIPE_PUBLISHABLE_KEY
-
+    payment = booking_payment(booking)
+
+    if payment.payment_status == 'Paid':
+        messages.info(request, "This booking has already been paid")
+        return redirect('booking_confirmation', booking_id=booking.id)
+    if booking.status == 'Canceled':
+        messages.error(
+            request, "This booking has expired. Please book again")
+        return redirect('book_car', car_id=car_id)
     try:
-        intent = stripe.PaymentIntent.create(
-            amount=int(booking.total_cost * 100),
-            currency='eur',
-            metadata={'booking_id': booking.id},
-        )
-
-        return render(request, 'checkout.html', {
-            'intent_client_secret': intent.client_secret,
-            'stripe_publishable_key': stripe_publishable_key,
-            'booking_id': booking_id,
-            'total_cost': booking.total_cost
-        })
+        renew_hold(booking)
+    except BookingConflict:
+        messages.error(
+            request, "These dates are no longer available. Please book again")
+        return redirect('book_car', car_id=car_id)
 
+    try:
+        intent_client_secret = payment_intent_for(booking, payment)
     except stripe.error.StripeError as e:
         print("Stripe Error:", str(e))
         messages.error(request, "Payment processing error. Please try again")
-        return redirect('checkout', car_id=car_id, booking_id=booking.id)
+        return redirect('car_detail', car_id=car_id)
+
+    return render(request, 'checkout.html', {
+        'intent_client_secret': intent_client_secret,
+        'stripe_publishable_key': stripe_publishable_key,
+        'booking_id': booking_id,
+        'total_cost': booking.total_cost
+    })
 
 
 @login_required
@@ -620,8 +723,10 @@ def booking_confirmation(request, booking_id):
 
     Purpose:
     This view handles the confirmation of a booking and displays
-    relevant booking details to the user. It also processes the payment
-    status based on the Stripe payment intent.
+    relevant booking details to the user. The payment status is read
+    from the database; it is kept up to date by the Stripe webhook
+    ('stripe_webhook'), so the page makes no Stripe calls and never
+    changes the payment itself.
 
     Args:
     - 'request': The HTTP request object sent by the client.
@@ -636,62 +741,37 @@ def booking_confirmation(request, booking_id):
     'payment_status'.
 
     Usage:
-    1. A user proceeds to confirm their booking.
+    1. A user proceeds to confirm their booking, usually redirected back
+    from Stripe with the intent in the query string.
 
     2. The view retrieves booking and payment information.
 
-    3. If a valid payment intent is provided, the payment status is updated
-    based on the intent status ('succeeded', 'processing', or
-    'requires_payment_method').
-
-    4. Appropriate messages are displayed to the user regarding the payment
-    status.
+    3. When the user has just returned from Stripe, a message reflecting
+    the stored payment status is displayed. A payment whose webhook event
+    has not arrived yet is shown as processing.
 
-    5. Booking details, location information, and payment status are presented
+    4. Booking details, location information, and payment status are presented
     on the booking confirmation page.
 
     Note:
     Only authenticated users view bookings for cars.
     """
-    booking = get_object_or_404(Booking, pk=booking_id)
+    booking = get_object_or_404(
+        Booking.objects.select_related('car'), pk=booking_id)
 
     payment_intent_id = request.GET.get("payment_intent")
     intent_client_secret = request.GET.get("payment_intent_client_secret")
 
     payment = Payment.objects.get(booking=booking)
-    car = booking.car
 
     if intent_client_secret:
-        try:
-            intent = stripe.PaymentIntent.retrieve(payment_intent_id)
-        except stripe.error.StripeError as e:
-            messages.error(
-                request, "Payment processing error. Please try again")
-            return redirect('checkout',
-                            car_id=booking.car.id,
-                            booking_id=booking_id)
-
-        payment_intent_status = intent.status
-
-        if payment_intent_status == 'succeeded':
-            payment.payment_status = 'Paid'
-            booking.status = 'Confirmed'
-            payment.payment_intent = payment_intent_id
+        if payment.payment_status == 'Paid':
             messages.success(request, "Payment successful")
-        elif payment_intent_status == 'processing':
-            payment.payment_status = 'Pending'
-            booking.status = 'Pending'
-            payment.payment_intent = payment_intent_id
+        elif payment.payment_status == 'Pending':
             messages.info(request, "Processing Payment")
         else:
-            payment_intent_status == 'requires_payment_method'
-            payment.payment_status = 'Failed'
-            booking.status = 'Canceled'
             messages.error(request, "Payment failed")
 
-        payment.save()
-        booking.save()
-
     car = booking.car
     location_address = car.location_address
     location_lat = car.latitude
@@ -708,6 +788,38 @@ def booking_confirmation(request, booking_id):
     })
 
 
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """
+    Endpoint receiving Stripe webhook events.
+
+    Purpose:
+    Verifies the 'Stripe-Signature' header against
+    'STRIPE_WEBHOOK_SECRET' and hands 'payment_intent.*' events to
+    'handle_stripe_event', which updates the payment and booking. Each
+    delivery is a short transaction on one locked row, so bursts of
+    events are absorbed without holding Stripe's connection.
+
+    Args:
+    - 'request': The HTTP request sent by Stripe.
+
+    Returns:
+    A JSON response with 'received' and whether the event was
+    'applied', or a 400 response when the payload or its signature is
+    invalid. Duplicates are acknowledged so Stripe stops retrying them.
+    """
+    try:
+        event = stripe.Webhook.construct_event(
+            request.body, request.headers.get('Stripe-Signature', ''),
+            settings.STRIPE_WEBHOOK_SECRET)
+    except (ValueError, stripe.error.SignatureVerificationError):
+        return HttpResponse(status=400)
+
+    applied = handle_stripe_event(event)
+    return JsonResponse({'received': True, 'applied': applied})
+
+
 @login_required
 def leave_review(request, car_id):
     """
@@ -788,8 +900,15 @@ def dashboard(request):
     Returns:
     Renders the 'dashboard.html' template, providing context
     variables including 'user', 'current_bookings', 'past_bookings',
-    'reviews', 'form', and 'unapproved_requests'. The template displays
-    relevant user data and booking-related information.
+    'reviews' and 'form'. The template displays relevant user data and
+    booking-related information.
+
+    Current and past bookings come from one query that joins the car
+    and is annotated with 'has_pending_request' and
+    'pending_request_id' for the first unapproved cancellation request.
+    Both lists and the reviews are evaluated in the view, so the
+    template counts them without further queries and the number of
+    queries does not grow with the number of bookings.
 
     Usage:
     1. An authenticated user (customer) accesses their customer dashboard.
@@ -797,8 +916,8 @@ def dashboard(request):
     2. The view retrieves and organizes data related to the user's bookings,
     reviews, and cancellation requests.
 
-    3. It checks for current and past bookings and filters unapproved
-    cancellation requests associated with current bookings.
+    3. It splits the bookings into current and past ones and flags those
+    with an unapproved cancellation request.
 
     4. If the request method is POST and a valid cancellation request is
     submitted, it processes the request and displays a success message.
@@ -812,26 +931,27 @@ def dashboard(request):
     - Users can submit cancellation requests for their bookings.
     """
     user = request.user
-    current_bookings = Booking.objects.filter(
-        Q(status='Pending') | Q(status='Confirmed'),
+    now = timezone.now()
+    pending_requests = CancellationRequest.objects.filter(
+        booking=OuterRef('pk'), approved=False).order_by('id')
+    bookings = Booking.objects.filter(
+        Q(status__in=['Pending', 'Confirmed'], return_date__gte=now)
+        | Q(status='Completed', return_date__lt=now),
         user=user,
-        return_date__gte=timezone.now()
-    )
-    past_bookings = Booking.objects.filter(
-        Q(status='Completed'),
-        user=user,
-        return_date__lt=timezone.now()
-    )
-    reviews = Review.objects.filter(user=user)
+    ).select_related('car').annotate(
+        has_pending_request=Exists(pending_requests),
+        pending_request_id=Subquery(pending_requests.values('id')[:1]),
+    ).order_by('id')
+
+    current_bookings = []
+    past_bookings = []
+    for booking in bookings:
+        if booking.status == 'Completed':
+            past_bookings.append(booking)
+        else:
+            current_bookings.append(booking)
+    reviews = list(Review.objects.filter(user=user).select_related('car'))
     form = CancellationRequestForm(request.POST or None)
-    unapproved_requests = {}
-
-    for booking in current_bookings:
-        unapproved_request = CancellationRequest.objects.filter(
-            booking=booking, approved=False
-        ).first()
-        if unapproved_request:
-            unapproved_requests[booking.id] = unapproved_request
 
     if request.method == 'POST' and form.is_valid():
         booking_id = request.POST.get('booking_id')
@@ -852,7 +972,6 @@ def dashboard(request):
         'past_bookings': past_bookings,
         'reviews': reviews,
         'form': form,
-        'unapproved_requests': unapproved_requests,
     })
 
 
@@ -1123,3 +1242,36 @@ def approve_reject_cancellation_request(request, request_id, action):
         messages.error(request, 'Cancellation request not found.')
 
     return redirect('dashboard')
+
+
+@user_passes_test(lambda u: u.is_staff)
+@require_POST
+def bulk_approve_cancellation_requests(request):
+    """
+    Approve many cancellation requests in one request.
+
+    This view function is intended for staff members handling a mass
+    cancellation event. It approves every cancellation request listed
+    in the repeated 'ids' POST parameter in one database transaction
+    and queues the refunds of paid bookings as one batch for the
+    'process_refunds' worker, so no Stripe call is made here.
+
+    Args:
+    - request: The HTTP request object sent by the client.
+
+    Returns:
+    A JSON response with 'results', mapping every requested id to its
+    outcome ('refund_queued', 'canceled', 'already_approved',
+    'missing_payment' or 'not_found'), or a JSON error with status 400
+    when an id is not a number.
+    """
+    try:
+        request_ids = [int(request_id)
+                       for request_id in request.POST.getlist('ids')]
+    except ValueError:
+        return JsonResponse({'error': 'Invalid request id.'}, status=400)
+
+    results = approve_cancellation_requests(request_ids)
+    return JsonResponse({'results': {
+        str(request_id): outcome for request_id, outcome in results.items()
+    }})
@@ -222,3 +222,23 @@ PASSWORD_RESET_TIMEOUT_DAYS = 1
 # Stripe settings
 STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY')
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
+# Signing secret of the webhook endpoint ('whsec_...') delivering the
+# payment_intent.* events to /stripe/webhook/.
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
+
+# Cache settings
+# The fleet filter options are cached (see autoR5/facets.py) under a
+# version key that every change of the fleet bumps. Point REDIS_URL at
+# a Redis instance so every gunicorn worker and dyno shares it; without
+# it each process keeps its own local memory cache, which never sees
+# the other processes' bumps, so FACET_CACHE_TIMEOUT is kept short.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+    FACET_CACHE_TIMEOUT = 60 * 60
+else:
+    FACET_CACHE_TIMEOUT = 60
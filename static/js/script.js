@@ -53,8 +53,18 @@ document.addEventListener("DOMContentLoaded", function () {
 
 // Filtering options using jQuery
 $(document).ready(function () {
-  // Function to update dropdown options
-  function updateDropdown(dropdown, data, placeholder) {
+  // Filter dropdowns and the query parameter each one submits
+  const facetDropdowns = {
+    make: { element: $("#car_make"), placeholder: "Select Manufacturer" },
+    model: { element: $("#car_model"), placeholder: "Select Model" },
+    year: { element: $("#car_year"), placeholder: "Select Year" },
+    car_type: { element: $("#car_type"), placeholder: "Select Car Type" },
+    fuel_type: { element: $("#fuel_type"), placeholder: "Select Fuel Type" },
+    location: { element: $("#car_location"), placeholder: "Select Location" },
+  };
+
+  // Function to update dropdown options, keeping the current selection
+  function updateDropdown(dropdown, data, placeholder, selected) {
     dropdown.empty();
     dropdown.append(
       $("<option>", {
@@ -66,101 +76,124 @@ $(document).ready(function () {
       dropdown.append(
         $("<option>", {
           value: item.value,
-          text: item.text,
+          text: item.text + " (" + item.count + ")",
+          selected: String(item.value) === selected,
         })
       );
     });
   }
 
-  // AJAX request to populate car makes when page loads
-  $.ajax({
-    url: "/get_car_makes/",
-    success: function (data) {
-      updateDropdown($("#car_make"), data, "Select Manufacturer");
-    },
-  });
+  // Current selection, taken from the dropdowns or, on page load,
+  // from the filters already applied in the query string
+  function currentSelection(initial) {
+    let params = new URLSearchParams(window.location.search);
+    let selection = {};
+    $.each(facetDropdowns, function (name, dropdown) {
+      let value = initial ? params.get(name) : dropdown.element.val();
+      if (value) {
+        selection[name] = value;
+      }
+    });
+    return selection;
+  }
 
-  // Event handlers for filtering car models, years, types, and fuel types
-  // These make additional AJAX requests to populate dropdowns
-  $("#car_make").change(function () {
-    let selectedMake = $(this).val();
-    if (selectedMake) {
-      $.ajax({
-        url: "/get_car_models/",
-        data: {
-          make: selectedMake,
-        },
-        success: function (data) {
-          updateDropdown($("#car_model"), data, "Select Model");
-        },
-      });
-    }
-  });
+  // A single AJAX request refreshes every dropdown with
+  // cross-filtered counts for the current selection
+  function refreshFacets(initial) {
+    let selection = currentSelection(initial);
+    $.ajax({
+      url: "/api/facets/",
+      data: selection,
+      success: function (data) {
+        $.each(facetDropdowns, function (name, dropdown) {
+          updateDropdown(
+            dropdown.element,
+            data.facets[name],
+            dropdown.placeholder,
+            selection[name] || ""
+          );
+        });
+      },
+    });
+  }
 
-  // Event handler for car model selection
-  $("#car_model").change(function () {
-    let selectedModel = $(this).val();
-    if (selectedModel) {
-      $.ajax({
-        url: "/get_car_years/",
-        data: {
-          model: selectedModel,
-        },
-        success: function (data) {
-          updateDropdown($("#car_year"), data, "Select Year");
-        },
-      });
-    }
-  });
+  if ($("#filter-form").length) {
+    refreshFacets(true);
 
-  // Event handler for car year selection
-  $("#car_year").change(function () {
-    let selectedYear = $(this).val();
-    if (selectedYear) {
-      $.ajax({
-        url: "/get_car_types/",
-        data: {
-          year: selectedYear,
-        },
-        success: function (data) {
-          updateDropdown($("#car_type"), data, "Select Car Type");
-        },
+    $.each(facetDropdowns, function (name, dropdown) {
+      dropdown.element.change(function () {
+        refreshFacets(false);
       });
+    });
+  }
+});
+
+// Disable already booked days in the booking date pickers.
+// The server sends merged [start, end] ranges; the days are only
+// expanded here, before the date picker widgets are initialised.
+let bookedRangesElement = document.getElementById("booked-ranges");
+
+if (bookedRangesElement) {
+  let disabledDates = [];
+  JSON.parse(bookedRangesElement.textContent).forEach(function (range) {
+    let [startYear, startMonth, startDay] = range.start.split("-");
+    let [endYear, endMonth, endDay] = range.end.split("-");
+    let current = new Date(startYear, startMonth - 1, startDay);
+    let last = new Date(endYear, endMonth - 1, endDay);
+    while (current <= last) {
+      disabledDates.push(new Date(current));
+      current.setDate(current.getDate() + 1);
     }
   });
+  if (disabledDates.length > 0) {
+    window.dbdpOptions = Object.assign({}, window.dbdpOptions, {
+      disabledDates: disabledDates,
+    });
+  }
+}
 
-  // Event handler for car type selection
-  $("#car_type").change(function () {
-    let selectedCarType = $(this).val();
-    if (selectedCarType) {
-      $.ajax({
-        url: "/get_fuel_types/",
-        data: {
-          car_type: selectedCarType,
-        },
-        success: function (data) {
-          updateDropdown($("#fuel_type"), data, "Select Fuel Type");
-        },
-      });
+// Preview the price of the selected dates on the booking page.
+// The quote endpoint writes nothing; the booking is only created when
+// the form is submitted.
+let quotePreview = document.getElementById("quote-preview");
+
+if (quotePreview) {
+  let quoteDates = {};
+
+  let previewQuote = function () {
+    if (!quoteDates.rental_date || !quoteDates.return_date) {
+      return;
     }
-  });
+    $.getJSON(quotePreview.dataset.url, {
+      car: quotePreview.dataset.car,
+      start: quoteDates.rental_date,
+      end: quoteDates.return_date,
+    })
+      .done(function (quote) {
+        quotePreview.textContent =
+          "Total for " + quote.days + " day(s): \u20ac" + quote.total +
+          (quote.available ? "" : " (not available for these dates)");
+      })
+      .fail(function () {
+        quotePreview.textContent = "";
+      });
+  };
 
-  // Event handler for fuel type selection
-  $("#fuel_type").change(function () {
-    let selectedFuelType = $(this).val();
-    if (selectedFuelType) {
-      $.ajax({
-        url: "/get_car_locations/",
-        data: {
-          fuel_type: selectedFuelType,
-        },
-        success: function (data) {
-          updateDropdown($("#car_location"), data, "Select Location");
+  // The date picker widget moves the field names to hidden inputs that
+  // it fills from script, which fires no 'change' event. Its 'dp.change'
+  // events are subscribed to through 'window.dbdpEvents_<field>', read
+  // when the widgets are initialised.
+  ["rental_date", "return_date"].forEach(function (name) {
+    quoteDates[name] = $("input[name='" + name + "']").val();
+    window["dbdpEvents_" + name] = Object.assign(
+      {}, window["dbdpEvents_" + name], {
+        "dp.change": function (event) {
+          quoteDates[name] = event.date ? event.date.format("YYYY-MM-DD") : "";
+          previewQuote();
         },
       });
-    }
   });
-});
+}
 
 // Display car location on a map
 let carLocationElement = document.getElementById("car-location");
@@ -187,6 +220,60 @@ if (carLocationElement) {
     .bindPopup("Location: " + locationName);
 }
 
+// Load older reviews on the car detail page when the end of the
+// list scrolls into view, one page per request
+let reviewSentinel = document.getElementById("review-sentinel");
+
+if (reviewSentinel && "IntersectionObserver" in window) {
+  let loadingReviews = false;
+
+  function reviewCard(review) {
+    let card = $("<div>", { class: "col-12 col-lg-4 col-md-6 card" });
+    let wrap = $("<div>", { class: "card-wrap" }).appendTo(card);
+    let rating = $("<p>", { class: "date display-4", text: "Rating: " });
+    for (let i = 1; i <= 5; i++) {
+      rating.append(
+        $("<i>", { class: (i <= review.rating ? "fas" : "far") + " fa-star" })
+      );
+    }
+    wrap.append(rating);
+    wrap.append(
+      $("<p>", { class: "text display-5", text: '"' + review.comment + '"' })
+    );
+    wrap.append($("<p>", { class: "text display-7", text: review.user }));
+    return card;
+  }
+
+  let reviewObserver = new IntersectionObserver(function (entries) {
+    if (!entries[0].isIntersecting || loadingReviews) {
+      return;
+    }
+    loadingReviews = true;
+    $.ajax({
+      url: reviewSentinel.dataset.url,
+      data: { after: reviewSentinel.dataset.next },
+      success: function (data) {
+        $.each(data.reviews, function (index, review) {
+          $(reviewSentinel).before(reviewCard(review));
+        });
+        if (data.next) {
+          reviewSentinel.dataset.next = data.next;
+          // Observe again so a sentinel still in view loads the next page
+          reviewObserver.unobserve(reviewSentinel);
+          reviewObserver.observe(reviewSentinel);
+        } else {
+          reviewObserver.disconnect();
+          reviewSentinel.remove();
+        }
+      },
+      complete: function () {
+        loadingReviews = false;
+      },
+    });
+  });
+  reviewObserver.observe(reviewSentinel);
+}
+
 let stripe;
 let elements;
 let emailAddress = "";